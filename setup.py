@@ -29,7 +29,6 @@ setup(
         'numpy >=1.19.1',
         'opencv-contrib-python-headless>=4.3.0.36',
         'PySide2>=5.15.0',
-        'qimage2ndarray>=1.8.3',
         'shiboken2>=5.15.0',
     ],
     license='MIT',
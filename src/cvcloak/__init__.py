@@ -1,4 +1,7 @@
-from .mainwindow import run
+def run(argv=None):
+    # Imported lazily so the headless tools never load PySide2
+    from .cli import run as _run
+    return _run(argv)
 
 
 __all__ = ['run']
@@ -0,0 +1,57 @@
+import sys
+import time
+from functools import partial
+
+
+from PySide2 import QtWidgets, QtGui
+
+
+from .conf import APP
+
+
+def report_startup(stage, start_time):
+    if not APP.STARTUP_REPORT:
+        return
+
+    elapsed = (time.perf_counter() - start_time) * 1000.0
+    sys.stderr.write(f'startup {stage} {elapsed:.1f}ms\n')
+    sys.stderr.flush()
+
+
+def run_app(args, qt_argv=None, start_time=None):
+    if start_time is None:
+        start_time = time.perf_counter()
+
+    app = QtWidgets.QApplication(sys.argv[:1] + (qt_argv or []))
+
+    # The splash is painted before cv2, numpy and the sources are loaded,
+    # the cameras then open on their stream threads
+    splash = QtWidgets.QSplashScreen(QtGui.QPixmap(APP.SPLASH_SCREEN_PATH))
+    splash.show()
+    app.processEvents()
+    report_startup('splash', start_time)
+
+    from .mainwindow import MainWindow
+    from . import cli
+
+    try:
+        profile = cli.load_profile(args.profile)
+    except ValueError as error:
+        sys.stderr.write(f'{error}\n')
+        return 1
+
+    stream_sources, outputs = cli.create_sources(args)
+    mw = MainWindow(
+        sources=stream_sources,
+        outputs=outputs,
+        target_fps=args.target_fps,
+        profile=profile,
+    )
+    mw.FIRST_FRAME_SIGNAL.connect(
+        partial(report_startup, 'first_frame', start_time),
+    )
+    mw.show()
+    splash.finish(mw)
+    report_startup('window', start_time)
+
+    sys.exit(app.exec_())
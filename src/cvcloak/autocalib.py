@@ -0,0 +1,195 @@
+import cv2
+import numpy as np
+
+
+from .conf import APP
+from . import calib
+
+
+HUE_BINS = 180  # opencv hue, two degrees per bin
+CHANNEL_BINS = 256
+
+
+def region_slices(region, shape):
+    # `region` is `(x, y, width, height)` in fractions of the frame
+    height, width = shape[:2]
+    x, y, region_width, region_height = region
+    if not (
+            0.0 <= x < 1.0 and 0.0 <= y < 1.0
+            and 0.0 < region_width <= 1.0 - x
+            and 0.0 < region_height <= 1.0 - y
+    ):
+        error_msg = f'Region {region!r} is not inside the frame'
+        raise ValueError(error_msg)
+
+    left = int(x * width)
+    top = int(y * height)
+    right = max(left + 1, int((x + region_width) * width))
+    bottom = max(top + 1, int((y + region_height) * height))
+
+    return slice(top, bottom), slice(left, right)
+
+
+def hue_arc(hue_hist, coverage):
+    # The narrowest arc of the hue circle that holds `coverage` of the
+    # samples, as its first bin and its length in bins. The histogram is
+    # laid out twice so arcs across red need no special case, and every
+    # start bin finds its end with one vectorized search
+    hue_hist = np.asarray(hue_hist, np.float64)
+    cumulative = np.concatenate(([0.0], np.cumsum(np.tile(hue_hist, 2))))
+    target = coverage * hue_hist.sum()
+
+    starts = np.arange(HUE_BINS)
+    ends = np.searchsorted(
+        cumulative, cumulative[starts] + target - 1e-6, side='left',
+    )
+    lengths = np.minimum(ends - starts, HUE_BINS)
+
+    # Among the narrowest arcs the one with the most samples wins
+    narrowest = np.flatnonzero(lengths == lengths.min())
+    masses = cumulative[narrowest + lengths.min()] - cumulative[narrowest]
+    start = int(narrowest[np.argmax(masses)])
+
+    return start, int(max(1, lengths[start]))
+
+
+def lower_bound(channel_hist, coverage, margin, floor):
+    # Lowest saturation or value kept, `coverage` of the samples lie above
+    # it before the margin is taken off
+    cumulative = np.cumsum(channel_hist)
+    low = int(np.searchsorted(cumulative, (1.0 - coverage) * cumulative[-1]))
+    return max(floor, low - margin)
+
+
+def _degrees(hue_bin):
+    return 2 * hue_bin
+
+
+class AutoCalibrator:
+    # Builds hue against saturation and hue against value histograms of a
+    # region over a few frames, the bands are derived from their sum. All
+    # the work per frame is one conversion and two `calcHist` calls
+    def __init__(
+            self, region=APP.AUTO_CALIB_REGION,
+            frame_count=APP.AUTO_CALIB_FRAMES,
+            coverage=APP.AUTO_CALIB_COVERAGE,
+            min_saturation=APP.AUTO_CALIB_MIN_SATURATION,
+            min_value=APP.AUTO_CALIB_MIN_VALUE,
+            margin=APP.AUTO_CALIB_MARGIN,
+            max_hue_span=APP.AUTO_CALIB_MAX_HUE_SPAN,
+            min_colored=APP.AUTO_CALIB_MIN_COLORED,
+    ):
+        if frame_count < 1:
+            error_msg = f'Frame count should be at least 1, got {frame_count}'
+            raise ValueError(error_msg)
+
+        if not 0.0 < coverage <= 1.0:
+            error_msg = f'Coverage should be in (0, 1], got {coverage}'
+            raise ValueError(error_msg)
+
+        region_slices(region, (1, 1))
+
+        self._region = tuple(region)
+        self._frame_count = frame_count
+        self._coverage = coverage
+        self._min_saturation = min_saturation
+        self._min_value = min_value
+        self._margin = margin
+        self._max_hue_span = max_hue_span
+        self._min_colored = min_colored
+
+        # Pixels too grey or too dark to have a reliable hue are left out
+        self._low_color = np.array([0, min_saturation, min_value], np.uint8)
+        self._high_color = np.array([HUE_BINS - 1, 255, 255], np.uint8)
+
+        self._hs_hist = np.zeros((HUE_BINS, CHANNEL_BINS), np.float32)
+        self._hv_hist = np.zeros((HUE_BINS, CHANNEL_BINS), np.float32)
+        self._frames = 0
+        self._pixels = 0
+
+    @property
+    def region(self):
+        return self._region
+
+    @property
+    def frames(self):
+        return self._frames
+
+    @property
+    def done(self):
+        return self._frames >= self._frame_count
+
+    def add(self, frame):
+        rows, columns = region_slices(self._region, frame.shape)
+        hsv = cv2.cvtColor(frame[rows, columns], cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, self._low_color, self._high_color)
+
+        cv2.calcHist(
+            [hsv], [0, 1], mask, [HUE_BINS, CHANNEL_BINS],
+            [0, HUE_BINS, 0, CHANNEL_BINS],
+            hist=self._hs_hist, accumulate=True,
+        )
+        cv2.calcHist(
+            [hsv], [0, 2], mask, [HUE_BINS, CHANNEL_BINS],
+            [0, HUE_BINS, 0, CHANNEL_BINS],
+            hist=self._hv_hist, accumulate=True,
+        )
+
+        self._frames += 1
+        self._pixels += hsv.shape[0] * hsv.shape[1]
+
+    def calibration(self):
+        hue_hist = self._hs_hist.sum(axis=1)
+        samples = hue_hist.sum()
+        if not self._frames or samples < self._min_colored * self._pixels:
+            error_msg = (
+                'Not enough color in the region, hold the cloak inside it'
+            )
+            raise ValueError(error_msg)
+
+        start, length = hue_arc(hue_hist, self._coverage)
+        if _degrees(length) > self._max_hue_span:
+            error_msg = (
+                f'No dominant color in the region, its hues span '
+                f'{_degrees(length)} degrees'
+            )
+            raise ValueError(error_msg)
+
+        # Saturation and value only of the pixels inside the hue arc
+        arc_bins = (start + np.arange(length)) % HUE_BINS
+        low_saturation = lower_bound(
+            self._hs_hist[arc_bins].sum(axis=0),
+            self._coverage, self._margin, self._min_saturation,
+        )
+        low_value = lower_bound(
+            self._hv_hist[arc_bins].sum(axis=0),
+            self._coverage, self._margin, self._min_value,
+        )
+
+        # Like the master hue, band 1 runs up from the center and band 2
+        # up to it. An arc across red is split at red instead, band 1
+        # from 0 and band 2 up to 359
+        last = start + length - 1
+        center = (start + (length - 1) // 2) % HUE_BINS
+        if last >= HUE_BINS:
+            band_1 = (0, last - HUE_BINS)
+            band_2 = (start, HUE_BINS - 1)
+        else:
+            band_1 = (center, last)
+            band_2 = (start, center)
+
+        colors = []
+        for low_bin, high_bin in (band_1, band_2):
+            colors.append((_degrees(low_bin), low_saturation, low_value))
+            colors.append((_degrees(high_bin) + 1, 255, 255))
+
+        return calib.Calibration(colors, _degrees(center))
+
+
+def auto_calibrate(frames, **options):
+    # One go over frames already at hand, see `AutoCalibrator`
+    calibrator = AutoCalibrator(frame_count=len(frames), **options)
+    for frame in frames:
+        calibrator.add(frame)
+
+    return calibrator.calibration()
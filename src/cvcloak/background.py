@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+
+
+def median_frame(frames):
+    # `np.partition` keeps uint8, `np.median` would go through float64
+    frames = np.stack(frames)
+    middle = len(frames) // 2
+    return np.partition(frames, middle, axis=0)[middle]
+
+
+class BackgroundModel:
+    def __init__(self, learning_rate=0.02, update_interval=1):
+        self._learning_rate = learning_rate
+        self._update_interval = max(1, update_interval)
+
+        self._frame_index = 0
+        self._accumulator = None
+        self._update_mask = None
+        self._background = None
+
+    @property
+    def background(self):
+        return self._background
+
+    @property
+    def learning_rate(self):
+        return self._learning_rate
+
+    @learning_rate.setter
+    def learning_rate(self, learning_rate):
+        self._learning_rate = learning_rate
+
+    def initialize(self, frames):
+        if not len(frames):
+            error_msg = 'Unable to initialize the background!'
+            raise RuntimeError(error_msg)
+
+        # The running average is kept in BGR, averaging hue directly
+        # would break around the red wrap-around
+        background = median_frame(frames)
+        height, width = background.shape[:2]
+
+        self._accumulator = background.astype(np.float32)
+        self._update_mask = np.empty((height, width), np.uint8)
+        self._background = background
+        self._frame_index = 0
+
+        return self._background
+
+    def update(self, frame, mask):
+        if self._background is None or self._learning_rate <= 0:
+            return
+
+        self._frame_index += 1
+        if self._frame_index % self._update_interval:
+            return
+
+        # Only pixels outside the cloak mask are learnt, the cloak itself
+        # must never bleed into the background
+        cv2.bitwise_not(mask, dst=self._update_mask)
+        cv2.accumulateWeighted(
+            frame,
+            self._accumulator,
+            self._learning_rate,
+            mask=self._update_mask,
+        )
+
+        # Written in place so a processor holding `background` sees it
+        cv2.convertScaleAbs(self._accumulator, dst=self._background)
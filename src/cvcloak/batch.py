@@ -0,0 +1,518 @@
+import os
+import sys
+import time
+import argparse
+import collections
+import concurrent.futures
+from multiprocessing import shared_memory
+
+
+import cv2
+import numpy as np
+
+
+from .conf import APP
+from .background import median_frame
+from .calib import rescale_color_for_cv
+from . import opencv
+from . import sources
+from . import sinks
+
+
+# Per process state of the parallel render workers
+_WORKER_STATE = {}
+
+
+def open_input(input_path, fps=None):
+    # Any source spec works as input, a recorded session is read as fast
+    # as possible rather than at its original pace
+    source = sources.create_source(
+        input_path,
+        fps=fps or APP.BATCH_DEFAULT_FPS,
+    )
+    if not source.open():
+        error_msg = f'Unable to open input "{input_path}"'
+        raise RuntimeError(error_msg)
+
+    return source
+
+
+def read_background_plate(input_path, frame_count, flip=False):
+    # The plate is the per-pixel median of the first frames of the clip
+    capture = open_input(input_path)
+    frames = []
+    try:
+        while len(frames) < frame_count:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            frames.append(frame)
+    finally:
+        capture.release()
+
+    if not frames:
+        error_msg = f'No frames to build the background from "{input_path}"'
+        raise RuntimeError(error_msg)
+
+    background = median_frame(frames)
+    if flip:
+        background = cv2.flip(background, 1)
+
+    return background
+
+
+def read_background_image(image_path, flip=False):
+    background = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if background is None:
+        error_msg = f'Unable to read background image "{image_path}"'
+        raise RuntimeError(error_msg)
+
+    if flip:
+        background = cv2.flip(background, 1)
+
+    return background
+
+
+def open_output(output_path, fourcc, fps, shape):
+    # Frames are encoded on the sink thread while the next ones render,
+    # blocking keeps every frame of the clip
+    height, width = shape[:2]
+    return sinks.create_sink(
+        output_path,
+        fps=fps,
+        fourcc=fourcc,
+        frame_size=(width, height),
+        maxsize=APP.SINK_QUEUE_SIZE,
+        policy=sinks.SINK_POLICY.BLOCK,
+    )
+
+
+def process_clip(
+        input_path, output_path, background, bands,
+        fourcc='mp4v', fps=None, flip=False, processor_options=None,
+):
+    capture = open_input(input_path, fps=fps)
+    fps = fps or capture.get(cv2.CAP_PROP_FPS) or APP.BATCH_DEFAULT_FPS
+
+    # Frames are composited in BGR, which is what the sinks take
+    processor = opencv.CloakProcessor(
+        background=background,
+        output_code=None,
+        **(processor_options or {}),
+    )
+    processor.set_bands(*bands)
+    reader = opencv.FrameReader(capture, flip=flip)
+
+    try:
+        sink = open_output(output_path, fourcc, fps, background.shape)
+    except RuntimeError:
+        capture.release()
+        raise
+
+    # Frames are streamed one at a time through reused buffers so memory
+    # stays flat regardless of the clip length
+    frame_count = 0
+    start_time = time.perf_counter()
+    try:
+        while True:
+            frame = reader.read()
+            if frame is None:
+                break
+            sink.write(processor.process(frame, in_place=True))
+            frame_count += 1
+    finally:
+        # Queued frames are flushed before the clock stops
+        try:
+            sink.close()
+        finally:
+            elapsed = time.perf_counter() - start_time
+            capture.release()
+
+    return frame_count, elapsed
+
+
+def process_clip_parallel(
+        input_path, output_path, background, bands, workers,
+        fourcc='mp4v', fps=None, flip=False, processor_options=None,
+):
+    # Workers see interleaved frames, a mask averaged over time needs
+    # every frame in order
+    if (processor_options or {}).get('temporal_frames', 0) > 1:
+        error_msg = 'Temporal mask averaging needs a single worker'
+        raise ValueError(error_msg)
+
+    capture = open_input(input_path, fps=fps)
+    fps = fps or capture.get(cv2.CAP_PROP_FPS) or APP.BATCH_DEFAULT_FPS
+
+    try:
+        sink = open_output(output_path, fourcc, fps, background.shape)
+    except RuntimeError:
+        capture.release()
+        raise
+
+    # Frames are decoded into slots of shared memory and composited in
+    # place, the pool only ever receives slot indices so no pixels are
+    # pickled. A task covers a chunk of consecutive slots, which spreads
+    # its round trip over several frames. Decoding stays on this process
+    # and encoding on the sink thread, only the compositing runs on the
+    # workers
+    chunk_frames = APP.BATCH_CHUNK_FRAMES
+    chunk_count = workers * APP.BATCH_CHUNKS_PER_WORKER
+    slot_count = chunk_count * chunk_frames
+    shared_frames = shared_memory.SharedMemory(
+        create=True,
+        size=slot_count * background.nbytes,
+    )
+    frames = _slot_views(shared_frames, background.shape, slot_count)
+
+    frame_count = 0
+    start_time = time.perf_counter()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(
+                    shared_frames.name, background.shape, slot_count,
+                    background, bands, processor_options or {}, flip,
+                ),
+        ) as executor:
+            free_chunks = collections.deque(range(chunk_count))
+            pending = collections.deque()
+            exhausted = False
+
+            while True:
+                while free_chunks and not exhausted:
+                    chunk_index = free_chunks.popleft()
+                    first_slot = chunk_index * chunk_frames
+                    read_count = 0
+                    while read_count < chunk_frames:
+                        if not _read_into(
+                                capture, frames[first_slot + read_count],
+                        ):
+                            exhausted = True
+                            break
+                        read_count += 1
+
+                    if not read_count:
+                        free_chunks.append(chunk_index)
+                        break
+                    pending.append(
+                        executor.submit(
+                            _process_slots, first_slot, read_count,
+                        )
+                    )
+
+                if not pending:
+                    break
+
+                # Futures are collected in submission order, which keeps
+                # the output in frame order
+                first_slot, read_count = pending.popleft().result()
+                for frame in frames[first_slot:first_slot + read_count]:
+                    sink.write(frame)
+                free_chunks.append(first_slot // chunk_frames)
+                frame_count += read_count
+    finally:
+        # Queued frames are flushed before the clock stops
+        try:
+            sink.close()
+        finally:
+            elapsed = time.perf_counter() - start_time
+            capture.release()
+
+        # Views must go before the shared memory can be closed
+        del frames
+        shared_frames.close()
+        shared_frames.unlink()
+
+    return frame_count, elapsed
+
+
+def _slot_views(shared_frames, shape, slot_count):
+    return np.ndarray(
+        (slot_count,) + tuple(shape),
+        dtype=np.uint8,
+        buffer=shared_frames.buf,
+    )
+
+
+def _read_into(capture, slot):
+    ret, frame = capture.read(slot)
+    if not ret:
+        return False
+
+    if frame.shape != slot.shape:
+        error_msg = (
+            f'Frame shape {frame.shape} does not match '
+            f'background shape {slot.shape}'
+        )
+        raise ValueError(error_msg)
+
+    if frame is not slot:
+        np.copyto(slot, frame)
+
+    return True
+
+
+def _init_worker(
+        shared_frames_name, shape, slot_count,
+        background, bands, processor_options, flip,
+):
+    shared_frames = shared_memory.SharedMemory(name=shared_frames_name)
+    frames = _slot_views(shared_frames, shape, slot_count)
+
+    processor = opencv.CloakProcessor(
+        background=background,
+        output_code=None,
+        **processor_options,
+    )
+    processor.set_bands(*bands)
+
+    _WORKER_STATE.update(
+        shared_frames=shared_frames,
+        frames=frames,
+        processor=processor,
+        flip=flip,
+        flipped=None,
+    )
+
+
+def _process_slots(first_slot, read_count):
+    # The composite goes back into the slot the frame came from
+    state = _WORKER_STATE
+    for frame in state['frames'][first_slot:first_slot + read_count]:
+        source = frame
+        if state['flip']:
+            source = state['flipped'] = cv2.flip(
+                frame, 1, dst=state['flipped'],
+            )
+
+        state['processor'].process(source, out=frame, in_place=True)
+
+    return first_slot, read_count
+
+
+def _parse_color(value):
+    color = tuple(int(component) for component in value.split(','))
+    if len(color) != 3:
+        error_msg = f'Color should be "h,s,v", got "{value}"'
+        raise argparse.ArgumentTypeError(error_msg)
+
+    return color
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        prog='cvcloak-batch',
+        description='Cloak a recorded video or image sequence offline.',
+    )
+    parser.add_argument(
+        'input',
+        help='Input video file, directory of frames or recorded session',
+    )
+    parser.add_argument(
+        'output',
+        help=(
+            'Output video file, directory of frames or `-` for raw BGR '
+            'frames on stdout'
+        ),
+    )
+
+    background_group = parser.add_mutually_exclusive_group()
+    background_group.add_argument(
+        '--background',
+        help='Background plate image',
+    )
+    background_group.add_argument(
+        '--background-frames',
+        type=int,
+        default=APP.BATCH_BACKGROUND_FRAMES,
+        help=(
+            'Build the background from the first N frames of the input '
+            '(default: %(default)s)'
+        ),
+    )
+
+    for band_name, low_color, high_color in (
+            ('band-1', APP.DEFAULT_BAND_1_LOW_COLOR,
+             APP.DEFAULT_BAND_1_HIGH_COLOR),
+            ('band-2', APP.DEFAULT_BAND_2_LOW_COLOR,
+             APP.DEFAULT_BAND_2_HIGH_COLOR),
+    ):
+        for range_name, color in (('low', low_color), ('high', high_color)):
+            parser.add_argument(
+                f'--{band_name}-{range_name}',
+                type=_parse_color,
+                default=color,
+                metavar='H,S,V',
+                help=(
+                    f'{range_name.capitalize()} color of {band_name}, hue '
+                    'in degrees (default: %(default)s)'
+                ),
+            )
+
+    parser.add_argument(
+        '--mask-mode',
+        choices=[mask_mode.name for mask_mode in opencv.MASK_MODE],
+        default=APP.MASK_MODE,
+        help='Mask generation mode (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--morph-strategy',
+        choices=[strategy.name for strategy in opencv.MORPH_STRATEGY],
+        default=APP.MORPH_STRATEGY,
+        help='Morphology implementation (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--mask-scale',
+        type=float,
+        default=APP.MASK_SCALE,
+        help=(
+            'Compute the mask at this fraction of the frame size '
+            '(default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--open-iterations',
+        type=int,
+        default=APP.MORPH_OPEN_ITERATIONS,
+        help='Noise filter strength in 3x3 passes (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--temporal-frames',
+        type=int,
+        default=APP.MASK_TEMPORAL_FRAMES,
+        help=(
+            'Average the mask over this many frames, needs a single '
+            'worker (default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--feather',
+        type=int,
+        default=APP.COMPOSITE_FEATHER,
+        help=(
+            'Soften the cloak edge over this many pixels '
+            '(default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--roi',
+        action='store_true',
+        default=APP.MASK_ROI,
+        help=(
+            'Filter and composite only the regions of the frame that can '
+            'hold the cloak (default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--no-roi',
+        action='store_false',
+        dest='roi',
+        help='Filter and composite the whole frame',
+    )
+    parser.add_argument(
+        '--fourcc',
+        default='mp4v',
+        help='Output codec (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--fps',
+        type=float,
+        help='Output frame rate, defaults to the input frame rate',
+    )
+    parser.add_argument(
+        '--flip',
+        action='store_true',
+        help='Mirror the frames as the live camera view does',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=APP.BATCH_WORKERS,
+        help=(
+            'Number of render processes, `0` uses every core '
+            '(default: %(default)s)'
+        ),
+    )
+
+    return parser
+
+
+def main(argv=None):
+    args = _create_parser().parse_args(argv)
+
+    # A missing input, an unreadable background or bad bands end with a
+    # message rather than a traceback
+    try:
+        return render(args)
+    except (RuntimeError, ValueError, OSError, cv2.error) as error:
+        sys.stderr.write(f'{error}\n')
+        return 1
+
+
+def render(args):
+    if args.background is not None:
+        background = read_background_image(args.background, flip=args.flip)
+    else:
+        background = read_background_plate(
+            args.input,
+            frame_count=args.background_frames,
+            flip=args.flip,
+        )
+
+    bands = (
+        rescale_color_for_cv(args.band_1_low),
+        rescale_color_for_cv(args.band_1_high),
+        rescale_color_for_cv(args.band_2_low),
+        rescale_color_for_cv(args.band_2_high),
+    )
+
+    clip_kwargs = {
+        'input_path': args.input,
+        'output_path': args.output,
+        'background': background,
+        'bands': bands,
+        'fourcc': args.fourcc,
+        'fps': args.fps,
+        'flip': args.flip,
+        'processor_options': {
+            'mask_mode': opencv.MASK_MODE[args.mask_mode],
+            'mask_scale': args.mask_scale,
+            'mask_refine': APP.MASK_REFINE,
+            'open_iterations': args.open_iterations,
+            'dilate_iterations': APP.MORPH_DILATE_ITERATIONS,
+            'morph_strategy': opencv.MORPH_STRATEGY[args.morph_strategy],
+            'feather': args.feather,
+            'temporal_frames': args.temporal_frames,
+            'roi': args.roi,
+        },
+    }
+
+    # Checked up front, a render worker failing on them would only
+    # report a broken pool
+    opencv.CloakProcessor(**clip_kwargs['processor_options'])
+
+    workers = args.workers or os.cpu_count()
+    if workers > 1 and args.temporal_frames > 1:
+        sys.stderr.write(
+            'Temporal mask averaging renders on a single worker\n'
+        )
+        workers = 1
+
+    if workers > 1:
+        frame_count, elapsed = process_clip_parallel(
+            workers=workers,
+            **clip_kwargs,
+        )
+    else:
+        frame_count, elapsed = process_clip(**clip_kwargs)
+
+    # Raw frames own stdout when piping
+    report = sys.stderr if args.output == sinks.PIPE_SPEC else sys.stdout
+    fps = frame_count / elapsed if elapsed else 0.0
+    report.write(
+        f'Processed {frame_count} frames in {elapsed:.2f}s ({fps:.1f} fps)\n'
+    )
+
+    return 0
@@ -0,0 +1,143 @@
+from .conf import APP
+
+
+DEFAULT_HUE = 359
+HUE_SPAN = 20
+BAND_COLOR_COUNT = 4
+BAND_NAMES = ('band_1_low', 'band_1_high', 'band_2_low', 'band_2_high')
+
+
+def default_colors():
+    return (
+        APP.DEFAULT_BAND_1_LOW_COLOR,
+        APP.DEFAULT_BAND_1_HIGH_COLOR,
+        APP.DEFAULT_BAND_2_LOW_COLOR,
+        APP.DEFAULT_BAND_2_HIGH_COLOR,
+    )
+
+
+def rescale_color_for_cv(color):
+    # Hue runs from 0 to 359 in the calibration and from 0 to 179 in opencv
+    h, s, v = color
+    return int(h / 2), s, v
+
+
+def bands_from_colors(colors):
+    return tuple(rescale_color_for_cv(color) for color in colors)
+
+
+def hue_ranges(hue):
+    # The master hue spans two bands, `hue` to `hue + 20` and
+    # `hue - 20` to `hue`, wrapping around at red
+    parse_hue(hue)
+
+    if hue == 359 or hue == 0:
+        h2 = 359
+        l2 = 359 - HUE_SPAN
+        h1 = HUE_SPAN
+        l1 = 0
+    elif hue <= HUE_SPAN:
+        h2 = hue
+        l2 = 359 - HUE_SPAN + hue
+        h1 = hue + HUE_SPAN
+        l1 = hue
+    elif hue >= 359 - HUE_SPAN:
+        h2 = hue
+        l2 = hue - HUE_SPAN
+        h1 = hue - (359 - HUE_SPAN)
+        l1 = hue
+    else:
+        h2 = hue
+        l2 = hue - HUE_SPAN
+        h1 = hue + HUE_SPAN
+        l1 = hue
+
+    return l1, h1, l2, h2
+
+
+def apply_hue(colors, hue):
+    # Moves the hue of every band color, saturation and value are kept
+    hues = hue_ranges(hue)
+    return tuple(
+        (h, s, v) for h, (_, s, v) in zip(hues, colors)
+    )
+
+
+def parse_color(value):
+    # A color is three numbers, hue in degrees then saturation and value
+    try:
+        h, s, v = (int(component) for component in value)
+    except (TypeError, ValueError):
+        error_msg = f'Color should be [h, s, v], got {value!r}'
+        raise ValueError(error_msg)
+
+    if not (0 <= h <= 359 and 0 <= s <= 255 and 0 <= v <= 255):
+        error_msg = f'Color {value!r} is out of range'
+        raise ValueError(error_msg)
+
+    return h, s, v
+
+
+def parse_hue(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        error_msg = f'Hue should be an integer, got {value!r}'
+        raise ValueError(error_msg)
+
+    if not 0 <= value <= 359:
+        error_msg = f'Hue should be between 0 and 359, got {value}'
+        raise ValueError(error_msg)
+
+    return value
+
+
+class Calibration:
+    # An immutable snapshot of the band colors and the master hue. Every
+    # change makes a new snapshot, so a reader on another thread never
+    # sees half an update, and the opencv bands are derived only once
+    def __init__(self, colors=None, hue=DEFAULT_HUE):
+        if colors is None:
+            colors = default_colors()
+
+        colors = tuple(parse_color(color) for color in colors)
+        if len(colors) != BAND_COLOR_COUNT:
+            error_msg = (
+                f'Calibration needs {BAND_COLOR_COUNT} colors, '
+                f'got {len(colors)}'
+            )
+            raise ValueError(error_msg)
+
+        self._colors = colors
+        self._hue = parse_hue(hue)
+        self._bands = bands_from_colors(colors)
+
+    @property
+    def colors(self):
+        return self._colors
+
+    @property
+    def hue(self):
+        return self._hue
+
+    @property
+    def bands(self):
+        # Low and high colors of both bands in opencv's HSV ranges
+        return self._bands
+
+    def with_hue(self, hue):
+        return Calibration(apply_hue(self._colors, hue), hue)
+
+    def with_color(self, index, color):
+        colors = list(self._colors)
+        colors[index] = color
+        return Calibration(colors, self._hue)
+
+    def __eq__(self, other):
+        if not isinstance(other, Calibration):
+            return NotImplemented
+        return (self._colors, self._hue) == (other._colors, other._hue)
+
+    def __hash__(self):
+        return hash((self._colors, self._hue))
+
+    def __repr__(self):
+        return f'Calibration(colors={self._colors!r}, hue={self._hue})'
@@ -0,0 +1,208 @@
+import os
+import time
+import argparse
+
+
+from .conf import APP
+from .perf import PerfRecorder
+
+
+def stream_options(target_fps=None, **processor_options):
+    # Options of every stream of the app, `processor_options` override
+    # the configured processor settings. cv2 and numpy are imported by
+    # the first command that needs them, not by `--help` or the splash
+    from . import opencv
+
+    options = {
+        'mask_mode': opencv.MASK_MODE[APP.MASK_MODE],
+        'mask_scale': APP.MASK_SCALE,
+        'mask_refine': APP.MASK_REFINE,
+        'open_iterations': APP.MORPH_OPEN_ITERATIONS,
+        'dilate_iterations': APP.MORPH_DILATE_ITERATIONS,
+        'morph_strategy': opencv.MORPH_STRATEGY[APP.MORPH_STRATEGY],
+        'feather': APP.COMPOSITE_FEATHER,
+        'temporal_frames': APP.MASK_TEMPORAL_FRAMES,
+        'roi': APP.MASK_ROI,
+    }
+    options.update(processor_options)
+
+    return {
+        'background_delay': APP.BACKGROUND_DELAY_MSEC / 1000.0,
+        'queue_size': APP.FRAME_QUEUE_SIZE,
+        'processor_options': options,
+        'recorder': PerfRecorder(
+            size=APP.PERF_RING_SIZE,
+            enabled=APP.PERF_ENABLED,
+        ),
+        'background_frames': APP.BACKGROUND_FRAME_COUNT,
+        'background_learning_rate': APP.BACKGROUND_LEARNING_RATE,
+        'background_update_interval': APP.BACKGROUND_UPDATE_INTERVAL,
+        'read_timeout': APP.CAMERA_READ_TIMEOUT_MSEC / 1000.0,
+        'target_fps': APP.TARGET_FPS if target_fps is None else target_fps,
+    }
+
+
+def load_profile(spec=None):
+    # `spec` is the name of a saved profile or the path of a profile
+    # file, without it the default profile is used once it was saved
+    from . import profiles
+
+    if spec is None:
+        if APP.DEFAULT_PROFILE not in profiles.list_profiles():
+            return None
+        spec = APP.DEFAULT_PROFILE
+
+    if spec.endswith(profiles.PROFILE_EXT) or os.path.isfile(spec):
+        return profiles.read_profile(spec)
+
+    return profiles.load_profile(spec)
+
+
+def create_sink(spec, color_code=None):
+    from . import sinks
+
+    return sinks.create_sink(
+        spec,
+        fps=APP.BATCH_DEFAULT_FPS,
+        maxsize=APP.SINK_QUEUE_SIZE,
+        policy=sinks.SINK_POLICY[APP.SINK_POLICY],
+        color_code=color_code,
+    )
+
+
+def create_sources(args):
+    # One source and output per `--source`, recordings and outputs are
+    # numbered when there are several
+    from . import sources
+    from . import sinks
+
+    stream_sources = []
+    outputs = []
+    for index, spec in enumerate(args.source):
+        source = sources.create_source(
+            spec,
+            loop=args.loop,
+            realtime=not args.fast,
+        )
+        if args.record is not None:
+            session_path = args.record
+            if len(args.source) > 1:
+                root, ext = os.path.splitext(args.record)
+                session_path = f'{root}_{index}{ext}'
+            source = sources.RecordingSource(source, session_path)
+        stream_sources.append(source)
+
+        # Only the first stream can go to stdout
+        output = args.output
+        if output == sinks.PIPE_SPEC:
+            output = None if index else output
+        elif output is not None and len(args.source) > 1:
+            root, ext = os.path.splitext(output)
+            output = f'{root}_{index}{ext}'
+        outputs.append(output)
+
+    return stream_sources, outputs
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        prog='cvcloak',
+        description='Invisibility cloak from a live camera.',
+    )
+    parser.add_argument(
+        '--source',
+        nargs='+',
+        default=[str(APP.CAMERA_DEVICE_INT)],
+        help=(
+            'Camera indices, video files, directories of frames or '
+            'recorded sessions, one stream each (default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--fast',
+        action='store_true',
+        help='Replay files as fast as possible instead of in real time',
+    )
+    parser.add_argument(
+        '--loop',
+        action='store_true',
+        help='Restart file sources when they run out of frames',
+    )
+    parser.add_argument(
+        '--target-fps',
+        type=float,
+        default=APP.TARGET_FPS,
+        help=(
+            'Process at most this many frames a second, live sources skip '
+            'the frames in between (default: %(default)s, every frame)'
+        ),
+    )
+    parser.add_argument(
+        '--profile',
+        help=(
+            'Calibration profile to start with, the name of a saved '
+            f'profile or a profile `.json` (default: `{APP.DEFAULT_PROFILE}` '
+            'once it was saved)'
+        ),
+    )
+    parser.add_argument(
+        '--output',
+        help=(
+            'Write the cloaked frames to a video file, a directory of '
+            'frames or `-` for raw frames on stdout, numbered per stream '
+            'when there are several'
+        ),
+    )
+    parser.add_argument(
+        '--record',
+        metavar='SESSION',
+        help=(
+            'Record the source frames to a replayable session `.json`, '
+            'numbered per stream when there are several'
+        ),
+    )
+
+    serve_group = parser.add_argument_group(
+        'serve',
+        'Run without a window and stream to a browser instead',
+    )
+    serve_group.add_argument(
+        '--serve',
+        action='store_true',
+        help='Serve an MJPEG stream and a JSON control endpoint over HTTP',
+    )
+    serve_group.add_argument(
+        '--host',
+        default=APP.SERVE_HOST,
+        help='Address to serve on (default: %(default)s)',
+    )
+    serve_group.add_argument(
+        '--port',
+        type=int,
+        default=APP.SERVE_PORT,
+        help='Port to serve on (default: %(default)s)',
+    )
+
+    return parser
+
+
+def run(argv=None):
+    # Unknown arguments are left for Qt
+    start_time = time.perf_counter()
+    parser = _create_parser()
+    args, qt_argv = parser.parse_known_args(argv)
+    if args.target_fps < 0:
+        parser.error('--target-fps should not be negative')
+
+    if args.serve:
+        if qt_argv:
+            parser.error(f'unrecognized arguments: {" ".join(qt_argv)}')
+        if len(args.source) > 1:
+            parser.error('--serve takes a single --source')
+
+        # Headless, PySide2 is never imported
+        from .server import serve
+        return serve(args)
+
+    from .app import run_app
+    return run_app(args, qt_argv, start_time=start_time)
@@ -1,38 +1,122 @@
 import os
+import functools
 
 
 RESOURCE_DIR = os.path.join(os.path.dirname(__file__), 'resources')
 
 
-class STYLESHEET:
-    def _get_stylesheet(stylesheet_name):
-        stylesheet = None
-        stylesheet_file_path = os.path.join(
-            f'{RESOURCE_DIR}/css',
-            f'{stylesheet_name}.css',
+@functools.lru_cache(maxsize=None)
+def get_stylesheet(stylesheet_name):
+    # Read on first use, importing the config touches no files
+    stylesheet_file_path = os.path.join(
+        f'{RESOURCE_DIR}/css',
+        f'{stylesheet_name}.css',
+    )
+    with open(stylesheet_file_path, 'r') as f:
+        stylesheet = f.read()
+
+    return stylesheet
+
+
+class _Stylesheet:
+    # Class attribute holding the stylesheet text, read on first access.
+    # Without a name it follows the `STYLESHEET_NAME` of its class
+    def __init__(self, stylesheet_name=None):
+        self._stylesheet_name = stylesheet_name
+
+    def __get__(self, instance, owner):
+        return get_stylesheet(
+            self._stylesheet_name or owner.STYLESHEET_NAME
         )
-        with open(stylesheet_file_path, 'r') as f:
-            stylesheet = f.read()
 
-        return stylesheet
 
-    dark_01 = _get_stylesheet('dark_01')
+class STYLESHEET:
+    dark_01 = _Stylesheet('dark_01')
 
 
 class APP:
     NAME = "CVCLOAK"
-    STYLESHEET = STYLESHEET.dark_01
+    STYLESHEET_NAME = 'dark_01'  # Name of a `.css` in `resources/css`
+    STYLESHEET = _Stylesheet()  # Text of the `STYLESHEET_NAME` stylesheet
     IMAGE_WIDTH = 640
     IMAGE_HEIGHT = 480
     CAMERA_DEVICE_INT = 0  # `0` is for default camera
+    BACKGROUND_DELAY_MSEC = 3000  # Time for the camera to settle
+    CAMERA_OPEN_TIMEOUT_MSEC = 10000
+    CAMERA_RETRY_DELAY_MSEC = 100  # Doubles after every failed open
+    CAMERA_MAX_RETRY_DELAY_MSEC = 2000
+    CAMERA_READ_TIMEOUT_MSEC = 5000
+    STATUS_DISPLAY_MSEC = 2000
+    FRAME_QUEUE_SIZE = 1  # Processed frames waiting for display
+    TARGET_FPS = 0  # Processing rate cap, `0` processes every new frame
+    SESSION_WORKERS = 0  # Threads for non-live streams, `0` uses every core
+    SINK_QUEUE_SIZE = 8  # Frames waiting for an output sink to write them
+    SINK_POLICY = 'DROP_OLDEST'  # `DROP_OLDEST` or `BLOCK` when a sink is full
+    MASK_MODE = 'IN_RANGE'  # `IN_RANGE` or `LUT`, see `opencv.MASK_MODE`
+    MASK_SCALE = 1.0  # Mask is computed at this fraction of the frame size
+    MASK_REFINE = True  # Smooth the upscaled mask edges
+    MORPH_OPEN_ITERATIONS = 8  # Noise filter, in 3x3 kernel passes
+    MORPH_DILATE_ITERATIONS = 1  # Smooth filter, in 3x3 kernel passes
+    MORPH_STRATEGY = 'AUTO'  # See `opencv.MORPH_STRATEGY`
+    COMPOSITE_FEATHER = 0  # Soft cloak edge radius in pixels, `0` is hard
+    MASK_ROI = False  # Filter and composite only around the cloak
+
+    # Average the mask over this many frames, `0` is off. A stable mask
+    # needs less noise filtering, `MORPH_OPEN_ITERATIONS = 3` is plenty
+    MASK_TEMPORAL_FRAMES = 0
+
+    # Median of the first frames, then a running average of the pixels
+    # outside the cloak, `0` keeps the startup background forever
+    BACKGROUND_FRAME_COUNT = 30
+    BACKGROUND_LEARNING_RATE = 0.02
+    BACKGROUND_UPDATE_INTERVAL = 1
+
+    # Per stage timings, the overlay is toggled with the shortcut
+    PERF_ENABLED = bool(os.environ.get('CVCLOAK_PERF'))
+    PERF_CSV_PATH = os.environ.get('CVCLOAK_PERF_CSV')
+    STARTUP_REPORT = bool(os.environ.get('CVCLOAK_STARTUP'))  # To stderr
+    PERF_RING_SIZE = 300
+    PERF_OVERLAY_SHORTCUT = 'F3'
+    PERF_OVERLAY_INTERVAL_MSEC = 500
+
+    BATCH_BACKGROUND_FRAMES = 30
+    BATCH_DEFAULT_FPS = 30.0
+    BATCH_WORKERS = 1  # `0` uses every core
+    BATCH_CHUNKS_PER_WORKER = 2  # Frame chunks in flight per worker
+    BATCH_CHUNK_FRAMES = 4  # Frames a worker composites per task
+
+    # Headless `--serve` mode
+    SERVE_HOST = '127.0.0.1'  # Only this machine, `0.0.0.0` for the network
+    SERVE_PORT = 8080
+    SERVE_JPEG_QUALITY = 80
+    SERVE_SEND_BUFFER_BYTES = 65536  # Per client, a few frames at most
+    SERVE_MAX_BODY_BYTES = 65536  # Largest accepted control request
+
     BUTTON_HEIGHT = 60
     SLIDER_HEIGHT = 10
     SLIDER_WIDTH = 200
+    CALIB_UPDATE_MSEC = 0  # Slider changes batched, `0` is one screen refresh
 
     DEFAULT_BAND_1_LOW_COLOR = (0, 120, 70)
     DEFAULT_BAND_1_HIGH_COLOR = (20, 255, 255)
     DEFAULT_BAND_2_LOW_COLOR = (340, 120, 70)
     DEFAULT_BAND_2_HIGH_COLOR = (359, 255, 255)
+    PROFILE_DIR = os.environ.get(
+        'CVCLOAK_PROFILE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cvcloak', 'profiles'),
+    )
+    DEFAULT_PROFILE = 'default'  # Loaded at startup once it is saved
+
+    # Auto calibration samples the cloak held in a region of the frame
+    AUTO_CALIB_REGION = (0.35, 0.3, 0.3, 0.4)  # x, y, w, h, frame fractions
+    AUTO_CALIB_DELAY_MSEC = 2000  # Time to hold the cloak in the region
+    AUTO_CALIB_FRAMES = 10
+    AUTO_CALIB_COVERAGE = 0.95  # Fraction of the cloak pixels kept in bands
+    AUTO_CALIB_MIN_SATURATION = 50  # Greyer pixels have no reliable hue
+    AUTO_CALIB_MIN_VALUE = 40  # Darker pixels neither
+    AUTO_CALIB_MARGIN = 20  # Saturation and value slack below the samples
+    AUTO_CALIB_MAX_HUE_SPAN = 90  # Degrees, wider has no dominant color
+    AUTO_CALIB_MIN_COLORED = 0.2  # Fraction of the region with a usable hue
 
     FONT_FAMILY = 'Andale Mono'
     FONT_FILE_PATH = os.path.join(RESOURCE_DIR, f'font/{FONT_FAMILY}.ttf')
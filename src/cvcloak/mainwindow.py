@@ -1,14 +1,26 @@
-import sys
 import enum
 from functools import partial
 
 
+import cv2
 from PySide2 import QtCore, QtWidgets, QtGui
 
 
 from .conf import APP
-from .widgets import ColorBandWidget, block_widget_signals
-from . import opencv
+from .widgets import (
+    ColorBandWidget,
+    ImageViewerWidget,
+    block_widget_signals,
+    refresh_interval_msec,
+)
+from .worker import StreamSignals
+from .session import SessionManager, CAPTURE_STATE
+from .perf import PerfRecorder
+from . import autocalib
+from . import calib
+from . import cli
+from . import profiles
+from . import sources
 
 
 @enum.unique
@@ -24,18 +36,35 @@ class RANGE_TYPE(enum.Enum):
 
 
 class MainWindow(QtWidgets.QWidget):
-    def __init__(self, parent=None):
+    FIRST_FRAME_SIGNAL = QtCore.Signal()
+
+    def __init__(
+            self, sources=None, outputs=None, target_fps=None, profile=None,
+            parent=None,
+    ):
         super().__init__(parent=parent)
-        self._capture = None
-        self._background = None
+        self._sources = sources
+        self._outputs = outputs or []
+        self._target_fps = target_fps
+        self._profile = profile
+        self._session = None
+        self._signals = None
+        self._stream = None
+        self._viewer_stream = None
         self._background_captured = False
+        self._first_frame_shown = False
         self._image = None
         self._show_calib = False
+        self._show_perf = False
+        self._perf = PerfRecorder(
+            size=APP.PERF_RING_SIZE,
+            enabled=APP.PERF_ENABLED,
+        )
 
-        self._band_1_low_color = None
-        self._band_1_high_color = None
-        self._band_2_low_color = None
-        self._band_2_high_color = None
+        self._calibration = calib.Calibration()
+        if profile is not None:
+            self._calibration = profile.calibration
+        self._auto_calib_stream = None
 
         self._setup_ui()
         self._setup_camera()
@@ -79,30 +108,69 @@ class MainWindow(QtWidgets.QWidget):
 
         self._image = QtGui.QImage()
         self._image.load(APP.SPLASH_SCREEN_PATH)
-        self._image_label = QtWidgets.QLabel()
-        self._image_label.setStyleSheet(
-            'QWidget { border: 1px solid #5A5A5A; }'
+        self._image_viewer = ImageViewerWidget(recorder=self._perf)
+        self._image_viewer.set_image(self._image)
+        self._image_layout.addWidget(self._image_viewer)
+
+        self._perf_label = QtWidgets.QLabel(self._image_viewer)
+        self._perf_label.setStyleSheet(
+            'QWidget { '
+            'border: none; '
+            'color: #E0E0E0; '
+            'background-color: rgba(0, 0, 0, 160); '
+            'font-family: monospace; '
+            '}'
         )
-        self._image_label.setMinimumSize(APP.IMAGE_WIDTH, APP.IMAGE_HEIGHT)
-        self._image_label.setPixmap(QtGui.QPixmap.fromImage(self._image))
-        self._image_layout.addWidget(self._image_label)
+        self._perf_label.move(8, 8)
+        self._perf_label.setVisible(False)
+
+        self._status_label = QtWidgets.QLabel(self._image_viewer)
+        self._status_label.setStyleSheet(
+            'QWidget { '
+            'border: none; '
+            'color: #E0E0E0; '
+            'background-color: rgba(0, 0, 0, 160); '
+            '}'
+        )
+        self._status_label.move(8, APP.IMAGE_HEIGHT - 30)
+
+        self._perf_timer = QtCore.QTimer(self)
+        self._perf_timer.setInterval(APP.PERF_OVERLAY_INTERVAL_MSEC)
 
         return self._image_layout
 
     def _create_bottom_layout(self):
         self._bottom_layout = QtWidgets.QHBoxLayout()
+
+        # Only shown when the session runs more than one stream
+        self._stream_combo = QtWidgets.QComboBox()
+        self._stream_combo.setMinimumHeight(APP.BUTTON_HEIGHT)
+        self._stream_combo.setStyleSheet(
+            'QWidget { border: 1px solid #5A5A5A; }'
+        )
+        self._stream_combo.setVisible(False)
+
         self._calib_btn = QtWidgets.QPushButton("Open Calibration")
         self._calib_btn.setMinimumHeight(APP.BUTTON_HEIGHT)
         self._calib_btn.setStyleSheet(
             'QWidget { border: 1px solid #5A5A5A; }'
         )
 
+        self._background_btn = QtWidgets.QPushButton("Recapture Background")
+        self._background_btn.setMinimumHeight(APP.BUTTON_HEIGHT)
+        self._background_btn.setStyleSheet(
+            'QWidget { border: 1px solid #5A5A5A; }'
+        )
+        self._background_btn.setEnabled(False)
+
         self._close_btn = QtWidgets.QPushButton("Close")
         self._close_btn.setMinimumHeight(APP.BUTTON_HEIGHT)
         self._close_btn.setStyleSheet(
             'QWidget { border: 1px solid #5A5A5A; }'
         )
+        self._bottom_layout.addWidget(self._stream_combo)
         self._bottom_layout.addWidget(self._calib_btn)
+        self._bottom_layout.addWidget(self._background_btn)
         self._bottom_layout.addWidget(self._close_btn)
 
         return self._bottom_layout
@@ -147,18 +215,55 @@ class MainWindow(QtWidgets.QWidget):
         self._hue_slider.setValue(359)
         self._hue_slider.setSingleStep(1)
 
+        # Slider ticks only replace the calibration snapshot, the stream
+        # gets the latest one once per screen refresh
+        self._calib_timer = QtCore.QTimer(self)
+        self._calib_timer.setSingleShot(True)
+        self._calib_timer.setInterval(refresh_interval_msec())
+
+        self._profile_label = QtWidgets.QLabel('PROFILE')
+        self._profile_combo = QtWidgets.QComboBox()
+        self._profile_combo.setStyleSheet(
+            'QWidget { border: 1px solid #5A5A5A; }'
+        )
+        self._refresh_profiles()
+
         self._reset_calib_btn = QtWidgets.QPushButton("Default")
         self._reset_calib_btn.setMinimumHeight(APP.BUTTON_HEIGHT)
         self._reset_calib_btn.setStyleSheet(
             'QWidget { border: 1px solid #5A5A5A; }'
         )
 
+        self._auto_calib_btn = QtWidgets.QPushButton("Auto")
+        self._auto_calib_btn.setMinimumHeight(APP.BUTTON_HEIGHT)
+        self._auto_calib_btn.setStyleSheet(
+            'QWidget { border: 1px solid #5A5A5A; }'
+        )
+
+        # Time for the cloak to be held in the marked region
+        self._auto_calib_timer = QtCore.QTimer(self)
+        self._auto_calib_timer.setSingleShot(True)
+        self._auto_calib_timer.setInterval(APP.AUTO_CALIB_DELAY_MSEC)
+
+        self._save_profile_btn = QtWidgets.QPushButton("Save")
+        self._save_profile_btn.setMinimumHeight(APP.BUTTON_HEIGHT)
+        self._save_profile_btn.setStyleSheet(
+            'QWidget { border: 1px solid #5A5A5A; }'
+        )
+
+        self._calib_btn_layout = QtWidgets.QHBoxLayout()
+        self._calib_btn_layout.addWidget(self._reset_calib_btn)
+        self._calib_btn_layout.addWidget(self._auto_calib_btn)
+        self._calib_btn_layout.addWidget(self._save_profile_btn)
+
         self._calib_layout.addWidget(self._band_1_widget)
         self._calib_layout.addWidget(self._band_2_widget)
         self._calib_layout.addWidget(self._hue_label)
         self._calib_layout.addWidget(self._hue_gradient_label)
         self._calib_layout.addWidget(self._hue_slider)
-        self._calib_layout.addWidget(self._reset_calib_btn)
+        self._calib_layout.addWidget(self._profile_label)
+        self._calib_layout.addWidget(self._profile_combo)
+        self._calib_layout.addLayout(self._calib_btn_layout)
 
         return self._calib_widget
 
@@ -170,18 +275,11 @@ class MainWindow(QtWidgets.QWidget):
         if band_type == BAND_TYPE.FIRST:
             name = 'COLOR BAND 1'
             low_color = APP.DEFAULT_BAND_1_LOW_COLOR
-            self._band_1_low_color = self._rescale_color_for_cv(low_color)
-
             high_color = APP.DEFAULT_BAND_1_HIGH_COLOR
-            self._band_1_high_color = self._rescale_color_for_cv(high_color)
-
         elif band_type == BAND_TYPE.SECOND:
             name = 'COLOR BAND 2'
             low_color = APP.DEFAULT_BAND_2_LOW_COLOR
-            self._band_2_low_color = self._rescale_color_for_cv(low_color)
-
             high_color = APP.DEFAULT_BAND_2_HIGH_COLOR
-            self._band_2_high_color = self._rescale_color_for_cv(high_color)
 
         widget = ColorBandWidget(
             name=name,
@@ -193,41 +291,203 @@ class MainWindow(QtWidgets.QWidget):
         return widget
 
     def _reset_calib(self):
-        low_color_1 = APP.DEFAULT_BAND_1_LOW_COLOR
-        self._band_1_widget.low_color = low_color_1
-        self._band_1_low_color = self._rescale_color_for_cv(low_color_1)
+        self._set_calib(calib.Calibration())
 
-        high_color_1 = APP.DEFAULT_BAND_1_HIGH_COLOR
-        self._band_1_widget.high_color = high_color_1
-        self._band_1_high_color = self._rescale_color_for_cv(high_color_1)
+    def _set_calib(self, calibration):
+        # Applied right away, for a new stream or the defaults
+        self._calibration = calibration
+        self._update_band_widgets()
+        with block_widget_signals(self._hue_slider):
+            self._hue_slider.setValue(calibration.hue)
 
-        low_color_2 = APP.DEFAULT_BAND_2_LOW_COLOR
-        self._band_2_widget.low_color = low_color_2
-        self._band_2_low_color = self._rescale_color_for_cv(low_color_2)
+        self._calib_timer.stop()
+        self._update_stream_calibration()
 
-        high_color_2 = APP.DEFAULT_BAND_2_HIGH_COLOR
+    def _update_band_widgets(self):
+        # Band widgets restyle their swatches at most once per refresh
+        low_color_1, high_color_1, low_color_2, high_color_2 = (
+            self._calibration.colors
+        )
+        self._band_1_widget.low_color = low_color_1
+        self._band_1_widget.high_color = high_color_1
+        self._band_2_widget.low_color = low_color_2
         self._band_2_widget.high_color = high_color_2
-        self._band_2_high_color = self._rescale_color_for_cv(high_color_2)
 
-        with block_widget_signals(self._hue_slider):
-            self._hue_slider.setValue(359)
+    def _schedule_calib(self):
+        if not self._calib_timer.isActive():
+            self._calib_timer.start()
+
+    def _auto_calib(self):
+        if (
+                self._session is None
+                or self._stream.state != CAPTURE_STATE.RUNNING
+        ):
+            self._show_status('Auto calibration needs a running stream')
+            return
+
+        # The region is marked first, sampling starts once the cloak had
+        # time to be held in it
+        self._auto_calib_stream = self._stream
+        self._auto_calib_btn.setEnabled(False)
+        self._image_viewer.set_region(APP.AUTO_CALIB_REGION)
+        self._show_status('Hold the cloak inside the box')
+        self._auto_calib_timer.start()
+
+    def _start_auto_calib(self):
+        stream = self._auto_calib_stream
+        if (
+                self._session is None or stream is None
+                or stream.state != CAPTURE_STATE.RUNNING
+        ):
+            self._end_auto_calib()
+            return
+
+        self._show_status('Calibrating')
+        stream.auto_calibrate(autocalib.AutoCalibrator())
+
+    def _end_auto_calib(self):
+        # A calibration still waiting or sampling is called off
+        self._auto_calib_timer.stop()
+        if self._auto_calib_stream is not None:
+            self._auto_calib_stream.auto_calibrate(None)
+            self._auto_calib_stream = None
+        self._auto_calib_btn.setEnabled(True)
+        self._image_viewer.set_region(None)
+
+    def _auto_calibrated(self, stream, calibration, message):
+        if stream is not self._auto_calib_stream:
+            return
+
+        self._end_auto_calib()
+        self._show_status(message)
+        if calibration is None:
+            return
+
+        # Applied like any other calibration change, to the stream it
+        # was sampled from
+        if stream is self._stream:
+            self._set_calib(calibration)
+        else:
+            stream.set_calibration(calibration)
+
+    def _refresh_profiles(self, selected=None):
+        with block_widget_signals(self._profile_combo):
+            self._profile_combo.clear()
+            self._profile_combo.addItems(profiles.list_profiles())
+            self._profile_combo.setCurrentIndex(
+                self._profile_combo.findText(selected) if selected else -1
+            )
+
+    def _profile_activated(self, index):
+        name = self._profile_combo.itemText(index)
+        try:
+            profile = profiles.load_profile(name)
+        except ValueError as error:
+            self._show_status(str(error))
+            return
+
+        self._apply_profile(profile)
+
+    def _apply_profile(self, profile):
+        # One call switches the stream, the tables come with the profile
+        self._stream.set_profile(profile)
+        self._set_calib(profile.calibration)
+        self._refresh_profiles(selected=profile.name)
+
+    def _save_profile(self):
+        profile = self._stream.profile
+        name, accepted = QtWidgets.QInputDialog.getText(
+            self,
+            'Save profile',
+            'Profile name',
+            text=APP.DEFAULT_PROFILE if profile is None else profile.name,
+        )
+        if not accepted:
+            return
+
+        # The mask settings come from the stream's profile, or the
+        # defaults when it has none
+        try:
+            if profile is None:
+                profile = profiles.Profile(name, self._calibration)
+            else:
+                profile = profile.with_calibration(self._calibration, name)
+            profiles.save_profile(profile)
+        except ValueError as error:
+            self._show_status(str(error))
+            return
+        except OSError as error:
+            self._show_status(f'Unable to save profile: {error.strerror}')
+            return
+
+        self._apply_profile(profile)
 
     def _setup_camera(self):
-        self._initialize_capture()
+        if not self._sources:
+            self._sources = [sources.create_source(APP.CAMERA_DEVICE_INT)]
+
+        # Every source is a stream of the session with its own background
+        # and calibration, the window shows and calibrates one of them
+        self._session = SessionManager(workers=APP.SESSION_WORKERS)
+        self._signals = StreamSignals(self)
+        for index, source in enumerate(self._sources):
+            stream = self._add_stream(source)
+            self._signals.attach(stream)
+            if index < len(self._outputs) and self._outputs[index]:
+                stream.add_sink(self._create_sink(self._outputs[index]))
+            self._stream_combo.addItem(stream.name)
+
+            # Streams start with the startup profile or the defaults
+            if self._profile is not None:
+                stream.set_profile(self._profile)
+            else:
+                stream.set_calibration(self._calibration)
+
+        self._stream = self._session.streams[0]
+        self._stream_combo.setVisible(len(self._sources) > 1)
+        self._set_calib(self._calibration)
+        if self._profile is not None:
+            self._refresh_profiles(selected=self._profile.name)
+
+        # Capture, background and compositing all run on the session pool
+        self._session.start()
 
-        # Wait some time for capture to initialize
-        QtCore.QTimer.singleShot(3000, self._set_background)
+    def _add_stream(self, source):
+        return self._session.add_stream(
+            source,
+            **cli.stream_options(target_fps=self._target_fps),
+        )
 
-        # Now start the display
-        self._timer = QtCore.QTimer()
-        self._timer.start(30)
+    def _create_sink(self, spec):
+        # Streams put out RGB for display, the sinks write BGR
+        return cli.create_sink(spec, color_code=cv2.COLOR_RGB2BGR)
 
     def _connect_signals(self):
-        self._timer.timeout.connect(self._display_video_stream)
+        self._signals.FRAME_READY_SIGNAL.connect(self._display_video_stream)
+        self._signals.BACKGROUND_CAPTURED_SIGNAL.connect(
+            self._background_captured_changed
+        )
+        self._signals.STATE_CHANGED_SIGNAL.connect(
+            self._capture_state_changed
+        )
+        self._stream_combo.currentIndexChanged.connect(self._stream_changed)
+        self._calib_timer.timeout.connect(self._update_stream_calibration)
         self._close_btn.clicked.connect(self._close)
         self._calib_btn.clicked.connect(self._toggle_calib)
+        self._background_btn.clicked.connect(self._recapture_background)
         self._reset_calib_btn.clicked.connect(self._reset_calib)
+        self._save_profile_btn.clicked.connect(self._save_profile)
+        self._auto_calib_btn.clicked.connect(self._auto_calib)
+        self._auto_calib_timer.timeout.connect(self._start_auto_calib)
+        self._signals.CALIBRATED_SIGNAL.connect(self._auto_calibrated)
+        self._profile_combo.activated.connect(self._profile_activated)
         self._hue_slider.valueChanged.connect(self._hue_changed)
+        self._perf_timer.timeout.connect(self._update_perf_overlay)
+        self._perf_shortcut = QtWidgets.QShortcut(
+            QtGui.QKeySequence(APP.PERF_OVERLAY_SHORTCUT),
+            self,
+        )
+        self._perf_shortcut.activated.connect(self._toggle_perf_overlay)
 
         self._band_1_widget.LOW_COLOR_CHANGED_SIGNAL.connect(
             partial(
@@ -261,39 +521,123 @@ class MainWindow(QtWidgets.QWidget):
             )
         )
 
-    def _initialize_capture(self):
-        self._capture = opencv.open_capture(
-            camera_int=APP.CAMERA_DEVICE_INT,
-            width=APP.IMAGE_WIDTH,
-            height=APP.IMAGE_HEIGHT,
+    def _update_stream_calibration(self):
+        if self._stream is None:
+            return
+
+        self._stream.set_calibration(self._calibration)
+
+    def _stream_changed(self, index):
+        if self._session is None:
+            return
+
+        # The calibration panel follows the selected stream, a change
+        # still waiting for the timer goes to the stream it was made on
+        if self._calib_timer.isActive():
+            self._calib_timer.stop()
+            self._update_stream_calibration()
+
+        self._stream = self._session.streams[index]
+        self._set_calib(self._stream.calibration)
+        profile = self._stream.profile
+        self._refresh_profiles(
+            selected=None if profile is None else profile.name,
+        )
+
+        self._background_btn.setEnabled(
+            self._stream.state == CAPTURE_STATE.RUNNING
         )
+        self._show_status(self._stream.name)
+
+    def _show_status(self, message):
+        self._status_label.setText(message)
+        self._status_label.adjustSize()
+        self._status_label.setVisible(True)
+        QtCore.QTimer.singleShot(APP.STATUS_DISPLAY_MSEC, self._hide_status)
+
+    def _background_captured_changed(self, stream):
+        if stream is not self._stream:
+            return
 
-    def _set_background(self):
-        self._background = opencv.get_background(self._capture)
         self._background_captured = True
+        self._background_btn.setEnabled(True)
+
+    def _capture_state_changed(self, stream, state, message):
+        # A stream stopping, failing or capturing its background again
+        # calls off its auto calibration
+        if (
+                stream is self._auto_calib_stream
+                and state != CAPTURE_STATE.RUNNING
+        ):
+            self._end_auto_calib()
+
+        if stream is not self._stream:
+            return
 
-    def _display_video_stream(self):
-        frame = opencv.get_frame(
-            capture=self._capture,
-            background=self._background,
-            low_color_1=self._band_1_low_color,
-            high_color_1=self._band_1_high_color,
-            low_color_2=self._band_2_low_color,
-            high_color_2=self._band_2_high_color,
-        )
+        self._status_label.setText(message)
+        self._status_label.adjustSize()
+
+        if state == CAPTURE_STATE.RUNNING:
+            # Leave the startup time up for a moment, then get out of the way
+            QtCore.QTimer.singleShot(
+                APP.STATUS_DISPLAY_MSEC,
+                self._hide_status,
+            )
+        else:
+            self._status_label.setVisible(True)
+
+        if state == CAPTURE_STATE.FAILED:
+            self._background_btn.setEnabled(False)
+
+    def _hide_status(self):
+        if self._session is None:
+            return
+
+        if self._stream.state == CAPTURE_STATE.RUNNING:
+            self._status_label.setVisible(False)
+
+    def _recapture_background(self):
+        if self._session is None:
+            return
+
+        # The stream rebuilds the background on the pool, the button
+        # comes back once the new background is in use
+        self._background_btn.setEnabled(False)
+        self._stream.recapture_background()
+
+    def _display_video_stream(self, stream):
+        # Signals queued before the session was stopped may still arrive
+        if self._session is None:
+            return
+
+        # Several frames may have been queued since the last paint,
+        # only the latest one is displayed
+        frame = stream.queue.get()
 
         if frame is None:
             return
 
-        self._image = self._array_to_qimage(frame)
-        self._image_label.setPixmap(QtGui.QPixmap.fromImage(self._image))
+        # Only the selected stream is on screen
+        if stream is not self._stream:
+            stream.queue.release(frame)
+            return
+
+        # The viewer keeps displaying the new frame buffer until the next
+        # one arrives, only then the previous buffer goes back to its
+        # stream
+        timer = self._perf.timer()
+        previous_frame = self._image_viewer.set_frame(
+            frame, timestamp=stream.queue.timestamp,
+        )
+        if previous_frame is not None:
+            self._viewer_stream.queue.release(previous_frame)
+        self._viewer_stream = stream
+        timer.lap('set_frame')
+        self._perf.frame_done()
 
-    def _array_to_qimage(self, frame):
-        # NOTE: Using `qimage2ndarray` (pip install qimage2ndarray).
-        # This fixes memory leak issues. This import should always
-        # follow Pyside2 imports as it does runtime detection of modules.
-        import qimage2ndarray
-        return qimage2ndarray.array2qimage(frame)
+        if not self._first_frame_shown:
+            self._first_frame_shown = True
+            self.FIRST_FRAME_SIGNAL.emit()
 
     def _toggle_calib(self):
         self._show_calib = not(self._show_calib)
@@ -307,87 +651,99 @@ class MainWindow(QtWidgets.QWidget):
             self._calib_btn.setText("Open Calibration")
             self.setFixedSize(self._main_layout.sizeHint())
 
+    def _toggle_perf_overlay(self):
+        self._show_perf = not(self._show_perf)
+        self._perf_label.setVisible(self._show_perf)
+        enabled = self._show_perf or APP.PERF_ENABLED
+        self._perf.enabled = enabled
+        for recorder in self._stream_recorders():
+            recorder.enabled = enabled
+
+        if self._show_perf:
+            self._update_perf_overlay()
+            self._perf_timer.start()
+        else:
+            self._perf_timer.stop()
+
+    def _stream_recorders(self):
+        if self._session is None:
+            return []
+
+        return [stream.recorder for stream in self._session.streams]
+
+    def _update_perf_overlay(self):
+        if self._session is None:
+            return
+
+        lines = [
+            f'{"fps":<12}{self._perf.fps():>8.1f}',
+            f'{"dropped":<12}{self._stream.queue.dropped:>8}',
+            f'{"skipped":<12}{self._stream.source.skipped:>8}',
+        ]
+        for sink in self._stream.sinks:
+            lines.append(sink.name)
+            lines.append(f'{"  depth":<12}{sink.depth:>8}')
+            lines.append(f'{"  drops":<12}{sink.dropped:>8}')
+
+        stage_ms = self._stream.recorder.stage_ms()
+        stage_ms.update(self._perf.stage_ms())
+        for stage, ms in stage_ms.items():
+            lines.append(f'{stage:<12}{ms:>6.2f}ms')
+
+        # Throughput of every stream, the viewer only shows one
+        streams = self._session.streams
+        if len(streams) > 1:
+            for stream in streams:
+                lines.append(f'{stream.name:<12}{stream.fps():>8.1f}')
+
+        self._perf_label.setText('\n'.join(lines))
+        self._perf_label.adjustSize()
+
     def _close(self):
-        opencv.close_capture(self._capture)
         self.close()
 
+    def closeEvent(self, event):
+        streams = []
+        if self._session is not None:
+            streams = self._session.streams
+            self._session.stop()
+            self._session = None
+
+        if APP.PERF_CSV_PATH:
+            self._perf.dump_csv(APP.PERF_CSV_PATH)
+            for stream in streams:
+                prefix = f'{stream.name}/' if len(streams) > 1 else ''
+                stream.recorder.dump_csv(
+                    APP.PERF_CSV_PATH, prefix=prefix, append=True,
+                )
+
+        super().closeEvent(event)
+
     def _color_changed(
             self, color,
             band_type=BAND_TYPE.FIRST, range_type=RANGE_TYPE.LOW
     ):
-        color = self._rescale_color_for_cv(color)
-
+        # Colors are ordered low and high of the first band, then of the
+        # second one
         if band_type == BAND_TYPE.FIRST:
-            if range_type == RANGE_TYPE.LOW:
-                self._band_1_low_color = color
-            elif range_type == RANGE_TYPE.HIGH:
-                self._band_1_high_color = color
-            else:
-                error_msg = 'Invalid range type!!'
-                raise ValueError(error_msg)
+            index = 0
         elif band_type == BAND_TYPE.SECOND:
-            if range_type == RANGE_TYPE.LOW:
-                self._band_2_low_color = color
-            elif range_type == RANGE_TYPE.HIGH:
-                self._band_2_high_color = color
-            else:
-                error_msg = 'Invalid range_type!!'
-                raise ValueError(error_msg)
+            index = 2
         else:
             error_msg = 'Invalid band_type'
             raise ValueError(error_msg)
 
-    def _rescale_color_for_cv(self, color):
-        h, s, v = color
-        return int(h / 2), s, v
+        if range_type == RANGE_TYPE.HIGH:
+            index += 1
+        elif range_type != RANGE_TYPE.LOW:
+            error_msg = 'Invalid range type!!'
+            raise ValueError(error_msg)
+
+        # The band widget already shows the color it reported
+        self._calibration = self._calibration.with_color(index, color)
+        self._schedule_calib()
 
     def _hue_changed(self, val):
-        h2, l2, h1, l1 = None, None, None, None
-
-        if val == 359 or val == 0:
-            h2 = 359
-            l2 = 339
-            h1 = 20
-            l1 = 0
-        elif val <= 20:
-            h2 = val
-            l2 = 339 + val
-            h1 = val + 20
-            l1 = val
-        elif val >= 339:
-            h2 = val
-            l2 = val - 20
-            h1 = val - 339
-            l1 = val
-        else:
-            h2 = val
-            l2 = val - 20
-            h1 = val + 20
-            l1 = val
-
-        _, s, v = self._band_2_high_color
-        color = h2, s, v
-        self._band_2_widget.high_color = color
-        self._band_2_high_color = self._rescale_color_for_cv(color)
-
-        _, s, v = self._band_2_low_color
-        color = l2, s, v
-        self._band_2_widget.low_color = color
-        self._band_2_low_color = self._rescale_color_for_cv(color)
-
-        _, s, v = self._band_1_high_color
-        color = h1, s, v
-        self._band_1_widget.high_color = color
-        self._band_1_high_color = self._rescale_color_for_cv(color)
-
-        _, s, v = self._band_1_low_color
-        color = l1, s, v
-        self._band_1_widget.low_color = color
-        self._band_1_low_color = self._rescale_color_for_cv(color)
-
-
-def run():
-    app = QtWidgets.QApplication(sys.argv)
-    mw = MainWindow()
-    mw.show()
-    sys.exit(app.exec_())
+        self._calibration = self._calibration.with_hue(val)
+        self._update_band_widgets()
+        self._schedule_calib()
@@ -1,13 +1,55 @@
+import time
+import enum
+import functools
+
+
 import cv2
 import numpy as np
 
 
-def open_capture(camera_int, width, height):
+from .perf import NULL_TIMER
+
+
+@enum.unique
+class MASK_MODE(enum.Enum):
+    IN_RANGE = 0
+    LUT = 1
+
+
+@enum.unique
+class MORPH_STRATEGY(enum.Enum):
+    AUTO = 0
+    ITERATE = 1
+    RECT = 2
+    DISTANCE = 3
+
+
+def open_capture(
+        camera_int, width, height, timeout=None,
+        retry_delay=0.1, max_retry_delay=2.0, stop_event=None,
+):
+    # Retries with exponential backoff until `timeout` seconds have gone
+    # by, returns `None` when `stop_event` is set while waiting
+    start_time = time.monotonic()
     capture = cv2.VideoCapture(camera_int)
-    while True:
-        if capture.isOpened():
-            break
-        capture.open()
+    while not capture.isOpened():
+        elapsed = time.monotonic() - start_time
+        if timeout is not None and elapsed + retry_delay > timeout:
+            capture.release()
+            error_msg = (
+                f'Unable to open camera {camera_int} '
+                f'within {timeout:.1f}s'
+            )
+            raise TimeoutError(error_msg)
+
+        if stop_event is None:
+            time.sleep(retry_delay)
+        elif stop_event.wait(retry_delay):
+            capture.release()
+            return
+
+        retry_delay = min(2 * retry_delay, max_retry_delay)
+        capture.open(camera_int)
 
     capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
     capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
@@ -15,29 +57,767 @@ def open_capture(camera_int, width, height):
     return capture
 
 
-def get_background(capture):
-    ret = False
-    frame = None
-    while True:
-        for _ in range(30):
-            ret, frame = capture.read()
-            frame = cv2.flip(frame, 1)
-        if ret:
-            break
+def close_capture(capture):
+    capture.release()
+
+
+def read_frame(capture, frame=None, flipped=None, flip=True):
+    ret, frame = capture.read(frame)
+
+    # Wait till capture initializes
+    if not ret:
+        return
+
+    if flip:
+        flipped = cv2.flip(frame, 1, dst=flipped)
+    else:
+        flipped = frame
 
-    if frame is None:
-        capture.release()
-        error_msg = (
-            "Unable to initialize the background!"
+    return frame, flipped
+
+
+class FrameReader:
+    def __init__(self, capture, flip=True):
+        self._capture = capture
+        self._flip = flip
+        self._frame = None
+        self._flipped = None
+
+    def read(self):
+        buffers = read_frame(
+            capture=self._capture,
+            frame=self._frame,
+            flipped=self._flipped,
+            flip=self._flip,
         )
-        raise RuntimeError(error_msg)
 
-    return cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        if buffers is None:
+            return
 
+        self._frame, self._flipped = buffers
+        return self._flipped
 
-def close_capture(capture):
-    capture.release()
-    cv2.destroyAllWindows()
+
+class MorphologyFilter:
+    # Beyond this radius one distance transform per pass is cheaper than
+    # a rectangular kernel, whose cost grows with its size
+    DISTANCE_RADIUS = 128
+
+    def __init__(
+            self, open_iterations=8, dilate_iterations=1,
+            strategy=MORPH_STRATEGY.AUTO,
+    ):
+        self._open_iterations = open_iterations
+        self._dilate_iterations = dilate_iterations
+
+        # An opening with a 3x3 square iterated `n` times is an erosion
+        # and a dilation by a (2n + 1) square, and the trailing dilation
+        # folds into the opening one
+        self._erode_radius = open_iterations
+        self._dilate_radius = open_iterations + dilate_iterations
+
+        if strategy == MORPH_STRATEGY.AUTO:
+            if max(self._erode_radius, self._dilate_radius) > \
+                    self.DISTANCE_RADIUS:
+                strategy = MORPH_STRATEGY.DISTANCE
+            else:
+                strategy = MORPH_STRATEGY.RECT
+        self._strategy = strategy
+
+        self._kernel = np.ones((3, 3), np.uint8)
+        self._erode_kernel = cv2.getStructuringElement(
+            cv2.MORPH_RECT,
+            (2 * self._erode_radius + 1, 2 * self._erode_radius + 1),
+        )
+        self._dilate_kernel = cv2.getStructuringElement(
+            cv2.MORPH_RECT,
+            (2 * self._dilate_radius + 1, 2 * self._dilate_radius + 1),
+        )
+        self._distance = None
+
+    @property
+    def strategy(self):
+        return self._strategy
+
+    @property
+    def erode_radius(self):
+        return self._erode_radius
+
+    @property
+    def dilate_radius(self):
+        return self._dilate_radius
+
+    def apply(self, mask, work_mask):
+        # Filters `mask` in place, `work_mask` is scratch of the same size
+        if self._strategy == MORPH_STRATEGY.ITERATE:
+            self._apply_iterate(mask, work_mask)
+        elif self._strategy == MORPH_STRATEGY.RECT:
+            self._apply_rect(mask, work_mask)
+        elif self._strategy == MORPH_STRATEGY.DISTANCE:
+            self._apply_distance(mask, work_mask)
+        else:
+            error_msg = f'MORPH STRATEGY {self._strategy} is not defined!!'
+            raise ValueError(error_msg)
+
+        return mask
+
+    def _apply_iterate(self, mask, work_mask):
+        # Apply noise filter to color mask
+        cv2.morphologyEx(
+            mask,
+            cv2.MORPH_OPEN,
+            self._kernel,
+            dst=work_mask,
+            iterations=self._open_iterations,
+        )
+
+        # Apply smooth filter to color mask
+        cv2.morphologyEx(
+            work_mask,
+            cv2.MORPH_DILATE,
+            self._kernel,
+            dst=mask,
+            iterations=self._dilate_iterations,
+        )
+
+    def _apply_rect(self, mask, work_mask):
+        cv2.erode(mask, self._erode_kernel, dst=work_mask)
+        cv2.dilate(work_mask, self._dilate_kernel, dst=mask)
+
+    def _apply_distance(self, mask, work_mask):
+        # The chessboard distance to the nearest zero pixel is the largest
+        # square erosion a pixel survives, which makes the cost of each
+        # pass independent of the radius
+        self._distance = cv2.distanceTransform(
+            mask, cv2.DIST_C, 3, dst=self._distance,
+        )
+        cv2.compare(
+            self._distance, self._erode_radius, cv2.CMP_GT, dst=work_mask,
+        )
+
+        cv2.bitwise_not(work_mask, dst=work_mask)
+        self._distance = cv2.distanceTransform(
+            work_mask, cv2.DIST_C, 3, dst=self._distance,
+        )
+        cv2.compare(
+            self._distance, self._dilate_radius, cv2.CMP_LE, dst=mask,
+        )
+
+
+class BandTables:
+    # Bounds and lookup table of one calibration, built once and only read
+    # afterwards so processors on any thread can share them
+    def __init__(self, bands):
+        self._low_bounds = np.array(bands[0::2], np.uint8)
+        self._high_bounds = np.array(bands[1::2], np.uint8)
+
+        # Per channel lookup table, bit `n` of an entry is set when the
+        # channel value lies inside band `n`
+        self._lut = np.zeros((1, 256, 3), np.uint8)
+        channel_values = np.arange(256).reshape(256, 1)
+        for band_index in range(len(self._low_bounds)):
+            inside = (
+                (channel_values >= self._low_bounds[band_index])
+                & (channel_values <= self._high_bounds[band_index])
+            )
+            self._lut[0][inside] |= np.uint8(1 << band_index)
+
+        for table in (self._low_bounds, self._high_bounds, self._lut):
+            table.flags.writeable = False
+
+    @property
+    def low_bounds(self):
+        return self._low_bounds
+
+    @property
+    def high_bounds(self):
+        return self._high_bounds
+
+    @property
+    def lut(self):
+        return self._lut
+
+
+@functools.lru_cache(maxsize=64)
+def band_tables(bands):
+    # `bands` is the tuple of low and high colors of every band, going
+    # back to a calibration or a profile reuses its tables
+    return BandTables(bands)
+
+
+def _runs(flags, min_length):
+    # Start and end of every run of set flags at least `min_length` long
+    edges = np.flatnonzero(np.diff(flags, prepend=False, append=False))
+    starts = edges[0::2]
+    ends = edges[1::2]
+    keep = ends - starts >= min_length
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
+def _merge_regions(regions):
+    # Regions that overlap or touch become their bounding box, until no
+    # two of them do
+    regions = list(regions)
+    merged = True
+    while merged:
+        merged = False
+        for index, region in enumerate(regions):
+            for other_index in range(index + 1, len(regions)):
+                other = regions[other_index]
+                if (
+                        region[0] <= other[2] and other[0] <= region[2]
+                        and region[1] <= other[3] and other[1] <= region[3]
+                ):
+                    regions[index] = (
+                        min(region[0], other[0]),
+                        min(region[1], other[1]),
+                        max(region[2], other[2]),
+                        max(region[3], other[3]),
+                    )
+                    del regions[other_index]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return regions
+
+
+def mask_regions(mask, radius, margin):
+    # Boxes `(left, top, right, bottom)` around every part of `mask` that
+    # survives an erosion by a square of `radius`, grown by `margin` and
+    # merged where they meet. A pixel survives when the square around it,
+    # cut off at the frame border, is all set, so every row and column of
+    # that square has `radius + 1` set pixels at least. The boxes are found
+    # from row and column sums instead of labelling the mask
+    height, width = mask.shape[:2]
+    min_size = radius + 1
+    threshold = 255 * min_size
+
+    def rows(left, right, top=0, bottom=height):
+        sums = cv2.reduce(
+            mask[top:bottom, left:right], 1, cv2.REDUCE_SUM,
+            dtype=cv2.CV_32S,
+        )
+        return [
+            (top + start, top + end)
+            for start, end in _runs(sums[:, 0] >= threshold, min_size)
+        ]
+
+    def columns(top, bottom):
+        sums = cv2.reduce(
+            mask[top:bottom], 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S,
+        )
+        return _runs(sums[0] >= threshold, min_size)
+
+    regions = []
+    for band_top, band_bottom in rows(0, width):
+        for left, right in columns(band_top, band_bottom):
+            # The band is as tall as everything beside the box, its rows
+            # are narrowed down to the box columns
+            box_rows = rows(left, right, band_top, band_bottom)
+            if not box_rows:
+                continue
+
+            regions.append((
+                max(0, left - margin),
+                max(0, box_rows[0][0] - margin),
+                min(width, right + margin),
+                min(height, box_rows[-1][1] + margin),
+            ))
+
+    return _merge_regions(regions)
+
+
+def _view(image, region):
+    left, top, right, bottom = region
+    return image[top:bottom, left:right]
+
+
+class CloakProcessor:
+    BAND_COUNT = 2
+
+    # Hysteresis on the averaged mask, a pixel turns on above the high
+    # level and only turns off again below the low one
+    TEMPORAL_HIGH = 170
+    TEMPORAL_LOW = 85
+
+    # Regions covering more of the mask than this are not worth cutting
+    # out, the whole frame is processed instead
+    ROI_MAX_AREA = 0.5
+
+    def __init__(
+            self, background=None, output_code=cv2.COLOR_BGR2RGB,
+            open_iterations=8, dilate_iterations=1,
+            mask_mode=MASK_MODE.IN_RANGE, mask_scale=1.0, mask_refine=True,
+            morph_strategy=MORPH_STRATEGY.AUTO, feather=0,
+            temporal_frames=0, roi=False,
+    ):
+        if not 0.0 < mask_scale <= 1.0:
+            error_msg = f'Mask scale should be in (0, 1], got {mask_scale}'
+            raise ValueError(error_msg)
+
+        self._background = background
+        self._output_code = output_code
+        self._mask_mode = mask_mode
+        self._mask_scale = mask_scale
+        self._mask_refine = mask_refine
+        self._feather = feather
+
+        # Morphology and compositing only inside the regions of the mask
+        # that can hold the cloak, see `mask_regions`
+        self._roi = roi
+        self._regions = None
+
+        # Exponential moving average over roughly `temporal_frames`
+        # frames, `0` or `1` keeps every mask independent
+        self._temporal_alpha = None
+        if temporal_frames > 1:
+            self._temporal_alpha = 2.0 / (temporal_frames + 1)
+        self._temporal_primed = False
+
+        self._morphology = None
+        self.set_morphology(open_iterations, dilate_iterations, morph_strategy)
+
+        self._tables = band_tables(((0, 0, 0),) * 2 * self.BAND_COUNT)
+
+        self._shape = None
+        self._mask_size = None
+        self._mask_frame = None
+        self._hsv = None
+        self._band_masks = None
+        self._band_flags = None
+        self._channel_flags = None
+        self._mask = None
+        self._scaled_mask = None
+        self._opened_mask = None
+        self._mask_average = None
+        self._stable_mask = None
+        self._weights = None
+        self._inverse_weights = None
+        self._composite = None
+        self._output = None
+
+    @property
+    def background(self):
+        return self._background
+
+    @property
+    def mask(self):
+        return self._mask
+
+    @property
+    def mask_scale(self):
+        return self._mask_scale
+
+    @property
+    def mask_mode(self):
+        return self._mask_mode
+
+    @mask_mode.setter
+    def mask_mode(self, mask_mode):
+        self._mask_mode = mask_mode
+
+    @property
+    def band_tables(self):
+        return self._tables
+
+    @property
+    def roi(self):
+        return self._roi
+
+    @property
+    def regions(self):
+        # Frame regions of the last frame, `None` when the whole frame was
+        # processed
+        return self._regions
+
+    def set_background(self, background):
+        self._background = background
+
+    def set_bands(
+            self, low_color_1, high_color_1, low_color_2, high_color_2,
+    ):
+        colors = (low_color_1, high_color_1, low_color_2, high_color_2)
+        self.set_band_tables(
+            band_tables(
+                tuple(tuple(int(value) for value in color) for color in colors)
+            )
+        )
+
+    def set_band_tables(self, tables):
+        # Tables are shared and never written, switching is a swap
+        self._tables = tables
+
+        # A calibration change should not fade in over several frames
+        self._temporal_primed = False
+
+    def set_morphology(
+            self, open_iterations, dilate_iterations,
+            morph_strategy=MORPH_STRATEGY.AUTO,
+    ):
+        # Morphology runs on the scaled mask, the iterations shrink with it
+        # so the filters cover the same area of the full frame. A filter
+        # that was asked for keeps one iteration, one that was not stays off
+        self._open_iterations = open_iterations
+        self._dilate_iterations = dilate_iterations
+        self._morph_strategy = morph_strategy
+        self._morphology = MorphologyFilter(
+            open_iterations=self._scale_iterations(open_iterations),
+            dilate_iterations=self._scale_iterations(dilate_iterations),
+            strategy=morph_strategy,
+        )
+
+    def _scale_iterations(self, iterations):
+        if not iterations:
+            return 0
+
+        return max(1, round(iterations * self._mask_scale))
+
+    def set_mask_scale(self, mask_scale):
+        if not 0.0 < mask_scale <= 1.0:
+            error_msg = f'Mask scale should be in (0, 1], got {mask_scale}'
+            raise ValueError(error_msg)
+
+        if mask_scale == self._mask_scale:
+            return
+
+        # The mask buffers are sized for the scale, they are allocated
+        # again with the next frame
+        self._mask_scale = mask_scale
+        self._shape = None
+        self.set_morphology(
+            self._open_iterations,
+            self._dilate_iterations,
+            self._morph_strategy,
+        )
+
+    def process(self, frame, out=None, timer=NULL_TIMER, in_place=False):
+        if self._background is None:
+            error_msg = 'Background is not set on the processor!'
+            raise RuntimeError(error_msg)
+
+        if frame.shape != self._background.shape:
+            error_msg = (
+                f'Frame shape {frame.shape} does not match '
+                f'background shape {self._background.shape}'
+            )
+            raise ValueError(error_msg)
+
+        if frame.shape != self._shape:
+            self._allocate(frame.shape)
+
+        mask_frame = frame
+        if self._mask_frame is not None:
+            # Nearest neighbour keeps real hues, averaging would invent
+            # new ones around the red wrap-around. It also picks whole
+            # pixels, so resizing before the conversion changes nothing
+            # but the number of pixels converted
+            mask_frame = cv2.resize(
+                frame,
+                self._mask_size,
+                dst=self._mask_frame,
+                interpolation=cv2.INTER_NEAREST,
+            )
+
+        # Only the thresholding needs HSV, frame and background are
+        # composited in BGR
+        hsv = cv2.cvtColor(mask_frame, cv2.COLOR_BGR2HSV, dst=self._hsv)
+
+        if self._mask_mode == MASK_MODE.IN_RANGE:
+            self._in_range_mask(hsv)
+        elif self._mask_mode == MASK_MODE.LUT:
+            self._lut_mask(hsv)
+        else:
+            error_msg = f'MASK MODE {self._mask_mode} is not defined!!'
+            raise ValueError(error_msg)
+        timer.lap('mask')
+
+        if self._temporal_alpha is not None:
+            self._stabilize_mask()
+            timer.lap('temporal')
+
+        regions = None
+        if self._roi:
+            regions = self._filter_regions()
+        else:
+            self._morphology.apply(self._scaled_mask, self._opened_mask)
+        timer.lap('morphology')
+
+        if self._mask_frame is not None:
+            regions = self._upscale_mask(regions)
+            timer.lap('upscale')
+        self._regions = regions
+
+        target = self._output if out is None else out
+
+        # With `in_place` the composite is built on `frame` itself, which
+        # leaves the pixels outside the mask untouched. Without an output
+        # conversion it goes straight out
+        if in_place:
+            composite = frame
+        elif self._output_code is None:
+            composite = target
+        else:
+            composite = self._composite
+
+        if regions is None and self._feather:
+            self._blend(frame, composite)
+        elif regions is None:
+            if composite is not frame:
+                np.copyto(composite, frame)
+            cv2.copyTo(self._background, self._mask, composite)
+        else:
+            # Outside the regions the mask is empty, the frame goes
+            # through as it is
+            if composite is not frame:
+                np.copyto(composite, frame)
+            for region in regions:
+                if self._feather:
+                    self._blend(frame, composite, region=region)
+                else:
+                    cv2.copyTo(
+                        _view(self._background, region),
+                        _view(self._mask, region),
+                        _view(composite, region),
+                    )
+        timer.lap('composite')
+
+        if self._output_code is not None:
+            target = cv2.cvtColor(composite, self._output_code, dst=target)
+            timer.lap('convert')
+        elif out is not None and composite is not out:
+            # A buffer handed in by the caller is always filled
+            np.copyto(out, composite)
+            timer.lap('copy')
+        else:
+            target = composite
+
+        return target
+
+    def _blend(self, frame, composite, region=None):
+        # The mask blurred straight into float is the background weight of
+        # every pixel, 0 to 255. blendLinear divides by the sum of both
+        # weights, so they need no scaling and the blend is one pass over
+        # frame and background. That pass on float weights is still slow,
+        # a feathered composite costs about 1.5 ms more than a hard one at
+        # 640x480
+        buffers = [
+            self._mask, self._weights, self._inverse_weights,
+            self._background, frame, composite,
+        ]
+        if region is not None:
+            buffers = [_view(buffer, region) for buffer in buffers]
+        mask, weights, inverse_weights, background, frame, composite = buffers
+
+        size = 2 * self._feather + 1
+        cv2.boxFilter(mask, cv2.CV_32F, (size, size), dst=weights)
+        cv2.subtract(255.0, weights, dst=inverse_weights)
+        cv2.blendLinear(
+            background,
+            frame,
+            weights,
+            inverse_weights,
+            dst=composite,
+        )
+
+    def _filter_regions(self):
+        # The margin covers what the dilation, the upscale and the feather
+        # add around the cloak, the regions hold all of the final mask.
+        # `None` when the whole mask was filtered
+        mask = self._scaled_mask
+        work_mask = self._opened_mask
+        height, width = mask.shape
+        margin = (
+            self._morphology.dilate_radius + 2
+            + int(np.ceil(self._feather * self._mask_scale))
+        )
+        regions = mask_regions(mask, self._morphology.erode_radius, margin)
+        area = sum(
+            (right - left) * (bottom - top)
+            for left, top, right, bottom in regions
+        )
+        if area > self.ROI_MAX_AREA * width * height:
+            self._morphology.apply(mask, work_mask)
+            return
+
+        # The sides of a region inside the frame are cleared, the erosion
+        # then sees the frame around the region as empty like it is. They
+        # lie in the margin, nothing the opening keeps depends on them
+        for region in regions:
+            left, top, right, bottom = region
+            region_mask = _view(work_mask, region)
+            np.copyto(region_mask, _view(mask, region))
+            if left:
+                region_mask[:, 0] = 0
+            if top:
+                region_mask[0] = 0
+            if right < width:
+                region_mask[:, -1] = 0
+            if bottom < height:
+                region_mask[-1] = 0
+
+        # Everything outside the regions is noise the opening removes
+        mask.fill(0)
+        for region in regions:
+            region_mask = _view(work_mask, region)
+            self._morphology.apply(region_mask, _view(mask, region))
+            np.copyto(_view(mask, region), region_mask)
+
+        return regions
+
+    def _in_range_mask(self, frame):
+        # Combine color bands into single mask
+        for band_index, band_mask in enumerate(self._band_masks):
+            cv2.inRange(
+                frame,
+                self._tables.low_bounds[band_index],
+                self._tables.high_bounds[band_index],
+                dst=band_mask,
+            )
+        cv2.bitwise_or(
+            self._band_masks[0], self._band_masks[1], dst=self._scaled_mask,
+        )
+
+    def _lut_mask(self, frame):
+        # A pixel is inside a band when the band bit survives the AND
+        # over all three channels, any surviving bit puts it in the mask
+        cv2.LUT(frame, self._tables.lut, dst=self._band_flags)
+        cv2.split(self._band_flags, self._channel_flags)
+        h_flags, s_flags, v_flags = self._channel_flags
+        cv2.bitwise_and(h_flags, s_flags, dst=h_flags)
+        cv2.bitwise_and(h_flags, v_flags, dst=h_flags)
+        cv2.compare(h_flags, 0, cv2.CMP_GT, dst=self._scaled_mask)
+
+    def _stabilize_mask(self):
+        if not self._temporal_primed:
+            np.copyto(self._mask_average, self._scaled_mask)
+            np.copyto(self._stable_mask, self._scaled_mask)
+            self._temporal_primed = True
+            return
+
+        cv2.addWeighted(
+            self._scaled_mask,
+            self._temporal_alpha,
+            self._mask_average,
+            1.0 - self._temporal_alpha,
+            0,
+            dst=self._mask_average,
+        )
+
+        # `_opened_mask` is free until the morphology, it is scratch here
+        cv2.compare(
+            self._mask_average, self.TEMPORAL_LOW, cv2.CMP_GE,
+            dst=self._opened_mask,
+        )
+        cv2.bitwise_and(
+            self._stable_mask, self._opened_mask, dst=self._stable_mask,
+        )
+        cv2.compare(
+            self._mask_average, self.TEMPORAL_HIGH, cv2.CMP_GE,
+            dst=self._opened_mask,
+        )
+        cv2.bitwise_or(
+            self._stable_mask, self._opened_mask, dst=self._stable_mask,
+        )
+
+        # The morphology works in place, the hysteresis state is kept
+        # apart from it
+        np.copyto(self._scaled_mask, self._stable_mask)
+
+    def _upscale_mask(self, regions=None):
+        if regions is None:
+            self._upscale(self._scaled_mask, self._mask)
+            return
+
+        # Regions are a pixel apart at least and stay apart in the frame
+        height, width = self._shape[:2]
+        mask_width, mask_height = self._mask_size
+        frame_regions = [
+            (
+                left * width // mask_width,
+                top * height // mask_height,
+                -(-right * width // mask_width),
+                -(-bottom * height // mask_height),
+            )
+            for left, top, right, bottom in regions
+        ]
+
+        # Only with a whole number of frame pixels per mask pixel does a
+        # region upscale sample the mask where the full upscale does
+        if width % mask_width or height % mask_height:
+            self._upscale(self._scaled_mask, self._mask)
+            return frame_regions
+
+        self._mask.fill(0)
+        for region, frame_region in zip(regions, frame_regions):
+            self._upscale(
+                _view(self._scaled_mask, region),
+                _view(self._mask, frame_region),
+            )
+
+        return frame_regions
+
+    def _upscale(self, scaled_mask, mask):
+        size = (mask.shape[1], mask.shape[0])
+        if not self._mask_refine:
+            cv2.resize(
+                scaled_mask, size, dst=mask, interpolation=cv2.INTER_NEAREST,
+            )
+            return
+
+        # Bilinear upscale and threshold back to a binary mask, which
+        # follows the cloak edge instead of leaving blocky steps
+        cv2.resize(
+            scaled_mask, size, dst=mask, interpolation=cv2.INTER_LINEAR,
+        )
+        cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY, dst=mask)
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        self._mask = np.empty((height, width), np.uint8)
+
+        mask_width = max(1, round(width * self._mask_scale))
+        mask_height = max(1, round(height * self._mask_scale))
+        self._mask_size = (mask_width, mask_height)
+        if self._mask_size == (width, height):
+            self._mask_frame = None
+            self._scaled_mask = self._mask
+        else:
+            self._mask_frame = np.empty(
+                (mask_height, mask_width) + tuple(shape[2:]), np.uint8,
+            )
+            self._scaled_mask = np.empty((mask_height, mask_width), np.uint8)
+        self._hsv = np.empty(
+            (mask_height, mask_width) + tuple(shape[2:]), np.uint8,
+        )
+
+        self._band_masks = [
+            np.empty((mask_height, mask_width), np.uint8)
+            for _ in range(self.BAND_COUNT)
+        ]
+        self._band_flags = np.empty(
+            (mask_height, mask_width) + tuple(shape[2:]), np.uint8,
+        )
+        self._channel_flags = [
+            np.empty((mask_height, mask_width), np.uint8)
+            for _ in range(3)
+        ]
+        self._opened_mask = np.empty((mask_height, mask_width), np.uint8)
+        if self._temporal_alpha is not None:
+            self._mask_average = np.empty(
+                (mask_height, mask_width), np.uint8,
+            )
+            self._stable_mask = np.empty((mask_height, mask_width), np.uint8)
+        self._temporal_primed = False
+        if self._feather:
+            self._weights = np.empty((height, width), np.float32)
+            self._inverse_weights = np.empty((height, width), np.float32)
+        self._composite = None
+        if self._output_code is not None:
+            self._composite = np.empty(shape, np.uint8)
+        self._output = np.empty(shape, np.uint8)
+        self._shape = shape
 
 
 def get_frame(
@@ -0,0 +1,122 @@
+import csv
+import time
+import collections
+
+
+class StageTimer:
+    def __init__(self, recorder):
+        self._recorder = recorder
+        self._last_time = time.perf_counter()
+
+    def start(self):
+        self._last_time = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self._recorder.add(stage, now - self._last_time, timestamp=now)
+        self._last_time = now
+
+
+class NullTimer:
+    # Stands in for `StageTimer` while instrumentation is disabled
+    def start(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class PerfRecorder:
+    def __init__(self, size=300, enabled=False):
+        self._size = size
+        self._enabled = enabled
+        self._samples = {}
+        self._frame_times = collections.deque(maxlen=size)
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, enabled):
+        self._enabled = enabled
+
+    def timer(self):
+        if not self._enabled:
+            return NULL_TIMER
+
+        return StageTimer(self)
+
+    def add(self, stage, seconds, timestamp=None):
+        samples = self._samples.get(stage)
+        if samples is None:
+            samples = self._samples.setdefault(
+                stage, collections.deque(maxlen=self._size),
+            )
+
+        if timestamp is None:
+            timestamp = time.perf_counter()
+
+        # `deque.append` is atomic, the worker and the GUI thread can
+        # record into the same recorder without a lock
+        samples.append((timestamp, seconds))
+
+    def frame_done(self):
+        if not self._enabled:
+            return
+
+        self._frame_times.append(time.perf_counter())
+
+    def clear(self):
+        self._samples.clear()
+        self._frame_times.clear()
+
+    def samples(self, stage):
+        return [seconds for _, seconds in self._samples.get(stage, ())]
+
+    def fps(self):
+        frame_times = list(self._frame_times)
+        if len(frame_times) < 2:
+            return 0.0
+
+        elapsed = frame_times[-1] - frame_times[0]
+        if elapsed <= 0:
+            return 0.0
+
+        return (len(frame_times) - 1) / elapsed
+
+    def stage_ms(self):
+        stage_ms = {}
+        for stage, samples in list(self._samples.items()):
+            samples = list(samples)
+            if not samples:
+                continue
+            stage_ms[stage] = (
+                1000.0 * sum(seconds for _, seconds in samples) / len(samples)
+            )
+
+        return stage_ms
+
+    def stats(self):
+        return {
+            'fps': self.fps(),
+            'stage_ms': self.stage_ms(),
+        }
+
+    def dump_csv(self, file_path, prefix='', append=False):
+        # `append` adds rows under the header of an earlier dump, the
+        # `prefix` tells the stages of several recorders apart
+        with open(file_path, 'a' if append else 'w', newline='') as f:
+            writer = csv.writer(f)
+            if not append:
+                writer.writerow(['stage', 'timestamp', 'ms'])
+            for stage, samples in list(self._samples.items()):
+                for timestamp, seconds in list(samples):
+                    writer.writerow([
+                        f'{prefix}{stage}',
+                        f'{timestamp:.6f}',
+                        f'{seconds * 1000.0:.4f}',
+                    ])
@@ -0,0 +1,247 @@
+import os
+import re
+import json
+
+
+from .conf import APP
+from . import calib
+from . import opencv
+
+
+PROFILE_VERSION = 1
+PROFILE_EXT = '.json'
+NAME_PATTERN = re.compile(r'^\w[\w .-]*$')
+NUMBER_LIST_PATTERN = re.compile(r'\[\s+([-\d.,\s]+?)\s+\]')
+PROFILE_KEYS = (
+    'version', 'name', 'hue', 'bands', 'open_iterations',
+    'dilate_iterations', 'morph_strategy', 'mask_scale',
+)
+
+
+def parse_name(value):
+    # Names are file names in the profile directory, no paths
+    if not isinstance(value, str) or not NAME_PATTERN.match(value):
+        error_msg = f'Invalid profile name {value!r}'
+        raise ValueError(error_msg)
+
+    return value
+
+
+def _parse_iterations(value, name):
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        error_msg = f'{name} should be an integer >= 0, got {value!r}'
+        raise ValueError(error_msg)
+
+    return value
+
+
+class Profile:
+    # A named calibration with the mask settings it was tuned with. The
+    # band tables are built with the profile, a stream switching to it
+    # only swaps references
+    def __init__(
+            self, name, calibration=None,
+            open_iterations=APP.MORPH_OPEN_ITERATIONS,
+            dilate_iterations=APP.MORPH_DILATE_ITERATIONS,
+            morph_strategy=APP.MORPH_STRATEGY,
+            mask_scale=APP.MASK_SCALE,
+    ):
+        if calibration is None:
+            calibration = calib.Calibration()
+
+        if morph_strategy not in opencv.MORPH_STRATEGY.__members__:
+            error_msg = f'Unknown morph strategy {morph_strategy!r}'
+            raise ValueError(error_msg)
+
+        if (
+                isinstance(mask_scale, bool)
+                or not isinstance(mask_scale, (int, float))
+                or not 0.0 < mask_scale <= 1.0
+        ):
+            error_msg = f'Mask scale should be in (0, 1], got {mask_scale!r}'
+            raise ValueError(error_msg)
+
+        self._name = parse_name(name)
+        self._calibration = calibration
+        self._open_iterations = _parse_iterations(
+            open_iterations, 'open_iterations',
+        )
+        self._dilate_iterations = _parse_iterations(
+            dilate_iterations, 'dilate_iterations',
+        )
+        self._morph_strategy = morph_strategy
+        self._mask_scale = float(mask_scale)
+        self._tables = opencv.band_tables(calibration.bands)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def calibration(self):
+        return self._calibration
+
+    @property
+    def open_iterations(self):
+        return self._open_iterations
+
+    @property
+    def dilate_iterations(self):
+        return self._dilate_iterations
+
+    @property
+    def morph_strategy(self):
+        return self._morph_strategy
+
+    @property
+    def mask_scale(self):
+        return self._mask_scale
+
+    @property
+    def tables(self):
+        return self._tables
+
+    def with_calibration(self, calibration, name=None):
+        return Profile(
+            self._name if name is None else name,
+            calibration,
+            open_iterations=self._open_iterations,
+            dilate_iterations=self._dilate_iterations,
+            morph_strategy=self._morph_strategy,
+            mask_scale=self._mask_scale,
+        )
+
+    def to_dict(self):
+        return {
+            'version': PROFILE_VERSION,
+            'name': self._name,
+            'hue': self._calibration.hue,
+            'bands': {
+                name: list(color)
+                for name, color in zip(
+                    calib.BAND_NAMES, self._calibration.colors,
+                )
+            },
+            'open_iterations': self._open_iterations,
+            'dilate_iterations': self._dilate_iterations,
+            'morph_strategy': self._morph_strategy,
+            'mask_scale': self._mask_scale,
+        }
+
+    @classmethod
+    def from_dict(cls, data, name=None):
+        # Only the bands are required, everything else falls back to the
+        # configured defaults. A given `name`, the file name, wins over
+        # the stored one
+        if not isinstance(data, dict):
+            error_msg = 'Profile should be a JSON object'
+            raise ValueError(error_msg)
+
+        unknown = set(data) - set(PROFILE_KEYS)
+        if unknown:
+            error_msg = f'Unknown profile settings {sorted(unknown)}'
+            raise ValueError(error_msg)
+
+        version = data.get('version', PROFILE_VERSION)
+        if version != PROFILE_VERSION:
+            error_msg = f'Unsupported profile version {version!r}'
+            raise ValueError(error_msg)
+
+        bands = data.get('bands')
+        if not isinstance(bands, dict) or set(bands) != set(calib.BAND_NAMES):
+            error_msg = f'Profile bands should be {list(calib.BAND_NAMES)}'
+            raise ValueError(error_msg)
+
+        calibration = calib.Calibration(
+            [bands[band_name] for band_name in calib.BAND_NAMES],
+            data.get('hue', calib.DEFAULT_HUE),
+        )
+
+        return cls(
+            data.get('name') if name is None else name,
+            calibration,
+            open_iterations=data.get(
+                'open_iterations', APP.MORPH_OPEN_ITERATIONS,
+            ),
+            dilate_iterations=data.get(
+                'dilate_iterations', APP.MORPH_DILATE_ITERATIONS,
+            ),
+            morph_strategy=data.get('morph_strategy', APP.MORPH_STRATEGY),
+            mask_scale=data.get('mask_scale', APP.MASK_SCALE),
+        )
+
+    def processor_options(self):
+        return {
+            'open_iterations': self._open_iterations,
+            'dilate_iterations': self._dilate_iterations,
+            'morph_strategy': opencv.MORPH_STRATEGY[self._morph_strategy],
+            'mask_scale': self._mask_scale,
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Profile):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        return hash((self._name, self._calibration))
+
+    def __repr__(self):
+        return f'Profile(name={self._name!r}, {self._calibration!r})'
+
+
+def profile_path(name, directory=None):
+    directory = APP.PROFILE_DIR if directory is None else directory
+    return os.path.join(directory, f'{parse_name(name)}{PROFILE_EXT}')
+
+
+def list_profiles(directory=None):
+    directory = APP.PROFILE_DIR if directory is None else directory
+    if not os.path.isdir(directory):
+        return []
+
+    return sorted(
+        os.path.splitext(file_name)[0]
+        for file_name in os.listdir(directory)
+        if file_name.endswith(PROFILE_EXT)
+    )
+
+
+def load_profile(name, directory=None):
+    return read_profile(profile_path(name, directory=directory))
+
+
+def read_profile(path):
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except OSError as error:
+        error_msg = f'Unable to read profile {path}: {error.strerror}'
+        raise ValueError(error_msg)
+    except json.JSONDecodeError as error:
+        error_msg = f'Invalid profile {path}: {error}'
+        raise ValueError(error_msg)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return Profile.from_dict(data, name=name)
+
+
+def save_profile(profile, directory=None):
+    # Written next to the profile and renamed over it, a reader never
+    # sees half a file
+    path = profile_path(profile.name, directory=directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Colors stay on one line each, profiles are small enough to edit by
+    # hand
+    text = NUMBER_LIST_PATTERN.sub(
+        lambda match: f'[{" ".join(match.group(1).split())}]',
+        json.dumps(profile.to_dict(), indent=2),
+    )
+
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(text + '\n')
+    os.replace(temp_path, path)
+
+    return path
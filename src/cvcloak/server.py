@@ -0,0 +1,531 @@
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import urllib.parse
+
+
+import cv2
+
+
+from .conf import APP
+from .session import SessionManager, CAPTURE_STATE
+from .perf import PerfRecorder
+from . import autocalib
+from . import calib
+from . import cli
+from . import profiles
+
+
+BOUNDARY = 'cvcloakframe'
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+INDEX_PAGE = (
+    '<!DOCTYPE html>\n'
+    '<html><head><title>cvcloak</title></head>\n'
+    '<body style="margin:0;background:#000">\n'
+    '<img src="/stream" style="display:block;margin:auto;max-width:100%">\n'
+    '</body></html>\n'
+).encode('utf-8')
+
+
+class CloakServer:
+    # Serves one stream over HTTP. Every processed frame is encoded to JPEG
+    # once and the same bytes go to all clients, a client still sending
+    # the last frame skips the ones produced meanwhile
+    def __init__(
+            self, session, stream, host='127.0.0.1', port=8080,
+            jpeg_quality=80, send_buffer_bytes=65536, max_body_bytes=65536,
+            snapshot_timeout=5.0, profile=None,
+    ):
+        self._session = session
+        self._stream = stream
+        self._host = host
+        self._port = port
+        self._encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self._send_buffer_bytes = send_buffer_bytes
+        self._max_body_bytes = max_body_bytes
+        self._snapshot_timeout = snapshot_timeout
+
+        self._profile = profile
+        self._calibration = calib.Calibration()
+        if profile is not None:
+            self._calibration = profile.calibration
+        self._state = None
+        self._message = ''
+        self._calibrating = False
+        self._calibration_message = ''
+
+        self._loop = None
+        self._server = None
+        self._stop_event = None
+        self._frame_event = None
+        self._jpeg_condition = None
+        self._jpeg = None
+        self._jpeg_index = 0
+        self._clients = 0
+        self._dropped = 0
+        self._tasks = set()
+        self._perf = PerfRecorder(size=APP.PERF_RING_SIZE, enabled=True)
+
+        if profile is not None:
+            self._stream.set_profile(profile)
+        else:
+            self._stream.set_calibration(self._calibration)
+
+    @property
+    def address(self):
+        # The bound address, which tells the port when serving on port 0
+        if self._server is None or not self._server.sockets:
+            return
+        return self._server.sockets[0].getsockname()[:2]
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._frame_event = asyncio.Event()
+        self._jpeg_condition = asyncio.Condition()
+        self._stream.set_callbacks(
+            frame_ready=self._frame_ready,
+            state_changed=self._state_changed,
+            calibrated=self._calibrated,
+        )
+
+        self._server = await asyncio.start_server(
+            self._handle_client, self._host, self._port,
+        )
+        host, port = self.address
+        sys.stderr.write(
+            f'Serving {self._stream.name} on http://{host}:{port}\n'
+        )
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(signum, self._stop_event.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not on this platform or not on the main thread
+                pass
+
+        encoder = asyncio.create_task(self._encode_frames())
+        self._session.start()
+        try:
+            await self._stop_event.wait()
+        finally:
+            self._server.close()
+            encoder.cancel()
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(encoder, *self._tasks, return_exceptions=True)
+            await self._server.wait_closed()
+
+            # Joins the pool threads, which must not block the loop
+            await self._loop.run_in_executor(None, self._session.stop)
+
+        return 1 if self._state == CAPTURE_STATE.FAILED else 0
+
+    def _frame_ready(self, stream):
+        # Called on a pool thread
+        self._loop.call_soon_threadsafe(self._frame_event.set)
+
+    def _state_changed(self, stream, state, message):
+        # Called on a pool thread, background progress is not logged
+        if (
+                state != CAPTURE_STATE.CAPTURING_BACKGROUND
+                or state != self._state
+        ):
+            sys.stderr.write(f'{message}\n')
+
+        self._state = state
+        self._message = message
+        if state == CAPTURE_STATE.FAILED:
+            self.stop()
+
+    def _calibrated(self, stream, calibration, message):
+        # Called on a pool thread, applied on the loop like a control change
+        self._loop.call_soon_threadsafe(
+            self._apply_auto_calibration, calibration, message,
+        )
+
+    def _apply_auto_calibration(self, calibration, message):
+        sys.stderr.write(f'{message}\n')
+        self._calibrating = False
+        self._calibration_message = message
+        if calibration is not None:
+            self._calibration = calibration
+            self._stream.set_calibration(calibration)
+
+    async def _encode_frames(self):
+        while True:
+            await self._frame_event.wait()
+            self._frame_event.clear()
+
+            frame = self._stream.queue.get()
+            if frame is None:
+                continue
+            timestamp = self._stream.queue.timestamp
+
+            # Nobody is watching, the frame is not encoded at all
+            if not self._clients:
+                self._stream.queue.release(frame)
+                continue
+
+            try:
+                jpeg = await self._loop.run_in_executor(
+                    None, self._encode, frame,
+                )
+            except (RuntimeError, cv2.error) as error:
+                sys.stderr.write(f'{error}\n')
+                continue
+            finally:
+                self._stream.queue.release(frame)
+
+            # From capture until the frame is ready to go out
+            if timestamp is not None:
+                self._perf.add('latency', time.perf_counter() - timestamp)
+
+            async with self._jpeg_condition:
+                self._jpeg = jpeg
+                self._jpeg_index += 1
+                self._jpeg_condition.notify_all()
+
+    def _encode(self, frame):
+        timer = self._perf.timer()
+        ret, jpeg = cv2.imencode('.jpg', frame, self._encode_params)
+        if not ret:
+            error_msg = 'Unable to encode frame'
+            raise RuntimeError(error_msg)
+        timer.lap('encode')
+
+        return jpeg.tobytes()
+
+    async def _wait_jpeg(self, index):
+        async with self._jpeg_condition:
+            await self._jpeg_condition.wait_for(
+                lambda: self._jpeg_index != index
+            )
+            return self._jpeg, self._jpeg_index
+
+    async def _handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            try:
+                method, path, body = await self._read_request(reader)
+                await self._route(writer, method, path, body)
+            except ValueError as error:
+                self._respond_json(writer, 400, {'error': str(error)})
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode('latin-1')
+        parts = request_line.split()
+        if len(parts) != 3:
+            error_msg = f'Malformed request line {request_line.strip()!r}'
+            raise ValueError(error_msg)
+        method, target, _ = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if not 0 <= length <= self._max_body_bytes:
+            error_msg = f'Request body of {length} bytes is not accepted'
+            raise ValueError(error_msg)
+
+        body = await reader.readexactly(length) if length else b''
+        path = urllib.parse.urlsplit(target).path
+
+        return method.upper(), path, body
+
+    async def _route(self, writer, method, path, body):
+        routes = {
+            '/': {'GET': self._send_index},
+            '/stream': {'GET': self._send_stream},
+            '/snapshot': {'GET': self._send_snapshot},
+            '/control': {
+                'GET': self._send_control,
+                'POST': self._update_control,
+            },
+        }
+
+        handlers = routes.get(path)
+        if handlers is None:
+            self._respond_json(writer, 404, {'error': f'No route {path}'})
+            return
+
+        handler = handlers.get(method)
+        if handler is None:
+            self._respond_json(
+                writer, 405, {'error': f'{method} is not allowed on {path}'},
+            )
+            return
+
+        await handler(writer, body)
+
+    def _respond(self, writer, status, content_type, body):
+        header = (
+            f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Cache-Control: no-store\r\n'
+            'Connection: close\r\n'
+            '\r\n'
+        )
+        writer.writelines([header.encode('latin-1'), body])
+
+    def _respond_json(self, writer, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self._respond(writer, status, 'application/json', body)
+
+    async def _send_index(self, writer, body):
+        self._respond(writer, 200, 'text/html; charset=utf-8', INDEX_PAGE)
+
+    async def _send_stream(self, writer, body):
+        header = (
+            'HTTP/1.1 200 OK\r\n'
+            f'Content-Type: multipart/x-mixed-replace; boundary={BOUNDARY}\r\n'
+            'Cache-Control: no-store\r\n'
+            'Connection: close\r\n'
+            '\r\n'
+        )
+        writer.write(header.encode('latin-1'))
+
+        # Without a write buffer `drain` waits until the frame is handed
+        # to the socket, frames produced meanwhile are skipped instead of
+        # piling up for a slow client. The socket buffer is capped too,
+        # otherwise the kernel would queue seconds of frames
+        writer.transport.set_write_buffer_limits(high=0)
+        sock = writer.get_extra_info('socket')
+        if sock is not None and self._send_buffer_bytes:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF, self._send_buffer_bytes,
+            )
+
+        self._clients += 1
+        try:
+            index = self._jpeg_index
+            while True:
+                jpeg, latest = await self._wait_jpeg(index)
+                self._dropped += latest - index - 1
+                index = latest
+
+                part_header = (
+                    f'--{BOUNDARY}\r\n'
+                    'Content-Type: image/jpeg\r\n'
+                    f'Content-Length: {len(jpeg)}\r\n'
+                    '\r\n'
+                )
+                writer.writelines(
+                    [part_header.encode('latin-1'), jpeg, b'\r\n'],
+                )
+                await writer.drain()
+        finally:
+            self._clients -= 1
+
+    async def _send_snapshot(self, writer, body):
+        self._clients += 1
+        try:
+            jpeg, _ = await asyncio.wait_for(
+                self._wait_jpeg(self._jpeg_index),
+                timeout=self._snapshot_timeout,
+            )
+        except asyncio.TimeoutError:
+            self._respond_json(
+                writer, 503, {'error': 'No frame', 'state': self._message},
+            )
+            return
+        finally:
+            self._clients -= 1
+
+        self._respond(writer, 200, 'image/jpeg', jpeg)
+
+    async def _send_control(self, writer, body):
+        self._respond_json(writer, 200, self._control_state())
+
+    async def _update_control(self, writer, body):
+        # Takes any of `profile`, `hue`, the band colors, `target_fps`,
+        # `recapture`, `save_profile` and `auto_calibrate`, nothing is
+        # applied unless the whole request is valid. Hue and colors apply
+        # over the profile, auto calibration later replaces them all
+        try:
+            request = json.loads(body or b'{}')
+        except json.JSONDecodeError as error:
+            error_msg = f'Invalid JSON: {error}'
+            raise ValueError(error_msg)
+
+        if not isinstance(request, dict):
+            error_msg = 'Control request should be a JSON object'
+            raise ValueError(error_msg)
+
+        unknown = set(request) - {
+            'profile', 'hue', 'target_fps', 'recapture', 'save_profile',
+            'auto_calibrate', *calib.BAND_NAMES,
+        }
+        if unknown:
+            error_msg = f'Unknown settings {sorted(unknown)}'
+            raise ValueError(error_msg)
+
+        profile = None
+        calibration = self._calibration
+        if 'profile' in request:
+            profile = profiles.load_profile(request['profile'])
+            calibration = profile.calibration
+
+        save_name = request.get('save_profile')
+        if save_name is not None:
+            profiles.parse_name(save_name)
+
+        # `true` samples the configured region, `[x, y, w, h]` in
+        # fractions of the frame another one
+        calibrator = None
+        region = request.get('auto_calibrate')
+        if region is True:
+            calibrator = autocalib.AutoCalibrator()
+        elif region not in (None, False):
+            try:
+                region = tuple(float(value) for value in region)
+                calibrator = autocalib.AutoCalibrator(region=region)
+            except (TypeError, ValueError):
+                error_msg = (
+                    f'Auto calibrate takes true or [x, y, w, h], '
+                    f'got {request["auto_calibrate"]!r}'
+                )
+                raise ValueError(error_msg)
+
+        if 'hue' in request:
+            calibration = calibration.with_hue(request['hue'])
+        for index, name in enumerate(calib.BAND_NAMES):
+            if name in request:
+                calibration = calibration.with_color(index, request[name])
+
+        if 'target_fps' in request:
+            target_fps = request['target_fps']
+            if (
+                    isinstance(target_fps, bool)
+                    or not isinstance(target_fps, (int, float))
+            ):
+                error_msg = (
+                    f'Target fps should be a number, got {target_fps!r}'
+                )
+                raise ValueError(error_msg)
+            self._stream.set_target_fps(target_fps)
+
+        if profile is not None:
+            self._profile = profile
+            self._stream.set_profile(profile)
+        self._calibration = calibration
+        self._stream.set_calibration(calibration)
+
+        if save_name is not None:
+            # The mask settings come from the current profile, or the
+            # defaults when none was loaded
+            base = self._profile or profiles.Profile(save_name)
+            saved = base.with_calibration(calibration, name=save_name)
+            try:
+                profiles.save_profile(saved)
+            except OSError as error:
+                self._respond_json(
+                    writer, 500,
+                    {'error': f'Unable to save profile: {error.strerror}'},
+                )
+                return
+            self._profile = saved
+            self._stream.set_profile(saved)
+
+        if request.get('recapture'):
+            self._stream.recapture_background()
+
+        if calibrator is not None:
+            self._calibrating = True
+            self._calibration_message = 'Calibrating'
+            self._stream.auto_calibrate(calibrator)
+
+        self._respond_json(writer, 200, self._control_state())
+
+    def _control_state(self):
+        return {
+            'stream': self._stream.name,
+            'state': None if self._state is None else self._state.name,
+            'message': self._message,
+            'profile': None if self._profile is None else self._profile.name,
+            'profiles': profiles.list_profiles(),
+            'hue': self._calibration.hue,
+            'bands': {
+                name: list(color)
+                for name, color in zip(
+                    calib.BAND_NAMES, self._calibration.colors,
+                )
+            },
+            'calibrating': self._calibrating,
+            'calibration_message': self._calibration_message,
+            'fps': self._stream.fps(),
+            'target_fps': self._stream.target_fps,
+            'frames': self._stream.frame_count,
+            'skipped': self._stream.source.skipped,
+            'encoded': self._jpeg_index,
+            'clients': self._clients,
+            'client_dropped': self._dropped,
+            'stage_ms': self._perf.stage_ms(),
+        }
+
+
+def serve(args):
+    try:
+        profile = cli.load_profile(args.profile)
+    except ValueError as error:
+        sys.stderr.write(f'{error}\n')
+        return 1
+
+    stream_sources, outputs = cli.create_sources(args)
+
+    # Frames stay in BGR, which is what the encoder and the sinks take
+    session = SessionManager(workers=APP.SESSION_WORKERS)
+    stream = session.add_stream(
+        stream_sources[0],
+        **cli.stream_options(target_fps=args.target_fps, output_code=None),
+    )
+    if outputs[0]:
+        stream.add_sink(cli.create_sink(outputs[0]))
+
+    server = CloakServer(
+        session,
+        stream,
+        host=args.host,
+        port=args.port,
+        jpeg_quality=APP.SERVE_JPEG_QUALITY,
+        send_buffer_bytes=APP.SERVE_SEND_BUFFER_BYTES,
+        max_body_bytes=APP.SERVE_MAX_BODY_BYTES,
+        snapshot_timeout=APP.CAMERA_READ_TIMEOUT_MSEC / 1000.0,
+        profile=profile,
+    )
+    try:
+        return asyncio.run(server.run())
+    except OSError as error:
+        # The port is taken or the address is not available
+        session.stop()
+        sys.stderr.write(f'Unable to serve: {error}\n')
+        return 1
+    except KeyboardInterrupt:
+        return 0
@@ -0,0 +1,646 @@
+import os
+import time
+import enum
+import threading
+import collections
+import concurrent.futures
+
+
+import numpy as np
+
+
+from . import opencv
+from . import sources
+from .background import BackgroundModel
+from .perf import PerfRecorder
+
+
+class FrameQueue:
+    def __init__(self, maxsize=1):
+        if maxsize < 1:
+            error_msg = f'Queue size should be at least 1, got {maxsize}'
+            raise ValueError(error_msg)
+
+        self._lock = threading.Lock()
+        self._frames = collections.deque(maxlen=maxsize)
+        self._free_frames = collections.deque()
+        self._dropped = 0
+        self._timestamp = None
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    @property
+    def timestamp(self):
+        # Capture time of the frame last returned by `get`
+        return self._timestamp
+
+    def acquire(self, shape):
+        # Reuse a frame buffer the consumer is done with, if any
+        with self._lock:
+            while self._free_frames:
+                frame = self._free_frames.pop()
+                if frame.shape == shape:
+                    return frame
+
+        return np.empty(shape, np.uint8)
+
+    def release(self, frame):
+        with self._lock:
+            self._free_frames.append(frame)
+
+    def put(self, frame, timestamp=None):
+        with self._lock:
+            # Latest frame wins, the oldest queued frame is discarded
+            if len(self._frames) == self._frames.maxlen:
+                self._dropped += 1
+                self._free_frames.append(self._frames.popleft()[0])
+            self._frames.append((frame, timestamp))
+
+    def get(self):
+        with self._lock:
+            if not self._frames:
+                return
+            frame, self._timestamp = self._frames.pop()
+            self._dropped += len(self._frames)
+            self._free_frames.extend(frame for frame, _ in self._frames)
+            self._frames.clear()
+            return frame
+
+
+@enum.unique
+class CAPTURE_STATE(enum.Enum):
+    OPENING = 0
+    WARMING_UP = 1
+    CAPTURING_BACKGROUND = 2
+    RUNNING = 3
+    FAILED = 4
+    STOPPED = 5
+
+
+class Stream:
+    # One source with its own background, calibration and processor. The
+    # work is cut into short steps so a pool can interleave many streams
+    THROUGHPUT_WINDOW = 60
+
+    def __init__(
+            self, source, name=None, background_delay=3.0, queue_size=1,
+            processor_options=None, recorder=None,
+            background_frames=30, background_learning_rate=0.02,
+            background_update_interval=1, read_timeout=5.0, target_fps=0,
+            drop_stale=True,
+    ):
+        # Live sources are read on their own thread so the stream always
+        # gets the newest frame, however long the last one took
+        if drop_stale and source.live:
+            source = sources.LatestFrameSource(source)
+
+        self._source = source
+        self._name = name or source.name
+        self._background_delay = background_delay
+        self._read_timeout = read_timeout
+        self._processor_options = processor_options or {}
+        self._recorder = recorder or PerfRecorder()
+        self._background_frames = background_frames
+        self._background_model = BackgroundModel(
+            learning_rate=background_learning_rate,
+            update_interval=background_update_interval,
+        )
+
+        self._queue = FrameQueue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+        self._recapture_event = threading.Event()
+
+        self._calibration_lock = threading.Lock()
+        self._calibration = None
+        self._band_tables = None
+        self._profile = None
+        self._frame_interval = 0.0
+        self._next_frame_time = 0.0
+        self.set_target_fps(target_fps)
+
+        self._sinks_lock = threading.Lock()
+        self._sinks = []
+
+        self._frame_ready_callback = None
+        self._state_changed_callback = None
+        self._background_captured_callback = None
+        self._calibrated_callback = None
+        self._calibrator = None
+
+        self._state = None
+        self._start_time = None
+        self._startup_time = None
+        self._warm_up_deadline = None
+        self._read_deadline = None
+        self._reader = None
+        self._background_buffer = []
+        self._processor = None
+        self._processor_tables = None
+        self._processor_profile = None
+        self._frame_count = 0
+        self._frame_times = collections.deque(maxlen=self.THROUGHPUT_WINDOW)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def live(self):
+        return self._source.live
+
+    @property
+    def queue(self):
+        return self._queue
+
+    @property
+    def recorder(self):
+        return self._recorder
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def startup_time(self):
+        # Seconds from the first step to the first processed frame
+        return self._startup_time
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    @property
+    def sinks(self):
+        with self._sinks_lock:
+            return list(self._sinks)
+
+    @property
+    def calibration(self):
+        with self._calibration_lock:
+            return self._calibration
+
+    @property
+    def profile(self):
+        with self._calibration_lock:
+            return self._profile
+
+    @property
+    def target_fps(self):
+        if not self._frame_interval:
+            return 0.0
+        return 1.0 / self._frame_interval
+
+    def fps(self):
+        frame_times = list(self._frame_times)
+        if len(frame_times) < 2:
+            return 0.0
+
+        elapsed = frame_times[-1] - frame_times[0]
+        if elapsed <= 0:
+            return 0.0
+
+        return (len(frame_times) - 1) / elapsed
+
+    def stats(self):
+        return {
+            'state': None if self._state is None else self._state.name,
+            'fps': self.fps(),
+            'frames': self._frame_count,
+            'dropped': self._queue.dropped,
+            'skipped': self._source.skipped,
+            'target_fps': self.target_fps,
+            'sinks': {sink.name: sink.stats() for sink in self.sinks},
+        }
+
+    def set_callbacks(
+            self, frame_ready=None, state_changed=None,
+            background_captured=None, calibrated=None,
+    ):
+        # Called from the pool threads, `frame_ready(stream)`,
+        # `state_changed(stream, state, message)`,
+        # `background_captured(stream)` and
+        # `calibrated(stream, calibration, message)`
+        self._frame_ready_callback = frame_ready
+        self._state_changed_callback = state_changed
+        self._background_captured_callback = background_captured
+        self._calibrated_callback = calibrated
+
+    def auto_calibrate(self, calibrator):
+        # The next frames read go to `calibrator` as well, once it has
+        # enough the result goes to the `calibrated` callback, with `None`
+        # and the reason when no calibration could be derived. `None`
+        # cancels a calibration in progress
+        self._calibrator = calibrator
+
+    def set_calibration(self, calibration):
+        # Snapshots are immutable, the processor takes the newest one
+        # before its next frame however often it was replaced meanwhile.
+        # Its tables are looked up here, not on the pool thread
+        band_tables = opencv.band_tables(calibration.bands)
+        with self._calibration_lock:
+            self._calibration = calibration
+            self._band_tables = band_tables
+
+    def set_profile(self, profile):
+        # The calibration and the mask settings of `profile` together, its
+        # tables were built when the profile was made
+        with self._calibration_lock:
+            self._profile = profile
+            self._calibration = profile.calibration
+            self._band_tables = profile.tables
+
+    def set_target_fps(self, target_fps):
+        # `0` processes every new frame as soon as it arrives
+        if target_fps < 0:
+            error_msg = f'Target fps should not be negative, got {target_fps}'
+            raise ValueError(error_msg)
+
+        self._frame_interval = 1.0 / target_fps if target_fps else 0.0
+
+    def add_sink(self, sink):
+        # Processed frames are copied to the sink, which the stream
+        # closes when it stops
+        with self._sinks_lock:
+            self._sinks.append(sink)
+
+    def recapture_background(self):
+        # Picked up by the stream before its next frame
+        self._recapture_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def step(self):
+        # Runs one unit of work, returns False once the stream is done.
+        # A stream never has two steps in flight, so its state is only
+        # ever touched by one thread at a time
+        if self._stop_event.is_set():
+            return False
+
+        try:
+            if self._state is None:
+                self._open()
+            elif self._state == CAPTURE_STATE.WARMING_UP:
+                self._warm_up()
+            elif self._state == CAPTURE_STATE.CAPTURING_BACKGROUND:
+                self._capture_background()
+            elif self._state == CAPTURE_STATE.RUNNING:
+                self._process()
+        except (RuntimeError, TimeoutError) as error:
+            self._set_state(CAPTURE_STATE.FAILED, str(error))
+            return False
+        except Exception as error:
+            # Anything else, like a frame of another size or an opencv
+            # error, fails the stream as well instead of dying unreported
+            self._set_state(
+                CAPTURE_STATE.FAILED, f'{self._name} failed: {error}',
+            )
+            return False
+
+        return not self._stop_event.is_set()
+
+    def close(self):
+        self._source.release()
+
+        with self._sinks_lock:
+            sinks = self._sinks
+            self._sinks = []
+        for sink in sinks:
+            try:
+                sink.close()
+            except RuntimeError as error:
+                self._set_state(CAPTURE_STATE.FAILED, str(error))
+
+        if self._state != CAPTURE_STATE.FAILED:
+            self._set_state(CAPTURE_STATE.STOPPED, f'{self._name} stopped')
+
+    def _set_state(self, state, message):
+        self._state = state
+        if self._state_changed_callback is not None:
+            self._state_changed_callback(self, state, message)
+
+    def _open(self):
+        self._start_time = time.monotonic()
+        self._set_state(CAPTURE_STATE.OPENING, f'Opening {self._name}')
+        if not self._source.open(stop_event=self._stop_event):
+            if self._stop_event.is_set():
+                return
+            error_msg = f'Unable to open {self._name}'
+            raise RuntimeError(error_msg)
+
+        # Wait some time for capture to initialize
+        self._reader = opencv.FrameReader(self._source)
+        self._warm_up_deadline = time.monotonic() + self._background_delay
+        self._set_state(
+            CAPTURE_STATE.WARMING_UP,
+            f'Warming up {self._name}',
+        )
+
+    def _warm_up(self):
+        # Waits in short slices, a long wait would hold a pool thread
+        remaining = self._warm_up_deadline - time.monotonic()
+        if remaining > 0:
+            self._stop_event.wait(min(remaining, 0.05))
+            return
+
+        self._start_background_capture()
+
+    def _start_background_capture(self):
+        self._background_buffer = []
+        self._read_deadline = time.monotonic() + self._read_timeout
+        self._set_state(
+            CAPTURE_STATE.CAPTURING_BACKGROUND,
+            f'Capturing background 1/{self._background_frames}',
+        )
+
+    def _read(self):
+        # A missing frame ends the step, the stream fails once no frame
+        # arrived for `read_timeout` seconds
+        frame = self._reader.read()
+        if frame is not None:
+            self._read_deadline = time.monotonic() + self._read_timeout
+            return frame
+
+        if time.monotonic() > self._read_deadline:
+            error_msg = (
+                f'No frame from {self._name} '
+                f'for {self._read_timeout:.1f}s'
+            )
+            raise TimeoutError(error_msg)
+
+    def _capture_background(self):
+        frame = self._read()
+        if frame is None:
+            return
+
+        self._background_buffer.append(frame.copy())
+        if len(self._background_buffer) < self._background_frames:
+            self._set_state(
+                CAPTURE_STATE.CAPTURING_BACKGROUND,
+                f'Capturing background '
+                f'{len(self._background_buffer) + 1}'
+                f'/{self._background_frames}',
+            )
+            return
+
+        background = self._background_model.initialize(
+            self._background_buffer
+        )
+        self._background_buffer = []
+
+        if self._processor is None:
+            self._processor = opencv.CloakProcessor(
+                background=background,
+                **self._processor_options,
+            )
+            self._startup_time = time.monotonic() - self._start_time
+            message = f'Started in {self._startup_time:.2f}s'
+        else:
+            self._processor.set_background(background)
+            message = 'Background recaptured'
+
+        if self._background_captured_callback is not None:
+            self._background_captured_callback(self)
+        self._set_state(CAPTURE_STATE.RUNNING, message)
+
+    def _process(self):
+        if self._recapture_event.is_set():
+            self._recapture_event.clear()
+            self._start_background_capture()
+            return
+
+        with self._calibration_lock:
+            band_tables = self._band_tables
+            profile = self._profile
+        if band_tables is None:
+            self._stop_event.wait(0.01)
+            return
+
+        if profile is not self._processor_profile:
+            options = profile.processor_options()
+            self._processor.set_mask_scale(options['mask_scale'])
+            self._processor.set_morphology(
+                options['open_iterations'],
+                options['dilate_iterations'],
+                options['morph_strategy'],
+            )
+            self._processor_profile = profile
+
+        if band_tables is not self._processor_tables:
+            self._processor.set_band_tables(band_tables)
+            self._processor_tables = band_tables
+
+        # Above the target rate the stream waits for its next slot, the
+        # frame read then is the newest one
+        frame_interval = self._frame_interval
+        if frame_interval:
+            remaining = self._next_frame_time - time.perf_counter()
+            if remaining > 0:
+                self._stop_event.wait(min(remaining, 0.05))
+                return
+
+        timer = self._recorder.timer()
+        frame = self._read()
+        if frame is None:
+            return
+        capture_time = self._source.frame_time or time.perf_counter()
+        timer.lap('read')
+
+        # Sampled before the composite is built on the frame
+        calibrator = self._calibrator
+        if calibrator is not None:
+            self._sample_calibration(calibrator, frame)
+            timer.lap('calibrate')
+
+        # The cadence is kept while on schedule, after a stall it starts
+        # over instead of rushing through the missed slots
+        if frame_interval:
+            now = time.perf_counter()
+            if now - self._next_frame_time > frame_interval:
+                self._next_frame_time = now
+            self._next_frame_time += frame_interval
+
+        # The output buffer is owned by the consumer until it is
+        # released back to the queue. The composite is built on the read
+        # buffer, the background model only learns the pixels outside
+        # the mask, which stay untouched
+        output = self._queue.acquire(frame.shape)
+        self._processor.process(
+            frame, out=output, timer=timer, in_place=True,
+        )
+        self._background_model.update(frame, self._processor.mask)
+        timer.lap('background')
+
+        for sink in self.sinks:
+            self._write_sink(sink, output)
+        timer.lap('sinks')
+
+        self._queue.put(output, timestamp=capture_time)
+        self._frame_count += 1
+        self._frame_times.append(time.perf_counter())
+        if self._frame_ready_callback is not None:
+            self._frame_ready_callback(self)
+
+    def _sample_calibration(self, calibrator, frame):
+        calibrator.add(frame)
+        if not calibrator.done:
+            return
+
+        # A calibrator handed in meanwhile starts over, not this one
+        if self._calibrator is calibrator:
+            self._calibrator = None
+        try:
+            calibration = calibrator.calibration()
+            message = f'Calibrated from {calibrator.frames} frames'
+        except ValueError as error:
+            calibration = None
+            message = str(error)
+
+        if self._calibrated_callback is not None:
+            self._calibrated_callback(self, calibration, message)
+
+    def _write_sink(self, sink, frame):
+        # A broken output is dropped, the stream itself keeps running
+        try:
+            sink.write(frame)
+        except RuntimeError as error:
+            with self._sinks_lock:
+                self._sinks.remove(sink)
+            self._set_state(CAPTURE_STATE.RUNNING, str(error))
+
+
+class SessionManager:
+    # Runs any number of streams on one pool sized to the cores, every
+    # stream resubmits its next step when the current one is done. Live
+    # streams wait on their camera for every frame, each runs its steps on
+    # a thread of its own so the pool never waits on a read
+    def __init__(self, workers=0):
+        self._workers = workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._streams = []
+        self._executor = None
+        self._live_threads = []
+        self._stopping = False
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def streams(self):
+        with self._lock:
+            return list(self._streams)
+
+    def get_stream(self, name):
+        for stream in self.streams:
+            if stream.name == name:
+                return stream
+
+    def add_stream(self, source, **stream_options):
+        name = stream_options.pop('name', None) or source.name
+        names = {stream.name for stream in self.streams}
+        unique_name = name
+        index = 1
+        while unique_name in names:
+            index += 1
+            unique_name = f'{name} ({index})'
+
+        stream = Stream(source, name=unique_name, **stream_options)
+        with self._lock:
+            self._streams.append(stream)
+            running = self._executor is not None
+
+        if running:
+            self._start_stream(stream)
+
+        return stream
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._stopping = False
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._workers,
+                thread_name_prefix='cvcloak',
+            )
+
+        for stream in self.streams:
+            self._start_stream(stream)
+
+    def stop(self):
+        with self._lock:
+            executor = self._executor
+            live_threads = self._live_threads
+            self._live_threads = []
+            self._stopping = True
+
+        for stream in self.streams:
+            stream.stop()
+
+        for thread in live_threads:
+            thread.join()
+
+        if executor is not None:
+            executor.shutdown(wait=True)
+        else:
+            # Streams of a session that never started still own sinks
+            for stream in self.streams:
+                stream.close()
+
+        with self._lock:
+            self._executor = None
+
+    def stats(self):
+        return {stream.name: stream.stats() for stream in self.streams}
+
+    def _start_stream(self, stream):
+        if not stream.live:
+            self._schedule(stream)
+            return
+
+        with self._lock:
+            if self._stopping or self._executor is None:
+                stream.close()
+                return
+            thread = threading.Thread(
+                target=self._run_live,
+                args=(stream,),
+                name=f'cvcloak-{stream.name}',
+                daemon=True,
+            )
+            self._live_threads.append(thread)
+            thread.start()
+
+    def _schedule(self, stream):
+        with self._lock:
+            if self._stopping or self._executor is None:
+                stream.close()
+                return
+            self._executor.submit(self._run_step, stream)
+
+    def _run_step(self, stream):
+        # Errors of the step itself fail the stream, anything raised
+        # beyond that still releases the source
+        running = False
+        try:
+            running = stream.step()
+        finally:
+            if running:
+                self._schedule(stream)
+            else:
+                stream.close()
+
+    def _run_live(self, stream):
+        running = True
+        try:
+            while running:
+                running = stream.step()
+        finally:
+            stream.close()
@@ -0,0 +1,274 @@
+import os
+import sys
+import enum
+import threading
+import collections
+
+
+import cv2
+import numpy as np
+
+
+PIPE_SPEC = '-'
+
+
+@enum.unique
+class SINK_POLICY(enum.Enum):
+    DROP_OLDEST = 0
+    BLOCK = 1
+
+
+class FrameSink:
+    # Frames are copied into a bounded queue and written on the sink's
+    # own thread, a slow encoder never stalls the producer unless the
+    # policy asks it to wait
+    def __init__(
+            self, maxsize=8, policy=SINK_POLICY.DROP_OLDEST, color_code=None,
+    ):
+        if maxsize < 1:
+            error_msg = f'Sink queue size should be at least 1, got {maxsize}'
+            raise ValueError(error_msg)
+
+        self._maxsize = maxsize
+        self._policy = policy
+        self._color_code = color_code
+
+        self._condition = threading.Condition()
+        self._frames = collections.deque()
+        self._free_frames = []
+        self._converted = None
+        self._dropped = 0
+        self._written = 0
+        self._closed = False
+        self._error = None
+
+        self._thread = threading.Thread(
+            target=self._run,
+            name=type(self).__name__,
+            daemon=True,
+        )
+        self._thread.start()
+
+    @property
+    def name(self):
+        return type(self).__name__
+
+    @property
+    def depth(self):
+        return len(self._frames)
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    @property
+    def written(self):
+        return self._written
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'dropped': self._dropped,
+            'written': self._written,
+        }
+
+    def write(self, frame):
+        with self._condition:
+            self._raise_error()
+            if self._closed:
+                error_msg = f'{self.name} is closed'
+                raise RuntimeError(error_msg)
+
+            if self._policy == SINK_POLICY.BLOCK:
+                while (
+                        len(self._frames) >= self._maxsize
+                        and self._error is None
+                ):
+                    self._condition.wait()
+                self._raise_error()
+            elif len(self._frames) >= self._maxsize:
+                self._dropped += 1
+                self._free_frames.append(self._frames.popleft())
+
+            buffer = self._acquire(frame)
+
+        # The buffer is not queued yet, the copy needs no lock
+        np.copyto(buffer, frame)
+
+        with self._condition:
+            self._frames.append(buffer)
+            self._condition.notify_all()
+
+    def close(self):
+        # Writes out what is queued, then releases the output
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        self._thread.join()
+
+        with self._condition:
+            self._raise_error()
+
+    def _acquire(self, frame):
+        while self._free_frames:
+            buffer = self._free_frames.pop()
+            if buffer.shape == frame.shape:
+                return buffer
+
+        return np.empty_like(frame)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._frames and not self._closed:
+                    self._condition.wait()
+                if not self._frames:
+                    break
+                frame = self._frames.popleft()
+                self._condition.notify_all()
+
+            try:
+                output = frame
+                if self._color_code is not None:
+                    output = self._converted = cv2.cvtColor(
+                        frame, self._color_code, dst=self._converted,
+                    )
+                self._write_frame(output)
+            except (RuntimeError, OSError, cv2.error) as error:
+                error_msg = f'{self.name} failed: {error}'
+                with self._condition:
+                    self._error = RuntimeError(error_msg)
+                    self._frames.clear()
+                    self._condition.notify_all()
+                break
+            finally:
+                with self._condition:
+                    self._free_frames.append(frame)
+
+            self._written += 1
+
+        try:
+            self._close_output()
+        except (RuntimeError, OSError, cv2.error) as error:
+            if self._error is None:
+                error_msg = f'{self.name} failed: {error}'
+                self._error = RuntimeError(error_msg)
+
+    def _write_frame(self, frame):
+        raise NotImplementedError
+
+    def _close_output(self):
+        pass
+
+
+class VideoFileSink(FrameSink):
+    def __init__(
+            self, file_path, fps=30.0, fourcc='mp4v', frame_size=None,
+            **sink_options,
+    ):
+        self._file_path = file_path
+        self._fps = fps
+        self._fourcc = fourcc
+        self._writer = None
+
+        # With a known frame size the file is opened right away, so a bad
+        # path or codec shows up before any frame is produced
+        if frame_size is not None:
+            self._open(frame_size)
+
+        super().__init__(**sink_options)
+
+    @property
+    def name(self):
+        return os.path.basename(self._file_path)
+
+    def _open(self, frame_size):
+        self._writer = cv2.VideoWriter(
+            self._file_path,
+            cv2.VideoWriter_fourcc(*self._fourcc),
+            self._fps,
+            frame_size,
+        )
+        if not self._writer.isOpened():
+            error_msg = f'Unable to open output "{self._file_path}"'
+            raise RuntimeError(error_msg)
+
+    def _write_frame(self, frame):
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._open((width, height))
+
+        self._writer.write(frame)
+
+    def _close_output(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+class ImageSequenceSink(FrameSink):
+    def __init__(self, directory, extension='.png', **sink_options):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._extension = extension
+        self._index = 0
+
+        super().__init__(**sink_options)
+
+    @property
+    def name(self):
+        return os.path.basename(os.path.normpath(self._directory))
+
+    def _write_frame(self, frame):
+        file_path = os.path.join(
+            self._directory, f'frame_{self._index:06d}{self._extension}',
+        )
+        if not cv2.imwrite(file_path, frame):
+            error_msg = f'Unable to write "{file_path}"'
+            raise RuntimeError(error_msg)
+
+        self._index += 1
+
+
+class PipeSink(FrameSink):
+    # Raw BGR frames one after another, for example for
+    # `ffmpeg -f rawvideo -pix_fmt bgr24 -s WxH -i - ...`
+    def __init__(self, stream=None, **sink_options):
+        self._stream = stream or sys.stdout.buffer
+
+        super().__init__(**sink_options)
+
+    @property
+    def name(self):
+        return 'pipe'
+
+    def _write_frame(self, frame):
+        self._stream.write(np.ascontiguousarray(frame).data)
+
+    def _close_output(self):
+        self._stream.flush()
+
+
+def create_sink(
+        spec, fps=30.0, fourcc='mp4v', frame_size=None, **sink_options,
+):
+    # `-` is stdout, a directory or a path without an extension takes an
+    # image sequence and anything else is a video file
+    if spec == PIPE_SPEC:
+        return PipeSink(**sink_options)
+
+    if os.path.isdir(spec) or not os.path.splitext(spec)[1]:
+        return ImageSequenceSink(spec, **sink_options)
+
+    return VideoFileSink(
+        spec,
+        fps=fps,
+        fourcc=fourcc,
+        frame_size=frame_size,
+        **sink_options,
+    )
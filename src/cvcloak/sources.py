@@ -0,0 +1,561 @@
+import os
+import json
+import time
+import threading
+
+
+import cv2
+import numpy as np
+
+
+from .conf import APP
+from . import opencv
+
+
+IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff')
+SESSION_EXTENSION = '.json'
+
+
+class FrameSource:
+    # Sources keep the reading interface of `cv2.VideoCapture`, so the
+    # `opencv` helpers and the pipelines accept either
+    def __init__(self, fps=None, realtime=False):
+        self._fps = fps
+        self._realtime = realtime
+        self._opened = False
+        self._start_time = None
+        self._first_timestamp = None
+
+    @property
+    def name(self):
+        return type(self).__name__
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @property
+    def live(self):
+        # Frames keep coming at their own pace whether they are read or not
+        return self._realtime
+
+    @property
+    def skipped(self):
+        # Frames that went stale before they were read
+        return 0
+
+    @property
+    def frame_time(self):
+        # `time.perf_counter` at which the frame last read arrived, if the
+        # source knows better than the time `read` returned
+        return
+
+    def open(self, stop_event=None):
+        self._opened = True
+        return True
+
+    def isOpened(self):
+        return self._opened
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FPS:
+            return self._fps or 0.0
+
+        return 0.0
+
+    def set(self, prop_id, value):
+        return False
+
+    def read(self, image=None):
+        raise NotImplementedError
+
+    def release(self):
+        self._opened = False
+
+    def _pace(self, timestamp):
+        # Holds the frame back until its original time has come, when
+        # replaying in real time, otherwise frames go as fast as possible
+        if not self._realtime or timestamp is None:
+            return
+
+        now = time.perf_counter()
+        if self._start_time is None:
+            self._start_time = now
+            self._first_timestamp = timestamp
+            return
+
+        delay = (timestamp - self._first_timestamp) - (now - self._start_time)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _copy_into(self, frame, image):
+        if image is None or image.shape != frame.shape:
+            return frame.copy()
+
+        np.copyto(image, frame)
+        return image
+
+
+class CameraSource(FrameSource):
+    def __init__(
+            self, camera_int, width, height, timeout=None,
+            retry_delay=0.1, max_retry_delay=2.0,
+    ):
+        super().__init__()
+        self._camera_int = camera_int
+        self._width = width
+        self._height = height
+        self._timeout = timeout
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._capture = None
+
+    @property
+    def name(self):
+        return f'camera {self._camera_int}'
+
+    @property
+    def live(self):
+        return True
+
+    @property
+    def fps(self):
+        if self._capture is None:
+            return
+        return self._capture.get(cv2.CAP_PROP_FPS) or None
+
+    def open(self, stop_event=None):
+        self._capture = opencv.open_capture(
+            camera_int=self._camera_int,
+            width=self._width,
+            height=self._height,
+            timeout=self._timeout,
+            retry_delay=self._retry_delay,
+            max_retry_delay=self._max_retry_delay,
+            stop_event=stop_event,
+        )
+        self._opened = self._capture is not None
+        return self._opened
+
+    def get(self, prop_id):
+        if self._capture is None:
+            return 0.0
+        return self._capture.get(prop_id)
+
+    def set(self, prop_id, value):
+        if self._capture is None:
+            return False
+        return self._capture.set(prop_id, value)
+
+    def read(self, image=None):
+        if self._capture is None:
+            return False, None
+        return self._capture.read(image)
+
+    def release(self):
+        if self._capture is not None:
+            opencv.close_capture(self._capture)
+            self._capture = None
+        super().release()
+
+
+class VideoFileSource(FrameSource):
+    def __init__(self, file_path, loop=False, realtime=False):
+        super().__init__(realtime=realtime)
+        self._file_path = file_path
+        self._loop = loop
+        self._capture = None
+        self._index = 0
+
+    @property
+    def name(self):
+        return os.path.basename(self._file_path)
+
+    def open(self, stop_event=None):
+        self._capture = cv2.VideoCapture(self._file_path)
+        self._opened = self._capture.isOpened()
+        self._fps = self._capture.get(cv2.CAP_PROP_FPS) or None
+        self._index = 0
+        return self._opened
+
+    def get(self, prop_id):
+        if self._capture is None:
+            return 0.0
+        return self._capture.get(prop_id)
+
+    def read(self, image=None):
+        if self._capture is None:
+            return False, None
+
+        ret, frame = self._capture.read(image)
+        if not ret and self._loop and self._index:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._capture.read(image)
+
+        if ret:
+            if self._fps:
+                self._pace(self._index / self._fps)
+            self._index += 1
+
+        return ret, frame
+
+    def release(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+        super().release()
+
+
+class ImageDirectorySource(FrameSource):
+    def __init__(self, directory, fps=30.0, loop=False, realtime=False):
+        super().__init__(fps=fps, realtime=realtime)
+        self._directory = directory
+        self._loop = loop
+        self._paths = []
+        self._index = 0
+
+    @property
+    def name(self):
+        return os.path.basename(os.path.normpath(self._directory))
+
+    def open(self, stop_event=None):
+        self._paths = sorted(
+            os.path.join(self._directory, file_name)
+            for file_name in os.listdir(self._directory)
+            if file_name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self._index = 0
+        self._opened = bool(self._paths)
+        return self._opened
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self._paths)
+        return super().get(prop_id)
+
+    def read(self, image=None):
+        if self._index >= len(self._paths):
+            if not self._loop or not self._paths:
+                return False, None
+            self._index = 0
+
+        frame = cv2.imread(self._paths[self._index % len(self._paths)])
+        self._pace(self._index / self._fps if self._fps else None)
+        self._index += 1
+
+        if frame is None:
+            return False, None
+
+        return True, self._copy_into(frame, image)
+
+    def release(self):
+        self._paths = []
+        super().release()
+
+
+class ArraySource(FrameSource):
+    # Frames come from a sequence or a generator of BGR arrays, which
+    # stands in for a camera on machines without one
+    def __init__(self, frames, fps=None, loop=False, realtime=False):
+        super().__init__(fps=fps, realtime=realtime)
+        self._frames = frames
+        self._loop = loop
+        self._iterator = None
+        self._index = 0
+
+    def open(self, stop_event=None):
+        self._iterator = iter(self._frames)
+        self._index = 0
+        self._opened = True
+        return True
+
+    def read(self, image=None):
+        if self._iterator is None:
+            return False, None
+
+        frame = next(self._iterator, None)
+        if frame is None and self._loop and self._index:
+            self._iterator = iter(self._frames)
+            frame = next(self._iterator, None)
+
+        if frame is None:
+            return False, None
+
+        self._pace(self._index / self._fps if self._fps else None)
+        self._index += 1
+
+        return True, self._copy_into(frame, image)
+
+    def release(self):
+        self._iterator = None
+        super().release()
+
+
+class ReplaySource(FrameSource):
+    # Plays back a session written by `SessionRecorder` with its
+    # original frame timing, or as fast as possible
+    def __init__(self, session_path, realtime=True):
+        super().__init__(realtime=realtime)
+        self._session_path = session_path
+        self._capture = None
+        self._timestamps = []
+        self._index = 0
+
+    @property
+    def name(self):
+        return os.path.basename(self._session_path)
+
+    @property
+    def timestamps(self):
+        return self._timestamps
+
+    def open(self, stop_event=None):
+        with open(self._session_path, 'r') as f:
+            session = json.load(f)
+
+        video_path = os.path.join(
+            os.path.dirname(self._session_path), session['video'],
+        )
+        self._timestamps = session['timestamps']
+        self._fps = session.get('fps')
+        self._capture = cv2.VideoCapture(video_path)
+        self._index = 0
+        self._opened = self._capture.isOpened()
+        return self._opened
+
+    def read(self, image=None):
+        if self._capture is None or self._index >= len(self._timestamps):
+            return False, None
+
+        ret, frame = self._capture.read(image)
+        if not ret:
+            return False, None
+
+        self._pace(self._timestamps[self._index])
+        self._index += 1
+
+        return ret, frame
+
+    def release(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+        super().release()
+
+
+class SessionRecorder:
+    def __init__(self, session_path, fps=30.0, fourcc='MJPG'):
+        self._session_path = session_path
+        self._video_name = (
+            os.path.splitext(os.path.basename(session_path))[0] + '.avi'
+        )
+        self._fps = fps
+        self._fourcc = fourcc
+        self._writer = None
+        self._timestamps = []
+
+    def write(self, frame, timestamp=None):
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._writer = cv2.VideoWriter(
+                os.path.join(
+                    os.path.dirname(self._session_path), self._video_name,
+                ),
+                cv2.VideoWriter_fourcc(*self._fourcc),
+                self._fps,
+                (width, height),
+            )
+
+        if timestamp is None:
+            timestamp = time.perf_counter()
+
+        self._writer.write(frame)
+        self._timestamps.append(timestamp)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+        session = {
+            'video': self._video_name,
+            'fps': self._fps,
+            'timestamps': self._timestamps,
+        }
+        with open(self._session_path, 'w') as f:
+            json.dump(session, f)
+
+
+class RecordingSource(FrameSource):
+    # Tees every frame read from `source` into a replayable session
+    def __init__(self, source, session_path, fourcc='MJPG'):
+        super().__init__()
+        self._source = source
+        self._session_path = session_path
+        self._fourcc = fourcc
+        self._recorder = None
+
+    @property
+    def name(self):
+        return self._source.name
+
+    @property
+    def fps(self):
+        return self._source.fps
+
+    @property
+    def live(self):
+        return self._source.live
+
+    def open(self, stop_event=None):
+        self._opened = self._source.open(stop_event=stop_event)
+        if self._opened:
+            self._recorder = SessionRecorder(
+                self._session_path,
+                fps=self._source.fps or 30.0,
+                fourcc=self._fourcc,
+            )
+        return self._opened
+
+    def get(self, prop_id):
+        return self._source.get(prop_id)
+
+    def set(self, prop_id, value):
+        return self._source.set(prop_id, value)
+
+    def read(self, image=None):
+        ret, frame = self._source.read(image)
+        if ret and self._recorder is not None:
+            self._recorder.write(frame)
+
+        return ret, frame
+
+    def release(self):
+        self._source.release()
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+        super().release()
+
+
+class LatestFrameSource(FrameSource):
+    # Reads a live source on its own thread and keeps only the newest
+    # frame. A reader that falls behind gets the latest frame instead of
+    # the ones that piled up in the capture meanwhile
+    def __init__(self, source, timeout=0.1):
+        super().__init__()
+        self._source = source
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._frame = None
+        self._spare_frame = None
+        self._arrival_time = None
+        self._read_time = None
+        self._index = 0
+        self._read_index = 0
+        self._skipped = 0
+
+    @property
+    def name(self):
+        return self._source.name
+
+    @property
+    def fps(self):
+        return self._source.fps
+
+    @property
+    def live(self):
+        return True
+
+    @property
+    def skipped(self):
+        return self._skipped
+
+    @property
+    def frame_time(self):
+        return self._read_time
+
+    def open(self, stop_event=None):
+        self._opened = self._source.open(stop_event=stop_event)
+        if self._opened:
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name=type(self).__name__,
+                daemon=True,
+            )
+            self._thread.start()
+
+        return self._opened
+
+    def get(self, prop_id):
+        return self._source.get(prop_id)
+
+    def set(self, prop_id, value):
+        return self._source.set(prop_id, value)
+
+    def read(self, image=None):
+        # Waits up to `timeout` for a frame newer than the last one read
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._index != self._read_index,
+                timeout=self._timeout,
+            )
+            if self._index == self._read_index:
+                return False, None
+
+            self._skipped += self._index - self._read_index - 1
+            self._read_index = self._index
+            self._read_time = self._arrival_time
+
+            return True, self._copy_into(self._frame, image)
+
+    def release(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        self._source.release()
+        super().release()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            # Readers copy under the lock, the spare frame is never shared
+            ret, frame = self._source.read(self._spare_frame)
+            if not ret:
+                self._stop_event.wait(0.01)
+                continue
+
+            with self._condition:
+                self._spare_frame = self._frame
+                self._frame = frame
+                self._arrival_time = time.perf_counter()
+                self._index += 1
+                self._condition.notify_all()
+
+
+def create_source(spec, fps=None, loop=False, realtime=False):
+    # An int is a camera index, a directory holds frames, a `.json` file
+    # is a recorded session and anything else is a video file
+    if isinstance(spec, int) or str(spec).isdigit():
+        return CameraSource(
+            camera_int=int(spec),
+            width=APP.IMAGE_WIDTH,
+            height=APP.IMAGE_HEIGHT,
+            timeout=APP.CAMERA_OPEN_TIMEOUT_MSEC / 1000.0,
+            retry_delay=APP.CAMERA_RETRY_DELAY_MSEC / 1000.0,
+            max_retry_delay=APP.CAMERA_MAX_RETRY_DELAY_MSEC / 1000.0,
+        )
+
+    if os.path.isdir(spec):
+        return ImageDirectorySource(
+            spec, fps=fps or 30.0, loop=loop, realtime=realtime,
+        )
+
+    if spec.lower().endswith(SESSION_EXTENSION):
+        return ReplaySource(spec, realtime=realtime)
+
+    return VideoFileSource(spec, loop=loop, realtime=realtime)
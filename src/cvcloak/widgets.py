@@ -1,5 +1,6 @@
+import time
 import enum
-from functools import partial
+from functools import partial, lru_cache
 import contextlib
 
 
@@ -7,6 +8,7 @@ from PySide2 import QtWidgets, QtCore, QtGui
 
 
 from .conf import APP
+from .perf import PerfRecorder
 
 
 @contextlib.contextmanager
@@ -16,6 +18,33 @@ def block_widget_signals(widget):
     widget.blockSignals(False)
 
 
+def refresh_interval_msec():
+    # One refresh of the primary screen, widgets updated more often than
+    # that only cost time on the GUI thread
+    if APP.CALIB_UPDATE_MSEC:
+        return APP.CALIB_UPDATE_MSEC
+
+    refresh_rate = 0.0
+    screen = QtGui.QGuiApplication.primaryScreen()
+    if screen is not None:
+        refresh_rate = screen.refreshRate()
+    if refresh_rate <= 0:
+        refresh_rate = 60.0
+
+    return max(1, int(1000 / refresh_rate))
+
+
+@lru_cache(maxsize=None)
+def load_app_font():
+    # Registered with Qt once, every widget then uses the family by name
+    font_id = QtGui.QFontDatabase.addApplicationFont(APP.FONT_FILE_PATH)
+    if font_id == -1:
+        error_msg = f'Could not load font from {APP.FONT_FILE_PATH}'
+        raise RuntimeError(error_msg)
+
+    return font_id
+
+
 @enum.unique
 class SLIDER_TYPE(enum.Enum):
     h = 0
@@ -40,6 +69,12 @@ class HSBWidget(QtWidgets.QWidget):
         self._h = 0
         self._s = 0
         self._v = 0
+        self._color_style = None
+
+        # Dragging restyles the swatch at most once per screen refresh
+        self._restyle_timer = QtCore.QTimer(self)
+        self._restyle_timer.setSingleShot(True)
+        self._restyle_timer.setInterval(refresh_interval_msec())
 
         self._setup_ui()
         self._connect_signals()
@@ -50,8 +85,13 @@ class HSBWidget(QtWidgets.QWidget):
 
     @color.setter
     def color(self, color):
+        color = tuple(color)
+        if color == self.color:
+            return
+
+        # The sliders follow right away, the swatch on the next restyle
         self._h, self._s, self._v = color
-        self._update_color_info()
+        self._schedule_restyle()
         for slider, val in zip(
                 [self._h_slider, self._s_slider, self._v_slider],
                 list(color),
@@ -89,10 +129,7 @@ class HSBWidget(QtWidgets.QWidget):
         self._color_text_label = QtWidgets.QLabel()
         self._color_text_label.setFixedHeight(14)
         self._color_text_label.setAlignment(QtCore.Qt.AlignLeft)
-        font_id = QtGui.QFontDatabase().addApplicationFont(APP.FONT_FILE_PATH)
-        if font_id == -1:
-            error_msg = f'Could not load font from {APP.FONT_FILE_PATH}'
-            raise RuntimeError(error_msg)
+        load_app_font()
         font = QtGui.QFont(APP.FONT_FAMILY)
         font.setPointSize(12)
         self._color_text_label.setFont(font)
@@ -125,6 +162,8 @@ class HSBWidget(QtWidgets.QWidget):
         return self._slider_group_layout
 
     def _connect_signals(self):
+        self._restyle_timer.timeout.connect(self._update_color_info)
+
         self._h_slider.valueChanged.connect(
             partial(
                 self._value_changed,
@@ -157,10 +196,14 @@ class HSBWidget(QtWidgets.QWidget):
             error_msg = f'SLIDER TYPE {slider_type} is not defined!!'
             raise ValueError(error_msg)
 
-        self._update_color_info()
+        self._schedule_restyle()
 
         self.COLOR_CHANGED_SIGNAL.emit((self._h, self._s, self._v))
 
+    def _schedule_restyle(self):
+        if not self._restyle_timer.isActive():
+            self._restyle_timer.start()
+
     def _get_color_style_string(self):
         return(
             'QWidget { background-color: '
@@ -175,8 +218,12 @@ class HSBWidget(QtWidgets.QWidget):
         )
 
     def _update_color_info(self):
+        # Setting a style sheet restyles the label, even with the same
+        # string
         color_style = self._get_color_style_string()
-        self._color_label.setStyleSheet(color_style)
+        if color_style != self._color_style:
+            self._color_label.setStyleSheet(color_style)
+            self._color_style = color_style
         color_text = self._get_color_text_string()
         self._color_text_label.setText(color_text)
 
@@ -214,6 +261,105 @@ class HSBWidget(QtWidgets.QWidget):
         return layout, label, slider
 
 
+class ImageViewerWidget(QtWidgets.QWidget):
+    BORDER_COLOR = QtGui.QColor('#5A5A5A')
+    REGION_COLOR = QtGui.QColor('#E0E0E0')
+
+    def __init__(self, recorder=None, parent=None):
+        super().__init__(parent=parent)
+        self._recorder = recorder or PerfRecorder()
+
+        # `_image` may point straight into `_frame`, so the array has to
+        # live at least as long as the image wrapping it
+        self._image = QtGui.QImage()
+        self._frame = None
+        self._frame_timestamp = None
+        self._region = None
+
+        self.setAttribute(QtCore.Qt.WA_OpaquePaintEvent)
+        self.setMinimumSize(APP.IMAGE_WIDTH, APP.IMAGE_HEIGHT)
+
+    @property
+    def image(self):
+        return self._image
+
+    def set_region(self, region):
+        # `(x, y, width, height)` in fractions of the image, outlined over
+        # it until set back to `None`
+        self._region = region
+        self.update()
+
+    def set_image(self, image):
+        previous_frame = self._frame
+        self._frame = None
+        self._frame_timestamp = None
+        self._image = image
+        self.update()
+
+        return previous_frame
+
+    def set_frame(self, frame, timestamp=None):
+        # Wrap the RGB buffer without copying it, the only copy left is
+        # the one Qt makes when drawing into the backing store. With the
+        # `timestamp` the frame was captured at, the first paint records
+        # the latency from capture to screen
+        height, width = frame.shape[:2]
+        image = QtGui.QImage(
+            frame.data,
+            width,
+            height,
+            frame.strides[0],
+            QtGui.QImage.Format_RGB888,
+        )
+
+        previous_frame = self._frame
+        self._frame = frame
+        self._frame_timestamp = timestamp
+        self._image = image
+        self.update()
+
+        return previous_frame
+
+    def paintEvent(self, event):
+        timer = self._recorder.timer()
+
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.black)
+
+        if not self._image.isNull():
+            x = (self.width() - self._image.width()) // 2
+            y = (self.height() - self._image.height()) // 2
+            painter.drawImage(x, y, self._image)
+
+            if self._region is not None:
+                width = self._image.width()
+                height = self._image.height()
+                region_x, region_y, region_width, region_height = (
+                    self._region
+                )
+                painter.setPen(
+                    QtGui.QPen(self.REGION_COLOR, 2, QtCore.Qt.DashLine)
+                )
+                painter.drawRect(
+                    x + int(region_x * width),
+                    y + int(region_y * height),
+                    int(region_width * width),
+                    int(region_height * height),
+                )
+
+        painter.setPen(self.BORDER_COLOR)
+        painter.drawRect(self.rect().adjusted(0, 0, -1, -1))
+        painter.end()
+
+        timer.lap('paint')
+
+        if self._frame_timestamp is not None and self._recorder.enabled:
+            self._recorder.add(
+                'latency', time.perf_counter() - self._frame_timestamp,
+            )
+        self._frame_timestamp = None
+
+
 class ColorBandWidget(QtWidgets.QFrame):
     LOW_COLOR_CHANGED_SIGNAL = QtCore.Signal(tuple)
     HIGH_COLOR_CHANGED_SIGNAL = QtCore.Signal(tuple)
@@ -0,0 +1,18 @@
+from PySide2 import QtCore
+
+
+class StreamSignals(QtCore.QObject):
+    # Streams run on pool threads, their callbacks are re-emitted as
+    # signals so the GUI slots run queued on the GUI thread
+    FRAME_READY_SIGNAL = QtCore.Signal(object)
+    BACKGROUND_CAPTURED_SIGNAL = QtCore.Signal(object)
+    STATE_CHANGED_SIGNAL = QtCore.Signal(object, object, str)
+    CALIBRATED_SIGNAL = QtCore.Signal(object, object, str)
+
+    def attach(self, stream):
+        stream.set_callbacks(
+            frame_ready=self.FRAME_READY_SIGNAL.emit,
+            state_changed=self.STATE_CHANGED_SIGNAL.emit,
+            background_captured=self.BACKGROUND_CAPTURED_SIGNAL.emit,
+            calibrated=self.CALIBRATED_SIGNAL.emit,
+        )
@@ -0,0 +1,833 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import tracemalloc
+
+
+import cv2
+import numpy as np
+
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+)
+from cvcloak import opencv  # noqa: E402
+from cvcloak import autocalib  # noqa: E402
+from cvcloak import calib  # noqa: E402
+from cvcloak import profiles  # noqa: E402
+from cvcloak import sources  # noqa: E402
+from cvcloak import session  # noqa: E402
+
+
+RESOLUTIONS = ('640x480', '1280x720', '1920x1080')
+MASK_SCALES = (0.5, 0.25)
+TEMPORAL_FRAMES = (3, 8)
+SESSION_STREAMS = (1, 2, 4)
+
+
+def open_source(frames):
+    source = sources.ArraySource(frames, loop=True)
+    source.open()
+    return source
+
+
+def parse_resolution(resolution):
+    width, height = (int(value) for value in resolution.split('x'))
+    return width, height
+
+
+def create_background(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    background = rng.integers(40, 200, (height, width, 3), np.uint8)
+    return cv2.GaussianBlur(background, (31, 31), 0)
+
+
+def create_frames(background, count=30, seed=1):
+    # A red disc crosses the background while sensor noise changes
+    # every frame, like a cloak held in front of a static camera
+    rng = np.random.default_rng(seed)
+    height, width = background.shape[:2]
+    radius = height // 5
+    frames = []
+    for index in range(count):
+        frame = background.copy()
+        center_x = int(radius + (width - 2 * radius) * index / count)
+        cv2.circle(frame, (center_x, height // 2), radius, (20, 20, 220), -1)
+        noise = rng.integers(-4, 5, frame.shape, np.int16)
+        frames.append(
+            np.clip(frame + noise, 0, 255).astype(np.uint8)
+        )
+
+    return frames
+
+
+def create_flicker_frames(background, count=30, seed=2):
+    # A still disc whose saturation sits on the band edge, the noise
+    # alone decides which pixels pass the threshold from frame to frame
+    rng = np.random.default_rng(seed)
+    height, width = background.shape[:2]
+    center = (width // 2, height // 2)
+    static = background.copy()
+    cv2.circle(static, center, height // 5, (90, 90, 220), -1)
+    cloak_mask = np.zeros((height, width), np.uint8)
+    cv2.circle(cloak_mask, center, height // 5, 255, -1)
+
+    frames = []
+    for _ in range(count):
+        noise = rng.integers(-24, 25, static.shape, np.int16)
+        frames.append(
+            np.clip(static + noise, 0, 255).astype(np.uint8)
+        )
+
+    return frames, cloak_mask
+
+
+def default_bands():
+    return calib.Calibration().bands
+
+
+def legacy_stages(background, bands):
+    # Mirrors `opencv.get_frame` and `opencv._process_capture` one call
+    # at a time so every stage can be timed on its own
+    low_color_1, high_color_1, low_color_2, high_color_2 = bands
+    kernel = np.ones((3, 3), np.uint8)
+
+    def hsv_convert(state):
+        state['frame'] = cv2.cvtColor(state['frame'], cv2.COLOR_BGR2HSV)
+
+    def flip(state):
+        state['frame'] = cv2.flip(state['frame'], 1)
+
+    def in_range_1(state):
+        state['band_1'] = cv2.inRange(
+            state['frame'],
+            np.array(list(low_color_1)),
+            np.array(list(high_color_1)),
+        )
+
+    def in_range_2(state):
+        state['band_2'] = cv2.inRange(
+            state['frame'],
+            np.array(list(low_color_2)),
+            np.array(list(high_color_2)),
+        )
+
+    def combine(state):
+        state['mask'] = state['band_1'] + state['band_2']
+
+    def morph_open(state):
+        state['mask'] = cv2.morphologyEx(
+            state['mask'], cv2.MORPH_OPEN, kernel, iterations=8,
+        )
+
+    def dilate(state):
+        state['mask'] = cv2.morphologyEx(
+            state['mask'], cv2.MORPH_DILATE, kernel, iterations=1,
+        )
+
+    def composite(state):
+        mask = state['mask']
+        masked_bg = cv2.bitwise_and(background, background, mask=mask)
+        inverse_mask = cv2.bitwise_not(mask)
+        masked_frame = cv2.bitwise_and(
+            state['frame'], state['frame'], mask=inverse_mask,
+        )
+        state['frame'] = cv2.addWeighted(masked_bg, 1, masked_frame, 1, 0)
+
+    def hsv_to_rgb(state):
+        state['frame'] = cv2.cvtColor(state['frame'], cv2.COLOR_HSV2RGB)
+
+    return [
+        ('hsv_convert', hsv_convert),
+        ('flip', flip),
+        ('in_range_1', in_range_1),
+        ('in_range_2', in_range_2),
+        ('combine', combine),
+        ('morph_open', morph_open),
+        ('dilate', dilate),
+        ('composite', composite),
+        ('hsv_to_rgb', hsv_to_rgb),
+    ]
+
+
+def pipelines(frames, background, bands):
+    hsv_background = cv2.cvtColor(background, cv2.COLOR_BGR2HSV)
+
+    def get_frame():
+        capture = open_source(frames)
+
+        def run():
+            opencv.get_frame(
+                capture=capture,
+                background=hsv_background,
+                low_color_1=bands[0],
+                high_color_1=bands[1],
+                low_color_2=bands[2],
+                high_color_2=bands[3],
+            )
+        return run
+
+    def processor(**processor_options):
+        def create():
+            reader = opencv.FrameReader(open_source(frames))
+            cloak_processor = opencv.CloakProcessor(
+                background=background,
+                **processor_options,
+            )
+            cloak_processor.set_bands(*bands)
+
+            def run():
+                cloak_processor.process(reader.read(), in_place=True)
+            return run
+        return create
+
+    return [
+        ('get_frame', get_frame),
+        ('processor', processor()),
+        ('processor_lut', processor(mask_mode=opencv.MASK_MODE.LUT)),
+        ('processor_bgr_out', processor(output_code=None)),
+        ('processor_feather', processor(feather=4)),
+        ('processor_roi', processor(roi=True)),
+        ('processor_feather_roi', processor(feather=4, roi=True)),
+        (
+            'processor_temporal',
+            processor(temporal_frames=8, open_iterations=3),
+        ),
+    ] + [
+        (f'processor_scale_{scale}', processor(mask_scale=scale))
+        for scale in MASK_SCALES
+    ]
+
+
+def mask_quality(frames, background, bands):
+    # Scaled masks against the full resolution mask of the same frames
+    def create(**processor_options):
+        cloak_processor = opencv.CloakProcessor(
+            background=background,
+            **processor_options,
+        )
+        cloak_processor.set_bands(*bands)
+        return cloak_processor
+
+    reference = create()
+    scaled = {scale: create(mask_scale=scale) for scale in MASK_SCALES}
+    totals = {scale: [0, 0, 0] for scale in MASK_SCALES}
+
+    for frame in frames:
+        reference.process(frame)
+        reference_mask = reference.mask > 0
+        for scale, cloak_processor in scaled.items():
+            cloak_processor.process(frame)
+            mask = cloak_processor.mask > 0
+            totals[scale][0] += np.count_nonzero(mask & reference_mask)
+            totals[scale][1] += np.count_nonzero(mask | reference_mask)
+            totals[scale][2] += np.count_nonzero(mask ^ reference_mask)
+
+    pixel_count = len(frames) * frames[0].shape[0] * frames[0].shape[1]
+    return {
+        f'mask_scale_{scale}': {
+            'iou': intersection / union if union else 1.0,
+            'mismatch_pct': 100.0 * mismatch / pixel_count,
+        }
+        for scale, (intersection, union, mismatch) in totals.items()
+    }
+
+
+def mask_stability(background, bands):
+    # Share of the pixels whose final mask flips between consecutive
+    # frames of a still scene, how much of the cloak it covers and the
+    # cost per frame to get there
+    frames, cloak_mask = create_flicker_frames(background)
+    cloak_pixels = np.count_nonzero(cloak_mask)
+    hsv_background = cv2.cvtColor(background, cv2.COLOR_BGR2HSV)
+
+    # Every variant is a timed `run(frame)` and the untimed `mask(frame)`
+    # it produced. The legacy path keeps its mask to itself, the same
+    # mask is built again outside the timing
+    def legacy():
+        def run(frame):
+            opencv._process_capture(
+                frame=cv2.cvtColor(frame, cv2.COLOR_BGR2HSV),
+                background=hsv_background,
+                low_color_1=bands[0],
+                high_color_1=bands[1],
+                low_color_2=bands[2],
+                high_color_2=bands[3],
+            )
+
+        def mask(frame):
+            return legacy_mask(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV), bands)
+        return run, mask
+
+    def processor(**processor_options):
+        cloak_processor = opencv.CloakProcessor(
+            background=background,
+            **processor_options,
+        )
+        cloak_processor.set_bands(*bands)
+
+        def mask(frame):
+            return cloak_processor.mask
+        return cloak_processor.process, mask
+
+    variants = [
+        ('legacy', legacy()),
+        ('processor', processor()),
+        ('processor_open_3', processor(open_iterations=3)),
+    ] + [
+        (
+            f'temporal_{temporal_frames}_open_3',
+            processor(temporal_frames=temporal_frames, open_iterations=3),
+        )
+        for temporal_frames in TEMPORAL_FRAMES
+    ]
+
+    results = {}
+    pixel_count = frames[0].shape[0] * frames[0].shape[1]
+    for name, (run, frame_mask) in variants:
+        flips = []
+        covered = []
+        timings = []
+        previous_mask = None
+        for frame in frames:
+            start_time = time.perf_counter()
+            run(frame)
+            timings.append(time.perf_counter() - start_time)
+            mask = frame_mask(frame)
+            covered.append(np.count_nonzero(mask & cloak_mask))
+            if previous_mask is not None:
+                flips.append(np.count_nonzero(mask != previous_mask))
+            previous_mask = mask.copy()
+
+        results[name] = {
+            'flicker_pct': 100.0 * float(np.mean(flips)) / pixel_count,
+            'coverage_pct': 100.0 * float(np.mean(covered)) / cloak_pixels,
+            'cost_ms': 1000.0 * float(np.median(timings)),
+        }
+
+    return results
+
+
+def raw_masks(frames, bands):
+    masks = []
+    for frame in frames:
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        masks.append(
+            cv2.bitwise_or(
+                cv2.inRange(hsv, np.array(bands[0]), np.array(bands[1])),
+                cv2.inRange(hsv, np.array(bands[2]), np.array(bands[3])),
+            )
+        )
+
+    return masks
+
+
+def benchmark_morphology(frames, bands, count, warmup):
+    masks = raw_masks(frames, bands)
+    work_mask = np.empty_like(masks[0])
+    results = {}
+    for strategy in opencv.MORPH_STRATEGY:
+        if strategy == opencv.MORPH_STRATEGY.AUTO:
+            continue
+
+        morphology = opencv.MorphologyFilter(strategy=strategy)
+        mask = masks[0].copy()
+
+        def run(index):
+            np.copyto(mask, masks[index % len(masks)])
+            start_time = time.perf_counter()
+            morphology.apply(mask, work_mask)
+            return time.perf_counter() - start_time
+
+        for index in range(warmup):
+            run(index)
+        timings = [run(index) for index in range(count)]
+        results[strategy.name.lower()] = summarize(timings, 0)
+
+    return results
+
+
+def benchmark_calibration_switch(frames, background, count, warmup):
+    # Frames processed right after a calibration change, with the tables
+    # built on the spot and taken from prebuilt profiles, and frames also
+    # sampled for auto calibration
+    calibrations = [calib.Calibration(), calib.Calibration().with_hue(120)]
+    profile_tables = [
+        profiles.Profile('benchmark', calibration).tables
+        for calibration in calibrations
+    ]
+    processor = opencv.CloakProcessor(
+        background=background, mask_mode=opencv.MASK_MODE.LUT,
+    )
+    processor.set_band_tables(profile_tables[0])
+
+    def rebuild(index):
+        processor.set_band_tables(
+            opencv.BandTables(calibrations[index % 2].bands)
+        )
+
+    def switch(index):
+        processor.set_band_tables(profile_tables[index % 2])
+
+    calibrator = autocalib.AutoCalibrator(frame_count=count + warmup)
+
+    def sample(index):
+        calibrator.add(frames[index % len(frames)])
+
+    results = {}
+    for name, change in (
+            ('steady', None), ('rebuild', rebuild), ('profile', switch),
+            ('auto_sample', sample),
+    ):
+        def run(index):
+            frame = frames[index % len(frames)]
+            start_time = time.perf_counter()
+            if change is not None:
+                change(index)
+            processor.process(frame)
+            return time.perf_counter() - start_time
+
+        for index in range(warmup):
+            run(index)
+        timings = [run(index) for index in range(count)]
+        results[name] = summarize(timings, 0)
+
+    return results
+
+
+def legacy_mask(hsv, bands):
+    # The mask `_process_capture` builds before compositing
+    color_mask = (
+        cv2.inRange(hsv, np.array(bands[0]), np.array(bands[1]))
+        + cv2.inRange(hsv, np.array(bands[2]), np.array(bands[3]))
+    )
+    color_mask = cv2.morphologyEx(
+        color_mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8), iterations=8,
+    )
+    return cv2.morphologyEx(
+        color_mask, cv2.MORPH_DILATE, np.ones((3, 3), np.uint8),
+        iterations=1,
+    )
+
+
+def verify_morphology(frames, background, bands):
+    # Every strategy has to reproduce the mask of `_process_capture`
+    # exactly and select frame and background pixels with it, on the
+    # synthetic frames and on empty, full and border touching masks. The
+    # same goes for every strategy in ROI mode
+    height, width = background.shape[:2]
+    edge_masks = [
+        np.zeros((height, width), np.uint8),
+        np.full((height, width), 255, np.uint8),
+        np.pad(
+            np.full((height - 4, width - 4), 255, np.uint8),
+            2,
+        ),
+    ]
+
+    results = {}
+    for strategy, roi in itertools.product(
+            opencv.MORPH_STRATEGY, (False, True),
+    ):
+        cloak_processor = opencv.CloakProcessor(
+            background=background,
+            morph_strategy=strategy,
+            roi=roi,
+        )
+        cloak_processor.set_bands(*bands)
+        bgr_processor = opencv.CloakProcessor(
+            background=background,
+            output_code=None,
+            morph_strategy=strategy,
+            roi=roi,
+        )
+        bgr_processor.set_bands(*bands)
+        bgr_out = np.empty_like(background)
+
+        matches = []
+        for frame in frames[::5]:
+            mask = legacy_mask(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV), bands)
+            expected_bgr = np.where(mask[..., None] > 0, background, frame)
+            expected = cv2.cvtColor(expected_bgr, cv2.COLOR_BGR2RGB)
+            result = cloak_processor.process(frame).copy()
+            in_place_result = cloak_processor.process(
+                frame.copy(), in_place=True,
+            )
+            # A passed in buffer is filled even when composited in place
+            bgr_result = bgr_processor.process(
+                frame.copy(), out=bgr_out, in_place=True,
+            )
+            matches.append(
+                np.array_equal(mask, cloak_processor.mask)
+                and np.array_equal(expected, result)
+                and np.array_equal(expected, in_place_result)
+                and bgr_result is bgr_out
+                and np.array_equal(expected_bgr, bgr_out)
+            )
+
+        reference = opencv.MorphologyFilter(
+            strategy=opencv.MORPH_STRATEGY.ITERATE,
+        )
+        morphology = opencv.MorphologyFilter(strategy=strategy)
+        for edge_mask in edge_masks:
+            expected = reference.apply(
+                edge_mask.copy(), np.empty_like(edge_mask),
+            )
+            result = morphology.apply(
+                edge_mask.copy(), np.empty_like(edge_mask),
+            )
+            matches.append(np.array_equal(expected, result))
+
+        name = strategy.name.lower() + ('_roi' if roi else '')
+        results[name] = {'match': float(all(matches))}
+
+    return results
+
+
+def verify_roi(frames, background, bands):
+    # ROI mode has to give the frame and mask of the whole frame pipeline
+    # with a scaled mask, a feathered edge, with no cloak in sight and
+    # with a cloak too thin to survive the opening but at the border
+    border_frame = background.copy()
+    border_frame[:, -4:] = (20, 20, 220)
+    results = {}
+    for mask_scale, feather in itertools.product((1.0, 0.5), (0, 4)):
+        processors = []
+        for roi in (False, True):
+            cloak_processor = opencv.CloakProcessor(
+                background=background,
+                mask_scale=mask_scale,
+                feather=feather,
+                roi=roi,
+            )
+            cloak_processor.set_bands(*bands)
+            processors.append(cloak_processor)
+
+        matches = []
+        for frame in frames[::5] + [background, border_frame]:
+            expected, result = [
+                cloak_processor.process(frame).copy()
+                for cloak_processor in processors
+            ]
+            matches.append(
+                np.array_equal(expected, result)
+                and np.array_equal(processors[0].mask, processors[1].mask)
+            )
+
+        name = f'roi_scale_{mask_scale}_feather_{feather}'
+        results[name] = {'match': float(all(matches))}
+
+    return results
+
+
+def benchmark_session(frames, calibration, count):
+    # Synthetic streams through one session manager, how the throughput
+    # of each stream holds up as streams share the pool
+    results = {}
+    for stream_count in SESSION_STREAMS:
+        manager = session.SessionManager()
+        streams = []
+        for _ in range(stream_count):
+            stream = manager.add_stream(
+                sources.ArraySource(frames, loop=True),
+                background_delay=0.0,
+                background_frames=5,
+            )
+            stream.set_calibration(calibration)
+            streams.append(stream)
+
+        manager.start()
+        start_time = time.perf_counter()
+        try:
+            while any(
+                    stream.frame_count < count
+                    and stream.state != session.CAPTURE_STATE.FAILED
+                    for stream in streams
+            ):
+                time.sleep(0.01)
+        finally:
+            elapsed = time.perf_counter() - start_time
+            manager.stop()
+
+        frame_count = sum(stream.frame_count for stream in streams)
+        results[f'streams_{stream_count}'] = {
+            'workers': manager.workers,
+            'stream_fps': frame_count / elapsed / stream_count,
+            'total_fps': frame_count / elapsed,
+        }
+
+    return results
+
+
+def summarize(timings, allocated):
+    timings = np.asarray(timings) * 1000.0
+    mean = float(timings.mean())
+    return {
+        'fps': 1000.0 / mean if mean else 0.0,
+        'mean_ms': mean,
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'alloc_kb_per_frame': allocated / 1024.0,
+    }
+
+
+def measure_allocated(run, count):
+    # Peak traced memory above the starting point, per call
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(count):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - current
+    finally:
+        tracemalloc.stop()
+
+    return total / count
+
+
+def benchmark_stages(frames, background, bands, count, warmup):
+    hsv_background = cv2.cvtColor(background, cv2.COLOR_BGR2HSV)
+    stages = legacy_stages(hsv_background, bands)
+    timings = {name: [] for name, _ in stages}
+    allocated = {name: 0 for name, _ in stages}
+
+    def run_stages(index, record):
+        state = {'frame': frames[index % len(frames)].copy()}
+        for name, stage in stages:
+            start_time = time.perf_counter()
+            stage(state)
+            if record:
+                timings[name].append(time.perf_counter() - start_time)
+
+    for index in range(warmup):
+        run_stages(index, record=False)
+    for index in range(count):
+        run_stages(index, record=True)
+
+    for name, stage in stages:
+        state = {'frame': frames[0].copy()}
+        for stage_name, stage_func in stages:
+            if stage_name == name:
+                break
+            stage_func(state)
+        allocated[name] = measure_allocated(
+            lambda stage=stage, state=state: stage(dict(state)),
+            count=min(count, 10),
+        )
+
+    return {
+        name: summarize(timings[name], allocated[name])
+        for name, _ in stages
+    }
+
+
+def benchmark_pipelines(frames, background, bands, count, warmup):
+    results = {}
+    for name, create in pipelines(frames, background, bands):
+        run = create()
+        for _ in range(warmup):
+            run()
+
+        timings = []
+        for _ in range(count):
+            start_time = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start_time)
+
+        allocated = measure_allocated(run, count=min(count, 10))
+        results[name] = summarize(timings, allocated)
+
+    return results
+
+
+def run_benchmark(resolutions, count, warmup):
+    bands = default_bands()
+    results = {}
+    for resolution in resolutions:
+        width, height = parse_resolution(resolution)
+        background = create_background(width, height)
+        frames = create_frames(background)
+
+        results[resolution] = {
+            'stages': benchmark_stages(
+                frames, background, bands, count, warmup,
+            ),
+            'pipelines': benchmark_pipelines(
+                frames, background, bands, count, warmup,
+            ),
+            'quality': mask_quality(frames, background, bands),
+            'stability': mask_stability(background, bands),
+            'morphology': benchmark_morphology(
+                frames, bands, count, warmup,
+            ),
+            'calibration': benchmark_calibration_switch(
+                frames, background, count, warmup,
+            ),
+            'verify': {
+                **verify_morphology(frames, background, bands),
+                **verify_roi(frames, background, bands),
+            },
+            'session': benchmark_session(frames, calib.Calibration(), count),
+        }
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'frames': count,
+        },
+        'results': results,
+    }
+
+
+def find_regressions(report, baseline, threshold):
+    regressions = []
+    for resolution, groups in report['results'].items():
+        baseline_groups = baseline['results'].get(resolution, {})
+        for group, entries in groups.items():
+            baseline_entries = baseline_groups.get(group, {})
+            for name, entry in entries.items():
+                baseline_entry = baseline_entries.get(name)
+                if baseline_entry is None or 'p50_ms' not in entry:
+                    continue
+
+                limit = baseline_entry['p50_ms'] * (1.0 + threshold)
+                if entry['p50_ms'] > limit:
+                    regressions.append(
+                        f'{resolution} {group}/{name}: '
+                        f'p50 {entry["p50_ms"]:.3f} ms > '
+                        f'{limit:.3f} ms '
+                        f'(baseline {baseline_entry["p50_ms"]:.3f} ms)'
+                    )
+
+    return regressions
+
+
+def find_mismatches(report):
+    return [
+        f'{resolution} verify/{name}'
+        for resolution, groups in report['results'].items()
+        for name, entry in groups.get('verify', {}).items()
+        if not entry['match']
+    ]
+
+
+def format_report(report):
+    lines = []
+    for resolution, groups in report['results'].items():
+        lines.append(resolution)
+        for group, entries in groups.items():
+            lines.append(f'  {group}')
+            for name, entry in entries.items():
+                if 'p50_ms' not in entry:
+                    lines.append(
+                        f'    {name:<24}'
+                        + ''.join(
+                            f'{key} {value:>8.4f}  '
+                            for key, value in entry.items()
+                        )
+                    )
+                    continue
+
+                lines.append(
+                    f'    {name:<24}'
+                    f'{entry["fps"]:>10.1f} fps'
+                    f'{entry["p50_ms"]:>9.3f} ms p50'
+                    f'{entry["p99_ms"]:>9.3f} ms p99'
+                    f'{entry["alloc_kb_per_frame"]:>11.1f} KB/frame'
+                )
+
+    return '\n'.join(lines)
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the cvcloak frame pipeline headless.',
+    )
+    parser.add_argument(
+        '--resolutions',
+        nargs='+',
+        default=list(RESOLUTIONS),
+        metavar='WxH',
+        help='Frame sizes to benchmark (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--frames',
+        type=int,
+        default=200,
+        help='Timed frames per resolution (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--warmup',
+        type=int,
+        default=20,
+        help='Untimed frames per resolution (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--output',
+        help='Write the JSON report to this file',
+    )
+    parser.add_argument(
+        '--baseline',
+        help='JSON report to compare against',
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.2,
+        help=(
+            'Allowed p50 slowdown against the baseline, as a fraction '
+            '(default: %(default)s)'
+        ),
+    )
+
+    return parser
+
+
+def main(argv=None):
+    args = _create_parser().parse_args(argv)
+
+    report = run_benchmark(
+        resolutions=args.resolutions,
+        count=args.frames,
+        warmup=args.warmup,
+    )
+    sys.stdout.write(format_report(report) + '\n')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    mismatches = find_mismatches(report)
+    for mismatch in mismatches:
+        sys.stdout.write(f'MISMATCH {mismatch}\n')
+
+    if mismatches:
+        return 1
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = find_regressions(report, baseline, args.threshold)
+        for regression in regressions:
+            sys.stdout.write(f'REGRESSION {regression}\n')
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,16 +4,29 @@ import subprocess
 
 
 def main():
+    failed = []
     for root, dirs, files in os.walk(
             os.path.abspath(os.path.dirname(__file__))):
+        # Compiled copies of the scripts are not tests of their own
+        dirs[:] = [d for d in dirs if d != '__pycache__']
         for file in files:
             fp = os.path.join(root, file)
-            if fp == __file__ or not file.startswith('test'):
+            if (
+                    fp == __file__
+                    or not file.startswith('test')
+                    or not file.endswith('.py')
+            ):
                 continue
             sys.stdout.write('Running tests for "{0}"\n'.format(fp))
-            subprocess.call(['python', fp])
+            if subprocess.call([sys.executable, fp]):
+                failed.append(fp)
             sys.stdout.write('\n')
 
+    for fp in failed:
+        sys.stdout.write('FAILED "{0}"\n'.format(fp))
+
+    return 1 if failed else 0
+
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
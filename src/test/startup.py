@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+APP_SCRIPT = os.path.join(SRC_DIR, 'scripts', 'cvcloak')
+ENTRY_MODULES = (
+    'cvcloak',
+    'cvcloak.cli',
+    'cvcloak.app',
+    'cvcloak.mainwindow',
+    'cvcloak.batch',
+    'cvcloak.server',
+)
+STARTUP_STAGES = ('splash', 'window', 'first_frame')
+
+
+def child_env(**extra):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [SRC_DIR, env.get('PYTHONPATH')])
+    )
+    if not env.get('DISPLAY') and not env.get('WAYLAND_DISPLAY'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    env.update(extra)
+    return env
+
+
+def parse_importtime(output):
+    # `-X importtime` writes one `self | cumulative | name` line per
+    # module, nested imports are indented two spaces per level and come
+    # before the module that imported them
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append(
+            (name.strip(), depth, int(self_us), int(cumulative_us))
+        )
+
+    return modules
+
+
+def package_imports(modules, package='cvcloak'):
+    # Only the trees under the package's own top level imports count, the
+    # interpreter's start up is not ours
+    imports = []
+    subtree = []
+    for name, depth, self_us, cumulative_us in modules:
+        subtree.append((name, depth, self_us, cumulative_us))
+        if depth:
+            continue
+
+        if name.split('.')[0] == package:
+            imports.extend(subtree)
+        subtree = []
+
+    return imports
+
+
+def profile_import(module, runs, top):
+    totals = []
+    heaviest = {}
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            env=child_env(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        modules = package_imports(parse_importtime(result.stderr))
+
+        totals.append(
+            sum(
+                cumulative_us
+                for _, depth, _, cumulative_us in modules
+                if depth == 0
+            ) / 1000.0
+        )
+        for name, _, _, cumulative_us in modules:
+            if '.' in name or name == 'cvcloak':
+                continue
+            heaviest.setdefault(name, []).append(cumulative_us / 1000.0)
+
+    heaviest = sorted(
+        (
+            (name, statistics.median(samples))
+            for name, samples in heaviest.items()
+        ),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:top]
+
+    return {
+        'import_ms': statistics.median(totals),
+        'heaviest': dict(heaviest),
+    }
+
+
+def create_clip(directory, count=30, width=640, height=480):
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    for index in range(count):
+        frame = rng.integers(40, 200, (height, width, 3), np.uint8)
+        cv2.imwrite(os.path.join(directory, f'{index:04d}.png'), frame)
+
+
+def _read_stages(stream, start, stages):
+    # The app reports `startup <stage> <ms>ms` lines on stderr, the
+    # arrival time also counts the interpreter starting up
+    for line in stream:
+        parts = line.split()
+        if len(parts) != 3 or parts[0] != 'startup':
+            continue
+        stages[parts[1]] = (
+            float(parts[2].rstrip('ms')),
+            (time.perf_counter() - start) * 1000.0,
+        )
+
+
+def measure_startup(source, timeout):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, APP_SCRIPT, '--source', source, '--loop'],
+        env=child_env(CVCLOAK_STARTUP='1'),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    stages = {}
+    reader = threading.Thread(
+        target=_read_stages,
+        args=(process.stderr, start, stages),
+        daemon=True,
+    )
+    reader.start()
+
+    deadline = start + timeout
+    while 'first_frame' not in stages and time.perf_counter() < deadline:
+        if process.poll() is not None:
+            break
+        time.sleep(0.01)
+
+    process.terminate()
+    try:
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    reader.join(timeout=1)
+
+    return stages
+
+
+def profile_startup(source, runs, timeout):
+    samples = {}
+    for _ in range(runs):
+        for stage, times in measure_startup(source, timeout).items():
+            samples.setdefault(stage, []).append(times)
+
+    return {
+        stage: {
+            'app_ms': statistics.median(t[0] for t in samples[stage]),
+            'wall_ms': statistics.median(t[1] for t in samples[stage]),
+        }
+        for stage in STARTUP_STAGES
+        if stage in samples
+    }
+
+
+def run_profile(runs, top, source, timeout):
+    imports = {
+        module: profile_import(module, runs, top)
+        for module in ENTRY_MODULES
+    }
+
+    clip_dir = None
+    if source is None:
+        clip_dir = tempfile.mkdtemp(prefix='cvcloak_startup_')
+        create_clip(clip_dir)
+        source = clip_dir
+    try:
+        startup = profile_startup(source, runs, timeout)
+    finally:
+        if clip_dir is not None:
+            shutil.rmtree(clip_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'runs': runs,
+        },
+        'imports': imports,
+        'startup': startup,
+    }
+
+
+def find_slow_stages(report, target_ms):
+    # The splash is the first pixel on screen, the first frame also waits
+    # for the background capture so it is reported but has no target
+    splash = report['startup'].get('splash')
+    if splash is None:
+        return ['startup/splash: no splash reported']
+
+    if splash['wall_ms'] > target_ms:
+        return [
+            f'startup/splash: {splash["wall_ms"]:.1f} ms > '
+            f'{target_ms:.1f} ms'
+        ]
+
+    return []
+
+
+def format_report(report):
+    lines = ['imports']
+    for module, entry in report['imports'].items():
+        lines.append(f'  {module:<24}{entry["import_ms"]:>9.1f} ms')
+        for name, ms in entry['heaviest'].items():
+            lines.append(f'    {name:<22}{ms:>9.1f} ms')
+
+    lines.append('startup')
+    for stage, entry in report['startup'].items():
+        lines.append(
+            f'  {stage:<24}'
+            f'{entry["app_ms"]:>9.1f} ms app'
+            f'{entry["wall_ms"]:>9.1f} ms wall'
+        )
+
+    return '\n'.join(lines)
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        description=(
+            'Profile the imports of the cvcloak entry points and the time '
+            'to the first pixel of the app.'
+        ),
+    )
+    parser.add_argument(
+        '--runs',
+        type=int,
+        default=5,
+        help=(
+            'Cold starts per measurement, the median is kept '
+            '(default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=5,
+        help='Heaviest imports listed per entry point (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--source',
+        help='Source for the app, a generated clip by default',
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=30.0,
+        help='Seconds to wait for the first frame (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--target-ms',
+        type=float,
+        default=500.0,
+        help=(
+            'Slowest allowed time from launch to the splash screen '
+            '(default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--output',
+        help='Write the JSON report to this file',
+    )
+
+    return parser
+
+
+def main(argv=None):
+    args = _create_parser().parse_args(argv)
+
+    report = run_profile(
+        runs=args.runs,
+        top=args.top,
+        source=args.source,
+        timeout=args.timeout,
+    )
+    sys.stdout.write(format_report(report) + '\n')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    slow_stages = find_slow_stages(report, args.target_ms)
+    for slow_stage in slow_stages:
+        sys.stdout.write(f'SLOW {slow_stage}\n')
+
+    return 1 if slow_stages else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
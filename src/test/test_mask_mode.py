@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+
+
+import numpy as np
+
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+)
+from cvcloak import calib  # noqa: E402
+from cvcloak import opencv  # noqa: E402
+
+
+class MaskModeTest(unittest.TestCase):
+    def test_lut_matches_in_range(self):
+        # Every HSV value shows up in the random frames, the red bands
+        # meet at the hue wrap-around
+        rng = np.random.default_rng(0)
+        frames = [
+            rng.integers(0, 256, (120, 160, 3), np.uint8) for _ in range(4)
+        ]
+        background = np.zeros_like(frames[0])
+        calibrations = [calib.Calibration()] + [
+            calib.Calibration().with_hue(hue) for hue in (0, 60, 120, 300)
+        ]
+
+        for calibration in calibrations:
+            processors = []
+            for mask_mode in (opencv.MASK_MODE.IN_RANGE, opencv.MASK_MODE.LUT):
+                cloak_processor = opencv.CloakProcessor(
+                    background=background,
+                    output_code=None,
+                    mask_mode=mask_mode,
+                )
+                cloak_processor.set_bands(*calibration.bands)
+                processors.append(cloak_processor)
+
+            for index, frame in enumerate(frames):
+                with self.subTest(hue=calibration.hue, frame=index):
+                    expected, result = [
+                        cloak_processor.process(frame).copy()
+                        for cloak_processor in processors
+                    ]
+                    np.testing.assert_array_equal(
+                        processors[1].mask, processors[0].mask,
+                    )
+                    np.testing.assert_array_equal(result, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
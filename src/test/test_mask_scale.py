@@ -0,0 +1,68 @@
+import os
+import sys
+import unittest
+
+
+import cv2
+import numpy as np
+
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+)
+from cvcloak import calib  # noqa: E402
+from cvcloak import opencv  # noqa: E402
+
+
+class MaskScaleTest(unittest.TestCase):
+    def test_zero_iterations_stay_off(self):
+        # Without opening and dilation the mask is the band mask itself
+        rng = np.random.default_rng(0)
+        frame = rng.integers(0, 256, (120, 160, 3), np.uint8)
+        bands = calib.Calibration().bands
+        cloak_processor = opencv.CloakProcessor(
+            background=np.zeros_like(frame),
+            output_code=None,
+            open_iterations=0,
+            dilate_iterations=0,
+        )
+        cloak_processor.set_bands(*bands)
+        cloak_processor.process(frame)
+
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        expected = cv2.bitwise_or(
+            cv2.inRange(hsv, np.array(bands[0]), np.array(bands[1])),
+            cv2.inRange(hsv, np.array(bands[2]), np.array(bands[3])),
+        )
+        np.testing.assert_array_equal(cloak_processor.mask, expected)
+
+    def test_iterations_scale_with_the_mask(self):
+        for mask_scale in (1.0, 0.5, 0.3):
+            for open_iterations, dilate_iterations, expected in (
+                    (0, 0, (0, 0)),
+                    (0, 1, (0, 1)),
+                    (1, 0, (1, 1)),
+                    (8, 1, (
+                        max(1, round(8 * mask_scale)),
+                        max(1, round(8 * mask_scale)) + 1,
+                    )),
+            ):
+                with self.subTest(
+                        mask_scale=mask_scale,
+                        open_iterations=open_iterations,
+                        dilate_iterations=dilate_iterations,
+                ):
+                    cloak_processor = opencv.CloakProcessor(
+                        open_iterations=open_iterations,
+                        dilate_iterations=dilate_iterations,
+                        mask_scale=mask_scale,
+                    )
+                    morphology = cloak_processor._morphology
+                    self.assertEqual(
+                        (morphology.erode_radius, morphology.dilate_radius),
+                        expected,
+                    )
+
+
+if __name__ == '__main__':
+    unittest.main()
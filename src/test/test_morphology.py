@@ -0,0 +1,70 @@
+import os
+import sys
+import unittest
+
+
+import cv2
+import numpy as np
+
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+)
+from cvcloak import opencv  # noqa: E402
+
+
+def create_masks(width=160, height=120, count=6, seed=0):
+    # Blobs and speckle, with empty, full and border touching masks, the
+    # cases the faster strategies have to agree on
+    rng = np.random.default_rng(seed)
+    masks = [
+        np.zeros((height, width), np.uint8),
+        np.full((height, width), 255, np.uint8),
+        np.pad(np.full((height - 4, width - 4), 255, np.uint8), 2),
+    ]
+    for _ in range(count):
+        mask = np.where(rng.random((height, width)) < 0.05, 255, 0)
+        mask = mask.astype(np.uint8)
+        for _ in range(3):
+            center = (
+                int(rng.integers(0, width)), int(rng.integers(0, height)),
+            )
+            radius = int(rng.integers(5, height // 2))
+            cv2.circle(mask, center, radius, 255, -1)
+        mask[:, -3:] = 255
+        masks.append(mask)
+
+    return masks
+
+
+class MorphologyTest(unittest.TestCase):
+    def test_strategies_match_iterate(self):
+        for open_iterations, dilate_iterations in ((8, 1), (3, 1), (1, 2)):
+            reference = opencv.MorphologyFilter(
+                open_iterations, dilate_iterations,
+                strategy=opencv.MORPH_STRATEGY.ITERATE,
+            )
+            for strategy in (
+                    opencv.MORPH_STRATEGY.RECT,
+                    opencv.MORPH_STRATEGY.DISTANCE,
+                    opencv.MORPH_STRATEGY.AUTO,
+            ):
+                morphology = opencv.MorphologyFilter(
+                    open_iterations, dilate_iterations, strategy=strategy,
+                )
+                for index, mask in enumerate(create_masks()):
+                    with self.subTest(
+                            strategy=strategy.name, mask=index,
+                            open_iterations=open_iterations,
+                    ):
+                        expected = reference.apply(
+                            mask.copy(), np.empty_like(mask),
+                        )
+                        result = morphology.apply(
+                            mask.copy(), np.empty_like(mask),
+                        )
+                        np.testing.assert_array_equal(result, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import os
+import sys
+import itertools
+import unittest
+
+
+import cv2
+import numpy as np
+
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+)
+from cvcloak import calib  # noqa: E402
+from cvcloak import opencv  # noqa: E402
+
+
+CLOAK_COLOR = (20, 20, 220)
+
+
+def create_frames(background, seed=0):
+    # Cloak patches of every size, speckle, a strip too narrow for the
+    # opening that survives it at the border, a line that does not, and a
+    # frame without any cloak
+    rng = np.random.default_rng(seed)
+    height, width = background.shape[:2]
+    frames = [background.copy()]
+    for _ in range(5):
+        frame = background.copy()
+        for _ in range(int(rng.integers(1, 4))):
+            center = (
+                int(rng.integers(0, width)), int(rng.integers(0, height)),
+            )
+            radius = int(rng.integers(3, height // 3))
+            cv2.circle(frame, center, radius, CLOAK_COLOR, -1)
+
+        speckle = rng.random((height, width)) < 0.02
+        frame[speckle] = CLOAK_COLOR
+        frame[:, -12:] = CLOAK_COLOR
+        frame[int(rng.integers(0, height)), :width // 2] = CLOAK_COLOR
+        frames.append(frame)
+
+    return frames
+
+
+def _inside(point, regions):
+    x, y = point
+    return any(
+        left <= x < right and top <= y < bottom
+        for left, top, right, bottom in regions
+    )
+
+
+class RegionsTest(unittest.TestCase):
+    def test_merge_regions(self):
+        for regions, expected in (
+                ([], []),
+                # Apart, overlapping and touching
+                ([(0, 0, 4, 4), (6, 0, 9, 4)], [(0, 0, 4, 4), (6, 0, 9, 4)]),
+                ([(0, 0, 4, 4), (2, 2, 6, 6)], [(0, 0, 6, 6)]),
+                ([(0, 0, 4, 4), (4, 0, 8, 2)], [(0, 0, 8, 4)]),
+                # The box of the first two reaches the third
+                (
+                    [(0, 0, 4, 4), (3, 3, 10, 5), (8, 0, 12, 1)],
+                    [(0, 0, 12, 5)],
+                ),
+        ):
+            with self.subTest(regions=regions):
+                self.assertEqual(opencv._merge_regions(regions), expected)
+
+    def test_mask_regions(self):
+        mask = np.zeros((60, 80), np.uint8)
+        self.assertEqual(opencv.mask_regions(mask, 2, 3), [])
+
+        # A blob away from the border grows by the margin, a line thinner
+        # than the erosion is left out
+        mask[20:30, 30:40] = 255
+        mask[50, :] = 255
+        self.assertEqual(
+            opencv.mask_regions(mask, 2, 3), [(27, 17, 43, 33)],
+        )
+
+        # A blob close by merges with it, the margin is cut at the border
+        mask[32:40, 0:36] = 255
+        self.assertEqual(
+            opencv.mask_regions(mask, 2, 3), [(0, 17, 43, 43)],
+        )
+
+    def test_mask_regions_cover_erosion(self):
+        # Whatever the erosion keeps, the border counting as set, lies in
+        # a region, and the regions do not touch
+        rng = np.random.default_rng(4)
+        for index, frame in enumerate(
+                create_frames(np.zeros((120, 160, 3), np.uint8), seed=5)
+        ):
+            mask = np.where(
+                np.all(frame == CLOAK_COLOR, axis=2), 255, 0,
+            ).astype(np.uint8)
+            for radius in (1, 3, int(rng.integers(4, 8))):
+                with self.subTest(frame=index, radius=radius):
+                    regions = opencv.mask_regions(mask, radius, 0)
+                    eroded = cv2.erode(
+                        mask, np.ones((2 * radius + 1,) * 2, np.uint8),
+                    )
+                    for y, x in zip(*np.nonzero(eroded)):
+                        self.assertTrue(_inside((x, y), regions))
+                    self.assertEqual(
+                        opencv._merge_regions(regions), regions,
+                    )
+
+
+class RoiTest(unittest.TestCase):
+    def test_roi_matches_whole_frame(self):
+        rng = np.random.default_rng(1)
+        background = rng.integers(40, 200, (120, 160, 3), np.uint8)
+        background[..., 2] = np.minimum(background[..., 2], 100)
+        frames = create_frames(background)
+        bands = calib.Calibration().bands
+
+        for strategy, mask_scale, feather, temporal_frames in (
+                itertools.product(
+                    opencv.MORPH_STRATEGY, (1.0, 0.5, 0.3), (0, 3), (0, 4),
+                )
+        ):
+            processors = []
+            for roi in (False, True):
+                cloak_processor = opencv.CloakProcessor(
+                    background=background,
+                    output_code=None,
+                    morph_strategy=strategy,
+                    mask_scale=mask_scale,
+                    feather=feather,
+                    temporal_frames=temporal_frames,
+                    roi=roi,
+                )
+                cloak_processor.set_bands(*bands)
+                processors.append(cloak_processor)
+
+            for index, frame in enumerate(frames):
+                with self.subTest(
+                        strategy=strategy.name, mask_scale=mask_scale,
+                        feather=feather, temporal_frames=temporal_frames,
+                        frame=index,
+                ):
+                    expected, result = [
+                        cloak_processor.process(frame.copy()).copy()
+                        for cloak_processor in processors
+                    ]
+                    np.testing.assert_array_equal(
+                        processors[1].mask, processors[0].mask,
+                    )
+                    np.testing.assert_array_equal(result, expected)
+
+    def test_roi_in_place(self):
+        # Composited on the frame itself only the regions are written
+        rng = np.random.default_rng(2)
+        background = rng.integers(40, 200, (120, 160, 3), np.uint8)
+        background[..., 2] = np.minimum(background[..., 2], 100)
+        bands = calib.Calibration().bands
+
+        processors = []
+        for roi in (False, True):
+            cloak_processor = opencv.CloakProcessor(
+                background=background, roi=roi,
+            )
+            cloak_processor.set_bands(*bands)
+            processors.append(cloak_processor)
+
+        for index, frame in enumerate(create_frames(background, seed=3)):
+            with self.subTest(frame=index):
+                expected, result = [
+                    cloak_processor.process(frame.copy(), in_place=True)
+                    for cloak_processor in processors
+                ]
+                np.testing.assert_array_equal(result, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()